@@ -25,5 +25,8 @@ setup(
                       "scipy",
                       "Pillow",
                       "networkx",
-                      "sk-video"]
+                      "sk-video"],
+    entry_points={
+        "console_scripts": ["blockmatching=blockmatching.batch:main"],
+    },
 )
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- Coding: UTF-8 -*-
+"""
+Offline benchmarks of the block matching package.
+
+All the inputs are synthetic frames, so no video file is needed. Each case
+is timed after a warm up call, which also triggers the numba compilation,
+and the results are written as JSON.
+
+Usage
+-----
+
+    python bench.py --output results.json
+    python bench.py --quick --baseline results.json --tolerance 0.2
+
+With ``--baseline`` the median of each case is compared with the median of
+the same case in the baseline file, and the script exits with status 1 if
+any case is slower than the baseline by more than the tolerance.
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+import numba
+import numpy
+from numpy import float32, float64, uint8, median
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from blockmatching import (block_matching, BackgroundSubtractor, clustering,
+                           layers, vectormask, dlayers, forecasting,
+                           translated_pair, moving_squares)
+
+
+FULL = {
+    'sizes': [(240, 320), (480, 640), (1080, 1920)],
+    'blocks': [3, 9, 17],
+    'dtypes': [uint8, float32, float64],
+    'frames': 30,
+    'repeat': 5,
+}
+
+QUICK = {
+    'sizes': [(120, 160), (240, 320)],
+    'blocks': [9],
+    'dtypes': [uint8],
+    'frames': 8,
+    'repeat': 3,
+}
+
+
+def timed(func, repeat):
+    "Run func once to warm up and return the time of repeat calls."
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def result(name, params, times):
+    "Summary of the times of one case."
+    return {'name': name,
+            'params': params,
+            'repeat': len(times),
+            'min': min(times),
+            'median': float(median(times)),
+            'mean': sum(times) / len(times)}
+
+
+def key(case):
+    "Identifier of a case, used to compare with a baseline."
+    return case['name'] + json.dumps(case['params'], sort_keys=True)
+
+
+def bench_block_matching(config, threads):
+    "block_matching across frame sizes, block sizes, dtypes and threads."
+    out = []
+    default_threads = numba.get_num_threads()
+    for nthreads in threads:
+        numba.set_num_threads(nthreads)
+        for shape in config['sizes']:
+            for block in config['blocks']:
+                for dtype in config['dtypes']:
+                    img0, img1 = translated_pair(shape, 1, -1)
+                    img0 = img0.astype(dtype)
+                    img1 = img1.astype(dtype)
+                    times = timed(lambda: block_matching(img0, img1, block,
+                                                         block),
+                                  config['repeat'])
+                    params = {'shape': list(shape), 'block': block,
+                              'dtype': numpy.dtype(dtype).name,
+                              'threads': nthreads}
+                    out.append(result('block_matching', params, times))
+    numba.set_num_threads(default_threads)
+    return out
+
+
+def bench_specialized(config):
+    "Generic and block size specialized kernels, with the gain of each size."
+    out = []
+    for shape in config['sizes']:
+        img0, img1 = translated_pair(shape, 1, -1)
+        for block in config['blocks']:
+            for metric in ('clamped', 'sad', 'zncc'):
+                params = {'shape': list(shape), 'block': block,
+                          'metric': metric}
+                generic = timed(lambda: block_matching(img0, img1, block,
+                                                       block, metric=metric),
+                                config['repeat'])
+                fast = timed(lambda: block_matching(img0, img1, block, block,
+                                                    metric=metric,
+                                                    specialize=True),
+                             config['repeat'])
+                out.append(result('block_matching[generic]', params,
+                                  generic))
+                out.append(result('block_matching[specialized]', params,
+                                  fast))
+                out[-1]['gain'] = float(median(generic) / median(fast))
+    return out
+
+
+def bench_stages(config):
+    "Each stage of the pipelines on a sequence of moving squares."
+    out = []
+    for shape in config['sizes']:
+        frames = list(moving_squares(config['frames'], shape))
+
+        def foreground():
+            background = BackgroundSubtractor(0.01, frames[0])
+            for frame in frames[1:]:
+                background.foreground(frame)
+
+        # The background stage does not depend on the block size.
+        times = timed(foreground, config['repeat'])
+        times = [t / (len(frames) - 1) for t in times]
+        out.append(result('BackgroundSubtractor.foreground',
+                          {'shape': list(shape)}, times))
+
+        for block in config['blocks']:
+            params = {'shape': list(shape), 'block': block}
+
+            XP, YP, XD, YD = block_matching(frames[0], frames[1], block,
+                                            block)
+            times = timed(lambda: clustering(XD, YD, XP, YP),
+                          config['repeat'])
+            out.append(result('clustering', params, times))
+
+            U, V, object_tops, meand = clustering(XD, YD, XP, YP)
+            times = timed(lambda: layers(frames[1], object_tops, block,
+                                         block),
+                          config['repeat'])
+            out.append(result('layers', params, times))
+
+            times = timed(lambda: vectormask(frames[1], XD, YD,
+                                             (XD + U).astype(int),
+                                             (YD + V).astype(int)),
+                          config['repeat'])
+            out.append(result('vectormask', params, times))
+    return out
+
+
+def bench_pipelines(config):
+    "Full dlayers and forecasting pipelines, time per frame."
+    out = []
+    for shape in config['sizes']:
+        frames = list(moving_squares(config['frames'], shape))
+        for block in config['blocks']:
+            params = {'shape': list(shape), 'block': block}
+
+            @dlayers(0.01, block, block, 7)
+            def motion():
+                for frame in frames:
+                    yield frame
+
+            @forecasting(60, 1, 0.01, block, block, 7)
+            def forecast():
+                for frame in frames:
+                    yield frame
+
+            for name, pipeline in (('dlayers', motion),
+                                   ('forecasting', forecast)):
+                times = timed(lambda: list(pipeline()), config['repeat'])
+                times = [t / len(frames) for t in times]
+                out.append(result(name, params, times))
+    return out
+
+
+def compare(results, baseline, tolerance):
+    "Cases slower than the baseline by more than the tolerance."
+    reference = {key(case): case for case in baseline['results']}
+    regressions = []
+    for case in results:
+        old = reference.get(key(case))
+        if old is None:
+            continue
+        ratio = case['median'] / old['median']
+        if ratio > 1.0 + tolerance:
+            regressions.append((key(case), old['median'], case['median'],
+                                ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--output', default='bench_output.json',
+                        help='JSON file with the results.')
+    parser.add_argument('--quick', action='store_true',
+                        help='Small frames and few repetitions.')
+    parser.add_argument('--threads', type=int, nargs='*',
+                        help='Thread counts for block matching. '
+                             'Default: 1 and all the cores.')
+    parser.add_argument('--only', nargs='*',
+                        choices=['matching', 'specialized', 'stages',
+                                 'pipelines'],
+                        default=['matching', 'specialized', 'stages',
+                                 'pipelines'])
+    parser.add_argument('--baseline', help='JSON file from a previous run.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed slow down relative to the baseline.')
+    args = parser.parse_args(argv)
+
+    config = QUICK if args.quick else FULL
+    threads = args.threads
+    if not threads:
+        threads = sorted({1, numba.config.NUMBA_NUM_THREADS})
+
+    results = []
+    if 'matching' in args.only:
+        results += bench_block_matching(config, threads)
+    if 'specialized' in args.only:
+        results += bench_specialized(config)
+    if 'stages' in args.only:
+        results += bench_stages(config)
+    if 'pipelines' in args.only:
+        results += bench_pipelines(config)
+
+    report = {
+        'meta': {'date': datetime.now().isoformat(),
+                 'python': platform.python_version(),
+                 'numpy': numpy.__version__,
+                 'numba': numba.__version__,
+                 'platform': platform.platform(),
+                 'cpus': os.cpu_count(),
+                 'quick': args.quick},
+        'results': results,
+    }
+
+    with open(args.output, 'w') as jfile:
+        json.dump(report, jfile, indent=2)
+
+    for case in results:
+        gain = ' gain {:.2f}x'.format(case['gain']) if 'gain' in case else ''
+        print('{:<36} {:>10.6f} s  {}{}'.format(case['name'], case['median'],
+                                                json.dumps(case['params']),
+                                                gain))
+
+    if args.baseline:
+        with open(args.baseline) as jfile:
+            baseline = json.load(jfile)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, old, new, ratio in regressions:
+            print('REGRESSION {}: {:.6f} s -> {:.6f} s ({:.2f}x)'.format(
+                name, old, new, ratio))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
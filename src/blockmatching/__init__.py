@@ -39,11 +39,29 @@ estimation based on Artificial Bee Colony (ABC).
 Applied Soft Computing, v. 13, n. 6, p. 3047-3059, 2013.
 """
 
+from .motionfield import *
+from .counters import *
+from .framecache import *
+from .specialized import *
 from .blockmatching import *
+from .globalmotion import *
+from .incremental import *
+from .framering import *
+from .rawio import *
+from .tiled import *
+from .quadtree import *
+from .clusters import *
 from .clustering import *
 from .vectormask import *
 from .background import *
 from .motionlayers import *
+from .scaling import *
+from .pipelinestats import *
+from .realtime import *
+from .snapshot import *
 from .dlayers import *
+from .sharedpipeline import *
+from .asyncpipeline import *
 from .savevideo import *
 from .forecast import *
+from .synthetic import *
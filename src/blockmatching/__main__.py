@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Run the batch processing with ``python -m blockmatching``, see batch.
+"""
+import sys
+
+from .batch import main
+
+sys.exit(main())
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Asyncio pipelines for many live streams.
+
+The ``dlayers`` and ``forecasting`` decorators are synchronous generators: a
+frame takes the whole matching, clustering and layers time, which would
+block an event loop. :class:`AsyncMotionPipeline` runs the same pipeline as
+an async generator. Each frame is processed in a thread of an executor that
+is shared by every stream (the numba kernels release the GIL), while the
+event loop only awaits the result. The streams are parallel over the threads
+of the executor, so each one matches its frames with the serial kernels:
+the threaded kernels called from several threads would oversubscribe the
+cpus, and abort the process with the workqueue threading layer of numba.
+
+Backpressure is given by ``await``: a stream reads the next frame from its
+source only when the consumer asks for the next result, and the pipeline
+keeps at most ``max_pending`` frames, of all its streams, in the executor.
+A stream is cancelled by cancelling the task that iterates it or by closing
+its async generator; the frame being processed finishes in its thread and
+the state of the stream is released.
+
+The results are the ones of the synchronous decorators, frame by frame.
+With a latency budget the stale frames are skipped as in ``dlayers``: the
+thread that processes a frame reads the next ones until it yields.
+
+Example
+-------
+>>> import asyncio
+>>> from blockmatching import *
+>>>
+>>> @async_dlayers(alpha=0.01, width=9, height=9)
+>>> async def camera(url):
+>>>     async for frame in read_gray_frames(url):
+>>>         yield frame
+>>>
+>>> async def serve(url):
+>>>     async for bg, fg, mask, meand, layers in camera(url):
+>>>         await publish(url, meand)
+>>>
+>>> async def main(urls):
+>>>     await asyncio.gather(*(serve(url) for url in urls))
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import asyncio
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .dlayers import dlayers
+from .forecast import forecasting
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+_DONE = object()
+
+
+def shared_executor(max_workers=None):
+    r'''
+    Thread pool shared by the async pipelines of the process.
+
+    :param int max_workers: number of threads, used only when the pool is
+                            created by the first call. Default the number of
+                            cpus.
+
+    :return ThreadPoolExecutor: the shared pool.
+    '''
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(
+                max_workers=max_workers or os.cpu_count() or 1,
+                thread_name_prefix='blockmatching')
+        return _EXECUTOR
+
+
+class _Feed:
+    """
+    Iterator that returns the frame given to the pipeline, one at a time.
+
+    A pipeline with a latency budget skips the stale frames: it asks for
+    another frame before yielding. The frame is then read in the thread from
+    a synchronous source, or asked to the event loop for an async source.
+    """
+
+    def __init__(self, loop, iterator=None):
+        self.frame = _DONE
+        self._loop = loop
+        self._iterator = iterator
+        self._wanted = asyncio.Event()
+        self._given = queue.Queue()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        frame, self.frame = self.frame, _DONE
+        if frame is _DONE:
+            if self._iterator is not None:
+                frame = next(self._iterator, _DONE)
+            else:
+                self._loop.call_soon_threadsafe(self._wanted.set)
+                frame = self._given.get()
+        if frame is _DONE:
+            raise StopIteration
+        return frame
+
+    async def wanted(self):
+        "Wait until the pipeline asks for a frame."
+        await self._wanted.wait()
+        self._wanted.clear()
+
+    def give(self, frame):
+        "Give the frame asked, _DONE at the end of the source."
+        self._given.put(frame)
+
+
+def _step(pipeline, feed, frame):
+    "Process one frame in a thread of the executor, _DONE at the end."
+    feed.frame = frame
+    # A StopIteration can not be set on a future.
+    return next(pipeline, _DONE)
+
+
+def _next_frame(iterator):
+    "Read the next frame of a synchronous source in the executor."
+    return next(iterator, _DONE)
+
+
+class AsyncMotionPipeline:
+    r'''
+    Run ``dlayers`` or ``forecasting`` pipelines as async generators.
+
+    :param str kind: 'dlayers' (default) or 'forecasting'.
+    :param ThreadPoolExecutor executor: pool that runs the frames, default
+                                        the pool of :func:`shared_executor`.
+    :param int max_pending: largest number of frames, of all the streams of
+                            this pipeline, in the executor at the same time.
+                            Default the number of threads of the executor.
+    :param options: parameters of the decorator, as alpha, width, height,
+                    sigma, stats, or seconds and dt for 'forecasting'. A
+                    PipelineStats records as queue depth the frames of the
+                    streams waiting in the pipeline. parallel is False by
+                    default, the matching of each frame runs in its thread.
+
+    Each call to :meth:`stream` has its own background model and state.
+    '''
+
+    def __init__(self, kind='dlayers', executor=None, max_pending=None,
+                 **options):
+        options.setdefault('parallel', False)
+        if kind == 'dlayers':
+            self._decorator = dlayers(**options)
+        elif kind == 'forecasting':
+            self._decorator = forecasting(**options)
+        else:
+            raise ValueError("kind must be 'dlayers' or 'forecasting'.")
+
+        self.kind = kind
+        self.parallel = options['parallel']
+        self.executor = executor if executor is not None else \
+            shared_executor()
+        if max_pending is None:
+            max_pending = getattr(self.executor, '_max_workers', 1)
+        self.max_pending = max_pending
+        self._pending = None
+        self._waiting = 0
+        stats = options.get('stats')
+        if stats is not None and stats.queue is None:
+            stats.queue = self._queue_depth
+
+    def _queue_depth(self):
+        # Frames read from the sources and not finished, but the one that
+        # finishes.
+        return max(self._waiting - 1, 0)
+
+    def _semaphore(self):
+        # Created in the event loop that runs the streams.
+        if self._pending is None:
+            self._pending = asyncio.Semaphore(self.max_pending)
+        return self._pending
+
+    async def _frames(self, source):
+        if hasattr(source, '__aiter__'):
+            async for frame in source:
+                yield frame
+            return
+
+        loop = asyncio.get_running_loop()
+        iterator = iter(source)
+        while True:
+            frame = await loop.run_in_executor(self.executor, _next_frame,
+                                               iterator)
+            if frame is _DONE:
+                return
+            yield frame
+
+    async def _result(self, job, feed, frames):
+        "Wait for a frame, giving the pipeline the frames it asks for."
+        done = asyncio.wrap_future(job)
+        while True:
+            wanted = asyncio.ensure_future(feed.wanted())
+            await asyncio.wait((done, wanted),
+                               return_when=asyncio.FIRST_COMPLETED)
+            if done.done():
+                wanted.cancel()
+                return done.result()
+            try:
+                frame = await frames.__anext__()
+            except StopAsyncIteration:
+                frame = _DONE
+            feed.give(frame)
+
+    async def stream(self, source):
+        r'''
+        Process the frames of one stream.
+
+        :param source: iterable or async iterable of gray level frames.
+                       Synchronous sources are read in the executor.
+
+        :return: async generator with the results of the decorator for each
+                 frame.
+        '''
+        iterator = None
+        if not hasattr(source, '__aiter__'):
+            source = iterator = iter(source)
+        feed = _Feed(asyncio.get_running_loop(), iterator)
+        pipeline = self._decorator(lambda: feed)()
+        frames = self._frames(source)
+        job = None
+        try:
+            async for frame in frames:
+                self._waiting += 1
+                try:
+                    async with self._semaphore():
+                        job = self.executor.submit(_step, pipeline, feed,
+                                                   frame)
+                        result = await self._result(job, feed, frames)
+                        job = None
+                finally:
+                    self._waiting -= 1
+                if result is _DONE:
+                    # The last frames of the source were skipped.
+                    return
+                yield result
+        finally:
+            await frames.aclose()
+            if job is not None and not job.done():
+                # Cancelled while the frame runs in a thread, the
+                # generator can be closed only when the thread is done. A
+                # thread waiting for a frame gets the end of the source.
+                feed.give(_DONE)
+                job.add_done_callback(lambda _: pipeline.close())
+            else:
+                pipeline.close()
+
+    def __call__(self, source):
+        return self.stream(source)
+
+
+def async_dlayers(executor=None, max_pending=None, **options):
+    r'''
+    Async version of the dlayers decorator.
+
+    The decorated function returns an iterable or an async iterable of
+    frames, an async generator function for instance. The parameters are
+    the ones of :class:`AsyncMotionPipeline` and of ``dlayers``.
+
+    :return: async generator with background, foreground, vector mask, mean
+             velocity and layers of each frame.
+    '''
+    pipeline = AsyncMotionPipeline('dlayers', executor, max_pending,
+                                   **options)
+
+    def wrap(func):
+        def wrapped_func(*args, **kwargs):
+            return pipeline.stream(func(*args, **kwargs))
+        return wrapped_func
+    return wrap
+
+
+def async_forecasting(seconds, dt, executor=None, max_pending=None,
+                      **options):
+    r'''
+    Async version of the forecasting decorator.
+
+    The decorated function returns an iterable or an async iterable of
+    frames. The parameters are the ones of :class:`AsyncMotionPipeline` and
+    of ``forecasting``.
+
+    :return: async generator with frame, forecast, foreground and background
+             of each frame.
+    '''
+    pipeline = AsyncMotionPipeline('forecasting', executor, max_pending,
+                                   seconds=seconds, dt=dt, **options)
+
+    def wrap(func):
+        def wrapped_func(*args, **kwargs):
+            return pipeline.stream(func(*args, **kwargs))
+        return wrapped_func
+    return wrap
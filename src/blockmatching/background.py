@@ -62,11 +62,28 @@ IEEE, 2010. p. 270-272.
 
 """
 import cv2
-from numpy import uint8, logical_and
+from numpy import uint8, logical_and, empty_like
 from scipy.ndimage.filters import gaussian_filter
 from scipy.signal import medfilt2d
 
 
+def _median(image, ksize, out):
+    "Median filter of medfilt2d, zero padded, written in out."
+    if image.dtype != uint8 or out.dtype != uint8 or ksize % 2 == 0 or \
+            not out.flags.c_contiguous or ksize < 3:
+        out[...] = medfilt2d(image, kernel_size=ksize)
+        return out
+    # medianBlur replicates the borders, only they come from medfilt2d.
+    cv2.medianBlur(image, ksize, dst=out)
+    pad = ksize // 2
+    band = 2 * pad
+    out[:pad] = medfilt2d(image[:band], kernel_size=ksize)[:pad]
+    out[-pad:] = medfilt2d(image[-band:], kernel_size=ksize)[-pad:]
+    out[:, :pad] = medfilt2d(image[:, :band], kernel_size=ksize)[:, :pad]
+    out[:, -pad:] = medfilt2d(image[:, -band:], kernel_size=ksize)[:, -pad:]
+    return out
+
+
 class BackgroundSubtractor:
     r'''
     Background estimation and subtraction.
@@ -99,6 +116,36 @@ class BackgroundSubtractor:
         self._oldf = self._background.copy()
         self._threashold = threashold
 
+    def state(self):
+        r'''
+        State of the background model, to restore it with
+        :meth:`from_state`.
+
+        :return dict state: learning parameters, averaged background and
+                            last frame.
+        '''
+        return {'alpha': self.alpha, 'sgm': self._sgm,
+                'threashold': self._threashold,
+                'background': self._background, 'oldf': self._oldf}
+
+    @classmethod
+    def from_state(cls, state):
+        r'''
+        Background model saved by :meth:`state`, without learning it again
+        from a first frame.
+
+        :param dict state: state of a background model.
+
+        :return BackgroundSubtractor: the restored model.
+        '''
+        model = cls.__new__(cls)
+        model.alpha = state['alpha']
+        model._sgm = state['sgm']
+        model._threashold = state['threashold']
+        model._background = state['background']
+        model._oldf = state['oldf']
+        return model
+
     @property
     def background(self):
         r'''
@@ -108,7 +155,7 @@ class BackgroundSubtractor:
         '''
         return gaussian_filter(self._background.astype(uint8), sigma=self._sgm)
 
-    def foreground(self, frame):
+    def foreground(self, frame, out=None):
         r'''
         Get Foreground.
         Apply the background averaging formula:
@@ -121,6 +168,9 @@ class BackgroundSubtractor:
         the learning rate and :math:`frame_\{i\}` is the current frame.
 
         :param 2d_array frame: Current frame.
+        :param 2d_array out: optional array where the foreground is written,
+                             a slot of a FrameRing for instance. The median
+                             filter of uint8 frames writes in it directly.
 
         :return 2d_array foreground: the estimated foreground.
         '''
@@ -139,7 +189,8 @@ class BackgroundSubtractor:
         result = cv2.absdiff(self._background.astype(uint8), frame)
         result[result < self._threashold] = 0
         result[result > self._threashold] = 255
-        tmp = result.copy()
-        tmp[~logical_and(diff, result)] = 0
+        result[~logical_and(diff, result)] = 0
 
-        return medfilt2d(tmp, kernel_size=self._sgm)
+        if out is None:
+            out = empty_like(result)
+        return _median(result, self._sgm, out)
@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Batch processing of video files.
+
+The ``blockmatching`` console script runs the ``dlayers`` or the
+``forecasting`` pipeline over directories or glob patterns of videos, one
+video per process of a pool. Each worker limits the threads of numba and of
+OpenCV, so that the pool uses every core without oversubscribing them: by
+default the cores are divided among the workers.
+
+The outputs of a video are written in a folder with the name of the video,
+in chunks of frames:
+
+- ``motion-NNNNN.npz``: ``frames``, the index of each frame, and ``motion``,
+  int16 array (frames, 4, lines, columns) with the grids XP, YP, XD, YD of
+  the block matching of each frame with the previous one.
+- ``clusters-NNNNN.npz``: the moving objects of each frame, as the arrays of
+  :class:`Clusters` concatenated: ``frames``, ``objects`` (the objects of
+  the frame k are the ones from objects[k] to objects[k + 1]), ``offsets``,
+  ``rows``, ``cols``, ``displacement`` and ``bboxes``.
+- ``render-NNNNN.avi``: optional, the foreground with the vector field, or
+  with the forecast.
+- ``state-NNNNN.npz``: the :class:`PipelineState` after the chunk.
+- ``progress.json``: options, frames and chunks done.
+
+An interrupted run is resumed by running the same command again: the videos
+done are skipped and the others restart after their last chunk, from the
+saved pipeline state. A change of the options restarts the video.
+
+The frames converted once to a ``(N, H, W)`` ``.npy`` file, see rawio, are
+read through memory mapping, without decoding the video again.
+
+A single long recording is processed at multi-core speed with
+``--frame-workers``: the background subtraction runs in the worker of the
+video and the matching, the clustering and the layers of the frames run in
+parallel processes, see ``process_dlayers``.
+
+Example
+-------
+.. code-block:: bash
+
+    $ blockmatching /data/cam*/2019-06-01/ -o /data/motion --workers 8
+    $ blockmatching "/data/**/*.mp4" -o /data/forecast --pipeline forecast \\
+          --seconds 2 --render
+    $ blockmatching /data/archive.mp4 -o /data/motion --frame-workers 8
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
+
+import cv2
+import numba
+from numpy import array, concatenate, cumsum, empty, hstack, stack, zeros
+from numpy import savez_compressed, float64, int16, int32, int64
+
+from .dlayers import dlayers
+from .forecast import forecasting
+from .sharedpipeline import process_dlayers
+from .rawio import MemmapSource
+from .snapshot import PipelineState
+
+VIDEO_EXTENSIONS = ('.avi', '.mp4', '.mkv', '.mov', '.mpg', '.mpeg', '.m4v',
+                    '.wmv', '.npy')
+
+
+def find_videos(inputs, extensions=VIDEO_EXTENSIONS):
+    r'''
+    Video files of directories and glob patterns.
+
+    :param list inputs: files, directories or glob patterns.
+    :param tuple extensions: extensions of the videos in the directories.
+
+    :return list videos: the files found, in order, without repetitions.
+    '''
+    videos = []
+    for item in inputs:
+        if os.path.isdir(item):
+            found = [os.path.join(item, name)
+                     for name in sorted(os.listdir(item))
+                     if os.path.splitext(name)[1].lower() in extensions]
+        elif os.path.isfile(item):
+            found = [item]
+        else:
+            found = sorted(glob.glob(item, recursive=True))
+        for video in found:
+            if os.path.isfile(video) and video not in videos:
+                videos.append(video)
+    return videos
+
+
+def video_frames(path, start=0):
+    r'''
+    Gray frames of a video file.
+
+    :param str path: video file.
+    :param int start: number of frames skipped at the beginning.
+
+    :return generator: 2d uint8 arrays.
+    '''
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError("Can not open the video {}".format(path))
+    try:
+        for _ in range(start):
+            if not cap.grab():
+                return
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if frame.ndim == 3:
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            yield frame
+    finally:
+        cap.release()
+
+
+def limit_threads(threads):
+    r'''
+    Limit the threads of numba and OpenCV in this process.
+
+    :param int threads: number of threads.
+    '''
+    numba.set_num_threads(max(1, min(threads,
+                                     numba.config.NUMBA_NUM_THREADS)))
+    cv2.setNumThreads(threads)
+
+
+class _Chunk:
+    "Motion fields and objects of the frames of one chunk."
+
+    def __init__(self):
+        self.frames = []
+        self.motion = []
+        self.clusters = []
+
+    def add(self, index, motion, clusters):
+        self.frames.append(index)
+        self.motion.append(stack(motion).astype(int16))
+        self.clusters.append(clusters)
+
+    def motion_arrays(self):
+        return {'frames': array(self.frames, dtype=int64),
+                'motion': stack(self.motion)}
+
+    def cluster_arrays(self):
+        objects = zeros(len(self.clusters) + 1, dtype=int64)
+        objects[1:] = cumsum([len(c) for c in self.clusters])
+        counts = concatenate([c.counts for c in self.clusters])
+        offsets = zeros(counts.size + 1, dtype=int64)
+        offsets[1:] = cumsum(counts)
+        if counts.size > 0:
+            bboxes = concatenate([c.bboxes for c in self.clusters])
+            displacement = concatenate([c.displacement
+                                        for c in self.clusters])
+        else:
+            bboxes = empty((0, 4), dtype=int32)
+            displacement = empty((0, 2), dtype=float64)
+        return {'frames': array(self.frames, dtype=int64),
+                'objects': objects,
+                'offsets': offsets,
+                'rows': concatenate([c.rows for c in self.clusters]),
+                'cols': concatenate([c.cols for c in self.clusters]),
+                'displacement': displacement,
+                'bboxes': bboxes}
+
+
+class _Render:
+    "Rendered frames of one chunk, moved to its name when closed."
+
+    def __init__(self, path, fps):
+        self.path = path
+        self.tmp = path + '.tmp.avi'
+        self.fps = fps
+        self.writer = None
+
+    def write(self, image):
+        if self.writer is None:
+            self.writer = cv2.VideoWriter(self.tmp,
+                                          cv2.VideoWriter_fourcc(*'MJPG'),
+                                          self.fps,
+                                          (image.shape[1], image.shape[0]),
+                                          image.ndim == 3)
+        self.writer.write(image)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+            os.replace(self.tmp, self.path)
+
+
+def _write(path, save):
+    "Write a file with save(file), replacing path only when it is complete."
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as out:
+        save(out)
+    os.replace(tmp, path)
+
+
+def _save_npz(path, arrays):
+    _write(path, lambda out: savez_compressed(out, **arrays))
+
+
+def _save_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as out:
+        json.dump(data, out, indent=2)
+    os.replace(tmp, path)
+
+
+def _load_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as inp:
+        return json.load(inp)
+
+
+def _name(video):
+    return os.path.splitext(os.path.basename(video))[0]
+
+
+def process_video(video, outdir, pipeline='dlayers', alpha=0.01, width=9,
+                  height=9, sigma=7, seconds=1, dt=1, scale=1,
+                  velocity_tolerance=None, chunk=250, render=False, fps=25,
+                  force=False, frames=None, frame_workers=0):
+    r'''
+    Run a pipeline over a video and write its outputs, resuming the work of
+    an interrupted run.
+
+    :param str video: video file, or (N, H, W) .npy file of frames, read
+                      through memory mapping.
+    :param str outdir: the outputs are written in outdir/<video name>.
+    :param str pipeline: 'dlayers' or 'forecast'.
+    :param float alpha: background learning factor.
+    :param int width: width of the blocks.
+    :param int height: height of the blocks.
+    :param int sigma: smoothing of the layers.
+    :param float seconds: forecast time, for the forecast pipeline.
+    :param float dt: time between frames, for the forecast pipeline.
+    :param float scale: processing resolution, see dlayers.
+    :param int velocity_tolerance: velocity-aware clustering, see dlayers.
+    :param int chunk: number of frames of each output file. The progress is
+                      saved after each chunk.
+    :param bool render: write the rendered frames.
+    :param float fps: frames per second of the rendered videos.
+    :param bool force: process the video again from the beginning.
+    :param iterable frames: optional, frames to use instead of reading the
+                            video file.
+    :param int frame_workers: with more than 0, the frames of the video are
+                              processed in parallel by that many worker
+                              processes, see process_dlayers. Only for the
+                              dlayers pipeline at scale 1.
+
+    :return dict progress: video, options, frames, chunks and done, with
+                           the frames processed and the seconds spent by
+                           this call.
+    '''
+    if pipeline not in ('dlayers', 'forecast'):
+        raise ValueError("Unknown pipeline {}".format(pipeline))
+    if frame_workers > 0 and (pipeline != 'dlayers' or scale != 1):
+        raise ValueError("frame_workers needs the dlayers pipeline at "
+                         "scale 1.")
+    options = json.loads(json.dumps(dict(
+        pipeline=pipeline, alpha=alpha, width=width, height=height,
+        sigma=sigma, seconds=seconds, dt=dt, scale=scale,
+        velocity_tolerance=velocity_tolerance, chunk=chunk,
+        render=render)))
+
+    folder = os.path.join(outdir, _name(video))
+    os.makedirs(folder, exist_ok=True)
+    progress_file = os.path.join(folder, 'progress.json')
+    progress = _load_json(progress_file)
+    if force or progress is None or progress['options'] != options \
+            or progress['video'] != video:
+        progress = dict(video=video, options=options, frames=0, chunks=0,
+                        done=False, state=None)
+    progress.update(processed=0, seconds=0.0)
+    if progress['done']:
+        return progress
+
+    state = PipelineState()
+    if progress['state'] is not None:
+        state = PipelineState.load(os.path.join(folder, progress['state']))
+    start = progress['frames']
+    if frames is None and video.endswith('.npy'):
+        frames = MemmapSource(video).frames(start)
+    elif frames is None:
+        frames = video_frames(video, start)
+    else:
+        frames = islice(frames, start, None)
+
+    if frame_workers > 0:
+        decorator = process_dlayers(alpha, width, height, sigma,
+                                    workers=frame_workers,
+                                    velocity_tolerance=velocity_tolerance,
+                                    state=state)
+    elif pipeline == 'dlayers':
+        decorator = dlayers(alpha, width, height, sigma,
+                            velocity_tolerance=velocity_tolerance,
+                            scale=scale, state=state)
+    else:
+        decorator = forecasting(seconds, dt, alpha, width, height, sigma,
+                                velocity_tolerance=velocity_tolerance,
+                                scale=scale, state=state)
+    stream = decorator(lambda: frames)()
+
+    def checkpoint(done):
+        key = '{:05d}'.format(progress['chunks'])
+        if recorded.frames:
+            _save_npz(os.path.join(folder, 'motion-' + key + '.npz'),
+                      recorded.motion_arrays())
+            _save_npz(os.path.join(folder, 'clusters-' + key + '.npz'),
+                      recorded.cluster_arrays())
+        if rendered is not None:
+            rendered.close()
+        old = progress['state']
+        if state.ready:
+            progress['state'] = 'state-' + key + '.npz'
+            _write(os.path.join(folder, progress['state']), state.save)
+        progress.update(frames=state.frames, chunks=progress['chunks'] + 1,
+                        done=done,
+                        processed=state.frames - start,
+                        seconds=time.perf_counter() - began)
+        _save_json(progress_file, progress)
+        if old is not None and old != progress['state']:
+            os.remove(os.path.join(folder, old))
+
+    def new_chunk():
+        key = '{:05d}'.format(progress['chunks'])
+        if render:
+            return _Chunk(), _Render(os.path.join(folder, 'render-' + key +
+                                                  '.avi'), fps)
+        return _Chunk(), None
+
+    began = time.perf_counter()
+    recorded, rendered = new_chunk()
+    for out in stream:
+        index = state.frames - 1
+        if index > 0:
+            recorded.add(index, state.motion, state.clusters)
+        if rendered is not None and index > 0:
+            if pipeline == 'dlayers':
+                rendered.write(cv2.add(out[1], out[2]))
+            else:
+                rendered.write(hstack((out[2], out[1])))
+        if state.frames - progress['frames'] >= chunk:
+            checkpoint(False)
+            recorded, rendered = new_chunk()
+    checkpoint(True)
+    return progress
+
+
+def _run(video, outdir, options):
+    "Process one video, the errors are returned instead of raised."
+    try:
+        return process_video(video, outdir, **options)
+    except Exception:
+        return dict(video=video, done=False, error=traceback.format_exc())
+
+
+def run_batch(videos, outdir, workers=None, threads=None, context='spawn',
+              callback=None, **options):
+    r'''
+    Process videos in a pool of processes.
+
+    :param list videos: video files, with different names.
+    :param str outdir: output directory.
+    :param int workers: number of processes, default one per core, at most
+                        one per video. With 0 the videos are processed in
+                        this process.
+    :param int threads: numba and OpenCV threads of each worker, default the
+                        cores divided by the workers.
+    :param str context: multiprocessing start method, default 'spawn'.
+    :param callable callback: optional, called with the progress of each
+                              video when it finishes.
+    :param options: parameters of process_video.
+
+    :return list progress: the progress of each video, in order. A video
+                           that failed has the traceback in 'error'.
+    '''
+    names = [_name(video) for video in videos]
+    if len(set(names)) != len(names):
+        raise ValueError("The videos must have different names.")
+    cpus = os.cpu_count() or 1
+    if workers is None:
+        workers = max(1, min(cpus, len(videos)))
+    if threads is None:
+        threads = max(1, cpus // max(workers, 1))
+
+    results = {}
+    if workers == 0:
+        for video in videos:
+            results[video] = _run(video, outdir, options)
+            if callback is not None:
+                callback(results[video])
+    else:
+        ctx = multiprocessing.get_context(context)
+        with ProcessPoolExecutor(workers, mp_context=ctx,
+                                 initializer=limit_threads,
+                                 initargs=(threads,)) as pool:
+            futures = {pool.submit(_run, video, outdir, options): video
+                       for video in videos}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if callback is not None:
+                    callback(results[futures[future]])
+    return [results[video] for video in videos]
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='blockmatching',
+        description="Run the motion layers or the forecast pipeline over "
+                    "video files, writing the motion fields and the moving "
+                    "objects of each frame. Running the same command again "
+                    "resumes an interrupted run.")
+    parser.add_argument('inputs', nargs='+',
+                        help="video files, directories or glob patterns")
+    parser.add_argument('-o', '--output', required=True,
+                        help="output directory")
+    parser.add_argument('--pipeline', choices=('dlayers', 'forecast'),
+                        default='dlayers')
+    parser.add_argument('--alpha', type=float, default=0.01,
+                        help="background learning factor")
+    parser.add_argument('--width', type=int, default=9)
+    parser.add_argument('--height', type=int, default=9)
+    parser.add_argument('--sigma', type=int, default=7)
+    parser.add_argument('--seconds', type=float, default=1,
+                        help="forecast time")
+    parser.add_argument('--dt', type=float, default=1,
+                        help="time between frames of the forecast")
+    parser.add_argument('--scale', type=float, default=1,
+                        help="processing resolution, in (0, 1]")
+    parser.add_argument('--velocity-tolerance', type=int, default=None)
+    parser.add_argument('--chunk', type=int, default=250,
+                        help="frames of each output file")
+    parser.add_argument('--render', action='store_true',
+                        help="write the rendered frames")
+    parser.add_argument('--fps', type=float, default=25,
+                        help="frames per second of the rendered videos")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of processes, 0 to run in this one")
+    parser.add_argument('--threads', type=int, default=None,
+                        help="threads of each process")
+    parser.add_argument('--frame-workers', type=int, default=0,
+                        help="processes matching the frames of each video "
+                             "in parallel, for long videos")
+    parser.add_argument('--force', action='store_true',
+                        help="process again the videos already done")
+    return parser
+
+
+def main(argv=None):
+    r'''
+    Entry point of the blockmatching console script.
+
+    :param list argv: arguments, default sys.argv[1:].
+
+    :return int: exit status, 1 when a video failed.
+    '''
+    args = vars(_parser().parse_args(argv))
+    inputs = args.pop('inputs')
+    outdir = args.pop('output')
+    workers = args.pop('workers')
+    threads = args.pop('threads')
+
+    videos = find_videos(inputs)
+    if not videos:
+        print("No video found.", file=sys.stderr)
+        return 1
+    os.makedirs(outdir, exist_ok=True)
+
+    finished = []
+
+    def report(progress):
+        finished.append(progress)
+        head = "[{}/{}] {}".format(len(finished), len(videos),
+                                   progress['video'])
+        if 'error' in progress:
+            print(head + ": failed\n" + progress['error'], file=sys.stderr)
+        elif progress['processed'] == 0:
+            print(head + ": done before, skipped")
+        else:
+            print("{}: {} frames, {:.1f} frames/s".format(
+                head, progress['processed'],
+                progress['processed'] / max(progress['seconds'], 1e-9)))
+        sys.stdout.flush()
+
+    results = run_batch(videos, outdir, workers, threads, callback=report,
+                        **args)
+    return int(any('error' in progress for progress in results))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
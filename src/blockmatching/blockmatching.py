@@ -140,20 +140,20 @@ operational solar radiation forecasts in the US.  Solar Energy,
 84. 12. 2161-2172. 2010.
 """
 
-from numba import jitclass
-from numba import njit, prange, jit, float64, int64, uint8
+from numba import njit, prange, jit
+from numba import parallel_chunksize, get_num_threads
 
-from numpy import zeros, sqrt, array
+from numpy import zeros, ones, sqrt, asarray, ascontiguousarray
+from numpy import int64, uint8, float64
 import cv2
 
+from .motionfield import MotionField, displacement_dtype
+from .specialized import specialized_kernel
 
-TYPESSME = "float64[:](float64[:,:], float64[:,:], int64, int64)"
 
-TYPESME = "float64[:](float64[:,:], float64[:,:], int64, int64, int64, int64,"
-TYPESME += "int64, int64, int64, int64, int64, int64)"
-
-TYPEBBMATCHING = "int64[:,:](float64[:,:], float64[:,:], int64, int64, int64,"
-TYPEBBMATCHING += "int64, int64, int64 ,int64, int64,)"
+TYPEBBMATCHING = "int64[:,:](uint8[:,:], uint8[:,:], float64[:,:],"
+TYPEBBMATCHING += "float64[:,:], float64[:,:], int64, int64, int64, int64,"
+TYPEBBMATCHING += "int64, int64[:], int64[:,:], int64[:,:])"
 
 TYPEBMATCHING = "int64[:,:], int64[:,:], int64[:,:], int64[:,:](float64[:,:],"
 TYPEBMATCHING += "float64[:,:], int64, int64)"
@@ -175,140 +175,519 @@ class ImageSizeError(Exception):
         return repr(value)
 
 
-@njit(TYPESSME, nogil=True)
-def _ssme(window, block, height, width):
+@njit(nogil=True)
+def _cost_clamped(img0, img1, s1, q1, r0, c0, r1, c1, height, width, m0, n0):
     r'''
-    Compare the block in the window.
+    Sum of the differences candidate - block clamped to [0, 255].
     input:
-        window - 2d array representing the window
-        blcok - 2d array representing the block to match
-        height - int64 - height of block
-        width - int64 - height of block
+        img0 - 2d uint8 or float64 array - image with the block
+        img1 - 2d uint8 or float64 array - image with the candidate
+        s1, q1 - 2d float64 arrays - integral images of img1 (not used)
+        r0, c0 - int64 - first line and column of the block
+        r1, c1 - int64 - first line and column of the candidate
+        height, width - int64 - block size
+        m0, n0 - float64 - block mean and norm (not used)
     '''
-    out = zeros(3)
-    minval = 1e99
-    if block.shape[0] != height or block.shape[1] != width:
-        out[0] = height // 2
-        out[1] = width // 2
-        return out
+    diff = 0.0
+    for ki in range(height):
+        for kj in range(width):
+            val = float(img1[r1 + ki, c1 + kj]) - img0[r0 + ki, c0 + kj]
+            diff += min(max(val, 0.0), 255.0)
+    return diff
 
-    for ki in prange(height):
-        for kj in prange(width):
-            tmp = (window[ki: ki + height, kj: kj + width] - block).flatten()
-            diff = 0
-            for val in list(tmp):
-                if val < 0:
-                    val = 0
-                if val > 255:
-                    val = 255
-                diff += val
-            diff = diff / (height * width)
-
-            if ki == height // 2 and kj == width // 2:
-
-                # To Priorize the central region of window.
-                # Neighbors can have same value and false moviment is detected.
-                # To avoid, a diferent approach for center of window.
-                if diff <= minval:
-                    minval = diff
-                    out[0] = ki
-                    out[1] = kj
-                    out[2] = minval
-
-            if(diff < minval):
-                minval = diff
-                out[0] = ki
-                out[1] = kj
-                out[2] = minval
 
-    return out
+@njit(nogil=True)
+def _cost_sad(img0, img1, s1, q1, r0, c0, r1, c1, height, width, m0, n0):
+    r'''
+    Sum of absolute differences between block and candidate.
+    '''
+    diff = 0.0
+    for ki in range(height):
+        for kj in range(width):
+            diff += abs(float(img1[r1 + ki, c1 + kj]) - img0[r0 + ki, c0 + kj])
+    return diff
 
 
-@njit(TYPESME, nogil=True)
-def _sme(img1, img0, wblock, hblock, wwind, hwind,
-        width, height, i0, i1, j0, j1):
+@njit(nogil=True)
+def _cost_ssd(img0, img1, s1, q1, r0, c0, r1, c1, height, width, m0, n0):
+    r'''
+    Sum of squared differences between block and candidate.
     '''
-    Create window and blocks to matching searching.
-    input:
-        img0 - 2d float64 array - image in time t + idt
-        img1 - 2d float64 array - image in time t + (i +1 )dt
-        wblock - int64 - Number of blocks in width
-        hblock - int64 - Number of blocks in height
-        wwind - int64 - Window width
-        hwind - int64 - Window height
-        width - int64 - block width in pixels
-        height - int64 - block height in pixels
-        i0 - int64 - initial line of window
-        i1 - int64 - final line of window
-        j0 - int64 - initial column of window
-        j1 - int64 - final column of window
-    Return:
-        Integer array with four elements:
-            inital line, initial column,
-            final line, final column.
+    diff = 0.0
+    for ki in range(height):
+        for kj in range(width):
+            val = float(img1[r1 + ki, c1 + kj]) - img0[r0 + ki, c0 + kj]
+            diff += val * val
+    return diff
+
+
+@njit(nogil=True)
+def _cost_zncc(img0, img1, s1, q1, r0, c0, r1, c1, height, width, m0, n0):
+    r'''
+    One minus the zero-mean normalized cross-correlation of block and
+    candidate. The mean and norm of the candidate are read from the integral
+    images s1, q1 of img1; m0, n0 are the mean and norm of the block.
+    '''
+    n = height * width
+    sum1 = s1[r1 + height, c1 + width] - s1[r1, c1 + width] - \
+        s1[r1 + height, c1] + s1[r1, c1]
+    sq1 = q1[r1 + height, c1 + width] - q1[r1, c1 + width] - \
+        q1[r1 + height, c1] + q1[r1, c1]
+    norm1 = sq1 - sum1 * sum1 / n
+
+    cross = 0.0
+    for ki in range(height):
+        for kj in range(width):
+            cross += float(img1[r1 + ki, c1 + kj]) * img0[r0 + ki, c0 + kj]
+    cross -= m0 * sum1
+
+    denom = n0 * norm1
+    if denom <= 0.0:
+        return 1.0
+    return 1.0 - cross / sqrt(denom)
+
+
+@njit(nogil=True)
+def _prep_none(img0, r0, c0, height, width):
+    r'''
+    Block statistics not needed by the metric.
+    '''
+    return 0.0, 0.0
+
+
+@njit(nogil=True)
+def _prep_zncc(img0, r0, c0, height, width):
+    r'''
+    Mean and squared norm, around the mean, of the block.
     '''
-    out = zeros(4)
+    total = 0.0
+    sq = 0.0
+    for ki in range(height):
+        for kj in range(width):
+            val = float(img0[r0 + ki, c0 + kj])
+            total += val
+            sq += val * val
+    n = height * width
+    return total / n, sq - total * total / n
+
+
+@njit(nogil=True)
+def _rect(s, r, c, height, width):
+    r'''
+    Sum of the pixels of a rectangle, read from the integral image s.
+    '''
+    return s[r + height, c + width] - s[r, c + width] - \
+        s[r + height, c] + s[r, c]
 
-    window = img1[i0: i1, j0: j1]
 
-    jb0 = j0 + width // 2
-    jb1 = j0 + 3 * width // 2
+@njit(nogil=True)
+def _bound_clamped(diff, n):
+    r'''
+    Lower bound of the clamped cost of a region from the difference of the
+    sums candidate - block. Valid for pixels in [0, 255].
+    '''
+    return max(diff, 0.0)
 
-    ib0 = i0 + height // 2
-    ib1 = i0 + 3 * height // 2
-    block = img0[ib0: ib1, jb0: jb1]
 
-    tmp = _ssme(window, block, height, width)
-    out[0] = ib0
-    out[1] = jb0
-    out[2] = i0 + tmp[0]
-    out[3] = j0 + tmp[1]
-    return out
+@njit(nogil=True)
+def _bound_sad(diff, n):
+    r'''
+    Lower bound of the sum of absolute differences of a region.
+    '''
+    return abs(diff)
 
 
-@njit(TYPEBBMATCHING, parallel=True, nogil=True)
-def _block_matching(img0, img1, width, height, wblock, hblock,
-                    wwind, hwind, wwindt, hwindt):
+@njit(nogil=True)
+def _bound_ssd(diff, n):
+    r'''
+    Lower bound of the sum of squared differences of a region of n pixels,
+    by the Cauchy-Schwarz inequality.
+    '''
+    return diff * diff / n
+
+
+@njit(nogil=True)
+def _eliminated(bound, s0, s1, r0, c0, r1, c1, height, width, levels,
+                best):
+    r'''
+    Successive elimination of a candidate.
+
+    At the level l the block is split in 2**l x 2**l regions and the sum of
+    the bounds of the regions, read from the integral images s0 and s1, is a
+    lower bound of the cost that grows with l. The candidate can not win
+    when a bound reaches the best cost, as the ties keep the best one.
+    '''
+    for lev in range(levels + 1):
+        parts = 1 << lev
+        if parts > height or parts > width:
+            break
+        total = 0.0
+        for a in range(parts):
+            ra = (a * height) >> lev
+            ha = (((a + 1) * height) >> lev) - ra
+            for b in range(parts):
+                ca = (b * width) >> lev
+                wb = (((b + 1) * width) >> lev) - ca
+                diff = _rect(s1, r1 + ra, c1 + ca, ha, wb) - \
+                    _rect(s0, r0 + ra, c0 + ca, ha, wb)
+                total += bound(diff, ha * wb)
+        if total >= best:
+            return True
+    return False
+
+
+def _make_kernel(cost, prep, parallel, counted=False, bound=None,
+                 levels=0):
     """
-    Divide image in windows to run in parallel mode.
-    input:
-        img0 - 2d float64 array - image in time t + idt
-        img1 - 2d float64 array - image in time t + (i +1 )dt
-        width - int64 - block width in pixels
-        height - int64 - block height in pixels
-        wblock - int64 - Number of blocks in width
-        hblock - int64 - Number of blocks in height
-        wwind - int64 - Window width
-        hwind - int64 - Window height
-        wwindt - int64 - Total number of windows in width
-        hwindt - int64 - Total number of windows in height
-    Return:
-        Array with nxm lines and 4 collumns.
-        Each collumn:
-            0 - Initial x
-            1 - Initial y
-            2 - Final matching x
-            3 - Final matching y
+    Build the matching kernel of one metric.
+
+    The cost function is a compile time constant of the kernel, so each
+    metric has its own kernel without a branch on the metric in the search
+    loop. The kernel is compiled for the types of the images of each call,
+    uint8 frames and read only views are used without a copy. counted is
+    also a constant: without it the counting code is removed. With a bound
+    function the candidates are first tested by successive elimination up
+    to the given level.
     """
-    m = hblock * wblock
-    out = zeros((m, 4), dtype=int64)
-    for i in prange(hblock - 1):
-        for j in prange(wblock - 1):
-            i0 = i * (height)
-            i1 = (i + 1) * (hwind)
+    pruned = bound is not None
+    if bound is None:
+        bound = _bound_sad
+
+    def kernel(img0, img1, s0, s1, q1, width, height, wblock, oy, ox, blocks,
+               out, counts):
+        """
+        Search the blocks of a flat work list, so the threads share the
+        blocks to search whatever their position in the grid.
+        input:
+            img0 - 2d uint8 or float64 array - image in time t + idt
+            img1 - 2d uint8 or float64 array - image in time t + (i +1 )dt
+            s0 - 2d float64 array - integral image of img0, used by the
+                 successive elimination
+            s1, q1 - 2d float64 array - integral images of img1, used by
+                     the zncc metric and the successive elimination
+            width - int64 - block width in pixels
+            height - int64 - block height in pixels
+            wblock - int64 - Number of blocks in width
+            oy, ox - int64 - global shift, in lines and columns, at the
+                     center of the search windows
+            blocks - 1d int64 array - index i * wblock + j of each block
+                     to search.
+            out - 2d int64 array - hblock * wblock x 4, output array. Lines
+                  of blocks not searched are left untouched.
+            counts - 2d int64 array - hblock * wblock x 2, candidates
+                     tested and candidates eliminated before their cost of
+                     each block, written by the counted kernels only.
+        Return:
+            Array with nxm lines and 4 collumns.
+            Each collumn:
+                0 - Initial x
+                1 - Initial y
+                2 - Final matching x
+                3 - Final matching y
+        """
+        lins, cols = img0.shape
+        hc = height // 2
+        wc = width // 2
+        for t in prange(blocks.size):
+            k0 = blocks[t]
+            i = k0 // wblock
+            j = k0 % wblock
+
+            # The block is in the center of a window of 2 * height x
+            # 2 * width pixels starting in (i * height, j * width). The
+            # blocks of the last line and column are moved inside the
+            # image and their windows are clipped. With a global shift the
+            # window is centered on the block shifted, kept inside the
+            # image.
+            ib0 = min(i * height + hc, lins - height)
+            jb0 = min(j * width + wc, cols - width)
+            ic = min(max(ib0 + oy, 0), lins - height)
+            jc = min(max(jb0 + ox, 0), cols - width)
+            i0 = ic - hc
+            j0 = jc - wc
+            ki0 = max(0, -i0)
+            ki1 = min(height, lins - height - i0 + 1)
+            kj0 = max(0, -j0)
+            kj1 = min(width, cols - width - j0 + 1)
+
+            m0, n0 = prep(img0, ib0, jb0, height, width)
+
+            # The center of the window is tested first, so it wins the
+            # ties: neighbors with the same cost must not be detected as
+            # false moviment.
+            minval = cost(img0, img1, s1, q1, ib0, jb0, ic, jc,
+                          height, width, m0, n0)
+            bi = hc
+            bj = wc
+            tested = 1
+            exits = 0
+            for ki in range(ki0, ki1):
+                for kj in range(kj0, kj1):
+                    if ki == hc and kj == wc:
+                        continue
+                    tested += 1
+                    if pruned:
+                        if _eliminated(bound, s0, s1, ib0, jb0, i0 + ki,
+                                       j0 + kj, height, width, levels,
+                                       minval):
+                            exits += 1
+                            continue
+                    diff = cost(img0, img1, s1, q1, ib0, jb0,
+                                i0 + ki, j0 + kj, height, width, m0, n0)
+                    if diff < minval:
+                        minval = diff
+                        bi = ki
+                        bj = kj
+
+            if counted:
+                counts[k0, 0] = tested
+                counts[k0, 1] = exits
+
+            out[k0, 0] = ib0
+            out[k0, 1] = jb0
+            out[k0, 2] = i0 + bi
+            out[k0, 3] = j0 + bj
+        return out
+
+    return njit(parallel=parallel, nogil=True)(kernel)
+
+
+# Lower bounds of the metrics with a successive elimination.
+BOUNDS = {
+    'clamped': _bound_clamped,
+    'sad': _bound_sad,
+    'ssd': _bound_ssd,
+}
+
+# Cost and block statistics of each metric.
+METRICS = {
+    'clamped': (_cost_clamped, _prep_none),
+    'sad': (_cost_sad, _prep_none),
+    'ssd': (_cost_ssd, _prep_none),
+    'zncc': (_cost_zncc, _prep_zncc),
+}
+
+# Default kernel, compiled at import for uint8 frames.
+_block_matching = _make_kernel(_cost_clamped, _prep_none, True)
+_block_matching.compile(TYPEBBMATCHING)
+
+# Kernels of each (metric, parallel, counted, sea) key, the other ones are
+# compiled at their first use. The serial kernels are used by callers that
+# run many matchings at once from their own threads.
+_KERNELS = {('clamped', True, False, None): _block_matching}
+
+# Counts given to the kernels without counters.
+_NOCOUNTS = zeros((1, 2), dtype=int64)
+
+
+def _kernel(metric, parallel, counted=False, sea=None):
+    """
+    Kernel of the metric, compiled at the first call.
+    """
+    key = (metric, bool(parallel), bool(counted), sea)
+    if key not in _KERNELS:
+        if metric not in METRICS:
+            raise ValueError("Unknown metric {}, use one of {}".format(
+                metric, ", ".join(sorted(METRICS))))
+        cost, prep = METRICS[metric]
+        bound = None
+        if sea is not None:
+            bound = BOUNDS[metric]
+        _KERNELS[key] = _make_kernel(cost, prep, parallel, counted, bound,
+                                     sea or 0)
+    return _KERNELS[key]
+
+
+def _grid_shape(img0, img1, width, height):
+    """
+    Check the images and return the number of blocks in height and width.
+    """
+    if img0.shape[0] != img1.shape[0]:
+        raise ImageSizeError("The images have diferent number of lines")
+
+    if img0.shape[1] != img1.shape[1]:
+        raise ImageSizeError("The images have diferent number of columns")
+
+    lins, cols = img0.shape
+
+    # Number of blocks in width
+    wblock = cols // width
+
+    # Number of blocks in height
+    hblock = lins // height
+
+    if wblock < 2:
+        raise BlockError("block larger than image.")
+
+    if hblock < 2:
+        raise BlockError("block heigher than image.")
+
+    return hblock, wblock
 
-            j0 = j * (width)
-            j1 = (j + 1) * (wwind)
 
-            x = _sme(img1, img0, wblock, hblock, wwind, hwind,
-                     width, height, i0, i1, j0, j1)
+_NOINTEGRAL = zeros((1, 1))
 
-            k0 = i * wblock + j
-            out[k0, :] = x
+
+def _pixels(img):
+    """
+    Frame as read by the kernels: uint8 frames as they are, other types
+    converted to float64.
+    """
+    if img.dtype == uint8:
+        return img
+    return asarray(img, dtype=float64)
+
+
+def _integral(img):
+    """
+    Integral image of the pixels of a frame, for the successive elimination.
+    """
+    return cv2.integral(ascontiguousarray(_pixels(img)), sdepth=cv2.CV_64F)
+
+
+def _integral2(img):
+    """
+    Integral images of the pixels and of their squares, for zncc.
+    """
+    return cv2.integral2(ascontiguousarray(_pixels(img)), sdepth=cv2.CV_64F,
+                         sqdepth=cv2.CV_64F)
+
+
+def _derived(cache, frame, key, name, compute):
+    """
+    Data derived from a frame, read from the cache when there is one.
+    """
+    if cache is None:
+        return compute(frame)
+    return cache.get(frame, name, compute, key)
+
+
+def _prepare(img0, img1, metric, cache=None, keys=(None, None)):
+    """
+    Frames and integral images of img1 given to the kernels of the metric.
+    With a FrameCache the data of each frame is computed once.
+    """
+    key0, key1 = keys
+    if metric == 'zncc':
+        s1, q1 = _derived(cache, img1, key1, 'integral2', _integral2)
+    else:
+        s1 = q1 = _NOINTEGRAL
+    if img0.dtype != uint8:
+        img0 = _derived(cache, img0, key0, 'pixels', _pixels)
+    if img1.dtype != uint8:
+        img1 = _derived(cache, img1, key1, 'pixels', _pixels)
+    return img0, img1, s1, q1
+
+
+def _check_sea(sea, metric, img0, img1):
+    """
+    Level of the successive elimination, None when it is not used. The
+    bound of the clamped metric needs pixels in [0, 255], it is used for
+    uint8 frames only.
+    """
+    if sea is None or sea is False:
+        return None
+    if metric not in BOUNDS:
+        raise ValueError("The successive elimination is not available for "
+                         "the metric {}.".format(metric))
+    if int(sea) < 0:
+        raise ValueError("sea must be a level >= 0.")
+    if metric == 'clamped' and (img0.dtype != uint8 or img1.dtype != uint8):
+        return None
+    return int(sea)
+
+
+def _work_list(mask, edges):
+    """
+    Flat index of the blocks to search, in raster order.
+    """
+    wblock = mask.shape[1]
+    if not edges:
+        mask = mask[:-1, :-1]
+    rows, cols = mask.nonzero()
+    return rows.astype(int64) * wblock + cols
+
+
+def _chunk(nblocks, chunksize):
+    """
+    Number of blocks given to a thread at a time. By default each thread
+    takes about 8 chunks, so the threads that finish early take the work of
+    the slow ones.
+    """
+    if chunksize is not None:
+        return chunksize
+    return max(1, nblocks // (8 * get_num_threads()))
+
+
+def _search(img0, img1, width, height, mask, out, parallel=True,
+            metric='clamped', edges=False, chunksize=None, counters=None,
+            sea=None, cache=None, keys=None, offset=(0, 0),
+            specialize=False):
+    """
+    Run the matching kernel over the blocks selected by mask, writing the
+    result in out. With counters the counting kernel is used and the
+    counters of the search are recorded. With sea the candidates are tested
+    by successive elimination up to the level sea. The data derived from
+    the frames is kept in cache, with the frame keys. The search windows
+    are centered on the blocks shifted by offset. With specialize the full
+    searches use the kernel of the block size, when there is one.
+    """
+    hblock, wblock = mask.shape
+    sea = _check_sea(sea, metric, img0, img1)
+    kernel = None
+    if specialize and counters is None and sea is None:
+        kernel = specialized_kernel(metric, height, width, parallel)
+    if kernel is None:
+        kernel = _kernel(metric, parallel, counters is not None, sea)
+    keys = (None, None) if keys is None else keys
+    s0 = _NOINTEGRAL
+    if sea is not None:
+        s0 = _derived(cache, img0, keys[0], 'integral', _integral)
+        s1 = _derived(cache, img1, keys[1], 'integral', _integral)
+    img0, img1, s1z, q1 = _prepare(img0, img1, metric, cache, keys)
+    if sea is None:
+        s1 = s1z
+    blocks = _work_list(mask, edges)
+    oy, ox = int(offset[0]), int(offset[1])
+    counts = _NOCOUNTS
+    if counters is not None:
+        counts = zeros((out.shape[0], 2), dtype=int64)
+    if not parallel:
+        kernel(img0, img1, s0, s1, q1, width, height, wblock, oy, ox, blocks,
+               out, counts)
+    else:
+        with parallel_chunksize(_chunk(blocks.size, chunksize)):
+            kernel(img0, img1, s0, s1, q1, width, height, wblock, oy, ox,
+                   blocks, out, counts)
+    if counters is not None:
+        counters.record(out, blocks, counts)
     return out
 
 
-def block_matching(img0, img1, width, height):
+def _output(out, hblock, wblock, width, height, compact, offset=(0, 0),
+            frame=None):
+    """
+    Format the output of the matching kernel as grids or as a compact motion
+    field.
+    """
+    if compact is not None:
+        dtype = displacement_dtype(width + 2 * abs(offset[1]),
+                                   height + 2 * abs(offset[0]))
+        dy = (out[:, 2] - out[:, 0]).astype(dtype).reshape(hblock, wblock)
+        dx = (out[:, 3] - out[:, 1]).astype(dtype).reshape(hblock, wblock)
+        motion = MotionField(dy, dx, width, height, frame)
+        if compact == 'sparse':
+            return motion.sparse()
+        return motion
+
+    return out[:, 0].reshape(hblock, wblock), out[:, 1].reshape(hblock, wblock),\
+           out[:, 2].reshape(hblock, wblock), out[:, 3].reshape(hblock, wblock),
+
+
+def block_matching(img0, img1, width, height, compact=None, mask=None,
+                   parallel=True, metric='clamped', edges=False,
+                   chunksize=None, counters=None, sea=None, cache=None,
+                   keys=None, offset=None, specialize=False):
     """
     Block matching algorithm.
     -------------------------
@@ -343,6 +722,74 @@ def block_matching(img0, img1, width, height):
         :parameter 2d_array img1: 2d array - Image in time t0 + (k+1)dt
         :parameter int64 width: int64 - matching block width
         :parameter int64 height: int64 - matching block height
+        :parameter str compact: None (default) return the four grids;
+                                'dense' return a MotionField with the
+                                int8/int16 displacement grids (dy, dx);
+                                'sparse' return a SparseMotion with only
+                                the moving blocks.
+        :parameter 2d_array mask: optional - one value for each block, only
+                                  blocks with non zero mask are searched. The
+                                  other blocks are returned as zeros, like
+                                  the blocks of the last line and column.
+        :parameter bool parallel: default True. With False the serial kernel
+                                  is used, for callers that run many
+                                  matchings at once from their own threads
+                                  or processes.
+        :parameter str metric: cost of a candidate block, default 'clamped'.
+                               'clamped' - sum of the differences candidate
+                               - block clamped to [0, 255];
+                               'sad' - sum of absolute differences;
+                               'ssd' - sum of squared differences;
+                               'zncc' - one minus the zero-mean normalized
+                               cross-correlation, robust to changes of
+                               brightness and contrast.
+        :parameter bool edges: default False. With True the blocks of the
+                               last line and column are also searched: they
+                               are moved inside the image, as given by XI
+                               and YI, and their search windows are clipped
+                               by the image borders.
+        :parameter int chunksize: number of blocks taken at a time by each
+                                  thread of the parallel kernel. The blocks
+                                  to search are a flat work list, shared by
+                                  the threads in chunks. Default about 8
+                                  chunks by thread; 0 splits the list in
+                                  one static part by thread.
+        :parameter KernelCounters counters: optional, the kernel counts the
+                                            candidates tested by each block
+                                            and the counters of the matching
+                                            are added to it.
+        :parameter int sea: optional, successive elimination level. The
+                            sums of the block and of a candidate, read from
+                            integral images of both frames, give a lower
+                            bound of the cost: the candidates whose bound
+                            reaches the best cost found are discarded
+                            without computing their cost. At the level l
+                            the block is also split in 2**l x 2**l regions
+                            for tighter bounds, tested from the level 0.
+                            The vectors are the ones of the full search.
+                            For the metrics 'clamped' (uint8 frames),
+                            'sad' and 'ssd'. Default None, full search.
+        :parameter FrameCache cache: optional, keeps the data derived from
+                                     the frames, the float64 pixels and
+                                     the integral images, for the next
+                                     calls with the same frames.
+        :parameter tuple keys: optional, (key0, key1) of the frames in the
+                               cache, as their sequence numbers. By default
+                               the frames are found by identity.
+        :parameter offset: optional, global shift (dy, dx) of the frame. The
+                           search window of each block is centered on the
+                           block shifted by offset, which is tested first
+                           and wins the ties, so large common motions, as
+                           camera shakes, are found with small blocks.
+                           'auto' estimates the shift with global_motion.
+                           Default None, windows centered on the blocks.
+        :parameter bool specialize: default False. With True the full
+                                    searches use a kernel generated for
+                                    the block size, with the size as a
+                                    constant and unrolled loops, compiled
+                                    at the first use of each size and kept
+                                    on disk, see specialized_kernel. The
+                                    vectors are the same.
 
     Return:
     ------
@@ -350,42 +797,35 @@ def block_matching(img0, img1, width, height):
         :return 2d_array YI: - 2d int64 array - Grid with Initial y
         :return 2d_array XF: - 2d int64 array - Final matching Grid with x
         :return 2d_array YF: - 2d int64 array - Final matching Grid with y
-    """
-
-    if img0.shape[0] != img1.shape[0]:
-        raise ImageSizeError("The images have diferent number of lines")
-
-    if img0.shape[1] != img1.shape[1]:
-        raise ImageSizeError("The images have diferent number of columns")
-
-    lins, cols = img0.shape
-
-    # Number of blocks in width
-    wblock = cols // width
 
-    # Number of blocks in height
-    hblock = lins // height
-
-    if wblock < 2:
-        raise BlockError("block larger than image.")
-
-    if hblock < 2:
-        raise BlockError("block heigher than image.")
-
-    # Window width
-    wwind = 2 * width
-
-    # Window height
-    hwind = 2 * height
-
-    # Total windows in width
-    wwindt = cols // wwind
-
-    # Total windows in height
-    hwindt = lins // hwind
-    out = _block_matching(img0.astype(float), img1.astype(float), width,
-                          height, wblock, hblock, wwind, hwind, wwindt, hwindt
-                          )
-
-    return out[:, 0].reshape(hblock, wblock), out[:, 1].reshape(hblock, wblock),\
-           out[:, 2].reshape(hblock, wblock), out[:, 3].reshape(hblock, wblock),
+        With compact='dense' or compact='sparse' a MotionField or a
+        SparseMotion is returned instead of the grids.
+    """
+    if compact not in (None, 'dense', 'sparse'):
+        raise ValueError("compact must be None, 'dense' or 'sparse'.")
+
+    if metric not in METRICS:
+        raise ValueError("Unknown metric {}, use one of {}".format(
+            metric, ", ".join(sorted(METRICS))))
+
+    hblock, wblock = _grid_shape(img0, img1, width, height)
+
+    if mask is None:
+        mask = ones((hblock, wblock), dtype=uint8)
+    elif mask.shape != (hblock, wblock):
+        raise BlockError("mask must have one element for each block.")
+
+    if offset is None:
+        offset = (0, 0)
+    elif isinstance(offset, str):
+        if offset != 'auto':
+            raise ValueError("offset must be None, 'auto' or (dy, dx).")
+        from .globalmotion import global_motion
+        offset = global_motion(img0, img1, cache=cache, keys=keys)
+
+    out = zeros((hblock * wblock, 4), dtype=int64)
+    _search(img0, img1, width, height, mask.astype(uint8), out, parallel,
+            metric, edges, chunksize, counters, sea, cache, keys, offset,
+            specialize)
+    return _output(out, hblock, wblock, width, height, compact, offset,
+                   img0.shape[:2])
@@ -62,8 +62,13 @@ from random import choice
 from networkx.algorithms import community
 from numpy import abs, array, sqrt, where, zeros_like, floor, median, zeros
 from numpy import float64, diag, sum, dot, linalg, argmax
+from numpy import empty, ones, bincount, int64, nonzero
+from numba import njit
 import matplotlib.pyplot as plt
 
+from .motionfield import MotionField, SparseMotion
+from .clusters import Clusters
+
 
 def _mout_edges(nodes):
     """Find edges using vertices representing xy position vertices."""
@@ -119,55 +124,34 @@ def split_graph(subg, graph, maxsizegraph):
     return [subgraph]
 
 
-def clustering(x0, y0, x1, y1, smooth=15, maxsizegraph=100):
+def _cluster_nodes(nodes, ddx, ddy, px, py, dsx, dsy, smooth, maxsizegraph):
     """
-    Estimating displacement of objects using optical flow.
-
-    Based on connected components in an undirected graph algorithm.
-
-    Generate a mask with arrows representing the vector moviment.
-    Velocities are smoothed from median following the sugestion from the work
-    of Bran and Letia, 2002 (doi:10.1117/12.477174).
-    Parameters
-    ----------
-    :parameter 2d_array x0: 2d Array - Grid with x initial position of vector
-    :parameter 2d_array y0: 2d Array - Grid with y initial position of vector
-    :parameter 2d_array x1: 2d Array - Grid with x final position of vector
-    :parameter 2d_array y1: 2d Array - Grid with y final position of vector
+    Connected components of the moving blocks.
 
-    Return
-    ------
-    :return 2d_array dsx: 2d Array - Grid with x displacement.
-    :return 2d_arraydsy: 2d Array - Grid with y displacement.
-    :return list object_tops: list of lists with x, y for each graph.
-    :return list mean_displacement: list with mean displacement of each graph.
+    nodes - (n, 2) array with the block line and column of each moving block,
+            in raster order.
+    ddx, ddy - displacement of each moving block, in lines and columns.
+    px, py - initial position, in pixels, of each moving block.
+    dsx, dsy - grids filled with the smoothed displacement.
     """
-    sh = x0.shape
-    ds = sqrt((x0 - x1) ** 2 + (y0 - y1) ** 2.0)
-    dsx = zeros_like(x1)
-    dsy = zeros_like(y1)
-    no_zeros = where(abs(ds) != 0.)
-    nodes = list(zip(no_zeros[0], no_zeros[1]))
     nnodes = len(nodes)
-    nodes = array(nodes)
     edges = _mout_edges(nodes)
     graph = nx.Graph()
     nodes_names = list(range(nnodes - 1))
     graph.add_nodes_from(nodes_names)
     graph.add_edges_from(edges)
-    object_tops = []
+    blocks = []
     mean_displacement = []
 
     for subgraph in nx.connected_components(graph):
         for subgin in split_graph(subgraph, graph, maxsizegraph):
-            ij = array(nodes[list(subgin)])
+            idx = list(subgin)
+            ij = array(nodes[idx])
             ij = (ij[:,0], ij[:, 1])
-            nnodes = ij[0].size
+            idx = array(idx)
 
-            n = ij[0].shape[0]
-
-            mdsx = floor(mode(x0[ij] - x1[ij])[0])
-            mdsy = floor(mode(y0[ij] - y1[ij])[0])
+            mdsx = floor(mode(ddx[idx])[0])
+            mdsy = floor(mode(ddy[idx])[0])
 
             nnodes = ij[0].size
 
@@ -177,13 +161,195 @@ def clustering(x0, y0, x1, y1, smooth=15, maxsizegraph=100):
             else:
                 for smo_i in range(0, nnodes - smooth, smooth):
                     subij = (ij[0][smo_i:smo_i + smooth], ij[1][smo_i:smo_i + smooth])
-                    smdsx = floor(mode(x0[subij] - x1[subij])[0])
-                    smdsy = floor(mode(y0[subij] - y1[subij])[0])
+                    subidx = idx[smo_i:smo_i + smooth]
+                    smdsx = floor(mode(ddx[subidx])[0])
+                    smdsy = floor(mode(ddy[subidx])[0])
 
                     dsx[subij] = smdsx
                     dsy[subij] = smdsy
 
-            object_tops.append(list(zip(x1[ij], y1[ij])))
+            blocks.append((px[idx], py[idx]))
             mean_displacement.append([mdsx, mdsy])
 
-    return dsx, dsy, object_tops, mean_displacement
+    clusters = Clusters.from_blocks(blocks, mean_displacement)
+    return dsx, dsy, clusters, clusters.displacement
+
+
+@njit(nogil=True)
+def _find(parent, k):
+    "Root of k, halving the path."
+    while parent[k] != k:
+        parent[k] = parent[parent[k]]
+        k = parent[k]
+    return k
+
+
+@njit(nogil=True)
+def _velocity_labels(dy, dx, tolerance):
+    """
+    Label the moving blocks, merging the 8 neighbors, as the edges of the
+    graph, whose displacements differ by at most tolerance in lines and in
+    columns. In the raster scan each block is joined to its left and its
+    three upper neighbors.
+
+    Return the grid of labels, -1 for the static blocks, numbered in the
+    raster order of the first block of each segment, and the number of
+    segments.
+    """
+    lins, cols = dy.shape
+    parent = empty(lins * cols, dtype=int64)
+    for i in range(lins):
+        for j in range(cols):
+            k = i * cols + j
+            parent[k] = k
+            if dy[i, j] == 0 and dx[i, j] == 0:
+                continue
+            for ni, nj in ((i, j - 1), (i - 1, j - 1), (i - 1, j),
+                           (i - 1, j + 1)):
+                if ni < 0 or nj < 0 or nj >= cols:
+                    continue
+                if dy[ni, nj] == 0 and dx[ni, nj] == 0:
+                    continue
+                if abs(dy[ni, nj] - dy[i, j]) > tolerance or \
+                   abs(dx[ni, nj] - dx[i, j]) > tolerance:
+                    continue
+                r0 = _find(parent, k)
+                r1 = _find(parent, ni * cols + nj)
+                # The smallest index is the root, so the roots are the
+                # first blocks of the segments.
+                if r0 < r1:
+                    parent[r1] = r0
+                elif r1 < r0:
+                    parent[r0] = r1
+
+    labels = -ones((lins, cols), dtype=int64)
+    nseg = 0
+    for i in range(lins):
+        for j in range(cols):
+            if dy[i, j] == 0 and dx[i, j] == 0:
+                continue
+            r = _find(parent, i * cols + j)
+            if r == i * cols + j:
+                labels[i, j] = nseg
+                nseg += 1
+            else:
+                labels[i, j] = labels[r // cols, r % cols]
+    return labels, nseg
+
+
+@njit(nogil=True)
+def _segment_modes(lab, d, nseg):
+    """
+    Most frequent value of d in each segment, the smallest one on ties.
+    """
+    lo = d.min() if d.size > 0 else 0
+    hi = d.max() if d.size > 0 else 0
+    counts = zeros((nseg, hi - lo + 1), dtype=int64)
+    for k in range(lab.size):
+        counts[lab[k], d[k] - lo] += 1
+    out = empty(nseg, dtype=float64)
+    for s in range(nseg):
+        out[s] = argmax(counts[s]) + lo
+    return out
+
+
+def _velocity_segments(dy, dx, px, py, dsx, dsy, tolerance):
+    """
+    Coherent motion segments of the displacement grids dy, dx, with the
+    initial positions px, py of the blocks.
+    """
+    labels, nseg = _velocity_labels(dy.astype(int64), dx.astype(int64),
+                                    tolerance)
+    rows, cols = nonzero(labels >= 0)
+    lab = labels[rows, cols]
+    order = lab.argsort(kind='stable')
+    rows, cols, lab = rows[order], cols[order], lab[order]
+
+    displacement = zeros((nseg, 2))
+    displacement[:, 0] = _segment_modes(lab, dy[rows, cols].astype(int64),
+                                        nseg)
+    displacement[:, 1] = _segment_modes(lab, dx[rows, cols].astype(int64),
+                                        nseg)
+    dsx[rows, cols] = displacement[lab, 0]
+    dsy[rows, cols] = displacement[lab, 1]
+
+    offsets = zeros(nseg + 1, dtype=int64)
+    offsets[1:] = bincount(lab, minlength=nseg).cumsum()
+    clusters = Clusters(offsets, px[rows, cols], py[rows, cols],
+                        displacement)
+    return dsx, dsy, clusters, clusters.displacement
+
+
+def clustering(x0, y0=None, x1=None, y1=None, smooth=15, maxsizegraph=100,
+               tolerance=None):
+    """
+    Estimating displacement of objects using optical flow.
+
+    Based on connected components in an undirected graph algorithm.
+
+    Generate a mask with arrows representing the vector moviment.
+    Velocities are smoothed from median following the sugestion from the work
+    of Bran and Letia, 2002 (doi:10.1117/12.477174).
+
+    The compact output of block matching, a MotionField or a SparseMotion,
+    can be given in place of the four grids, as in ``clustering(motion)``.
+    In this case the displacement grids have the type of the motion field.
+
+    With a tolerance the moving blocks are grouped by a union-find pass over
+    the block grid instead of the graph: neighboring blocks are merged only
+    when their displacements differ by at most tolerance pixels in lines and
+    in columns, so objects moving differently are separated even when they
+    touch. Each segment gets the most frequent displacement of its blocks,
+    without the split of large graphs nor the chunked smoothing.
+
+    Parameters
+    ----------
+    :parameter 2d_array x0: 2d Array - Grid with x initial position of vector
+    :parameter 2d_array y0: 2d Array - Grid with y initial position of vector
+    :parameter 2d_array x1: 2d Array - Grid with x final position of vector
+    :parameter 2d_array y1: 2d Array - Grid with y final position of vector
+    :parameter int tolerance: optional, largest difference of displacement,
+                              in pixels, of two neighbor blocks of the same
+                              segment. None (default) uses the graph
+                              algorithm.
+
+    Return
+    ------
+    :return 2d_array dsx: 2d Array - Grid with x displacement.
+    :return 2d_arraydsy: 2d Array - Grid with y displacement.
+    :return Clusters object_tops: x, y of the blocks of each graph. It can
+                                  be used as the old list of lists of
+                                  tuples.
+    :return 2d_array mean_displacement: (n, 2) array with the mean
+                                        displacement of each graph, (0, 2)
+                                        without moving blocks.
+    """
+    if isinstance(x0, (MotionField, SparseMotion)):
+        if tolerance is not None:
+            motion = x0 if isinstance(x0, MotionField) else x0.dense()
+            px, py = motion.origins()
+            return _velocity_segments(motion.dy, motion.dx, px, py,
+                                      zeros(motion.shape, motion.dy.dtype),
+                                      zeros(motion.shape, motion.dx.dtype),
+                                      tolerance)
+        motion = x0.sparse()
+        nodes = array([motion.rows, motion.cols]).T
+        px, py = motion.origins()
+        dsx = zeros(motion.shape, dtype=motion.dy.dtype)
+        dsy = zeros(motion.shape, dtype=motion.dx.dtype)
+        return _cluster_nodes(nodes, motion.dy, motion.dx, px, py,
+                              dsx, dsy, smooth, maxsizegraph)
+
+    if tolerance is not None:
+        return _velocity_segments(x0 - x1, y0 - y1, x1, y1, zeros_like(x1),
+                                  zeros_like(y1), tolerance)
+
+    ds = sqrt((x0 - x1) ** 2 + (y0 - y1) ** 2.0)
+    dsx = zeros_like(x1)
+    dsy = zeros_like(y1)
+    no_zeros = where(abs(ds) != 0.)
+    nodes = list(zip(no_zeros[0], no_zeros[1]))
+    nodes = array(nodes)
+    return _cluster_nodes(nodes, (x0 - x1)[no_zeros], (y0 - y1)[no_zeros],
+                          x1[no_zeros], y1[no_zeros], dsx, dsy,
+                          smooth, maxsizegraph)
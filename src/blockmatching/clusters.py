@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Array backed result of the clustering.
+
+:class:`Clusters` keeps the moving objects found by ``clustering`` in a few
+flat arrays instead of a list of lists of tuples: the block positions of all
+the objects are concatenated in ``rows`` and ``cols`` and the blocks of the
+object k are the ones from ``offsets[k]`` to ``offsets[k + 1]``, as in a CSR
+matrix. Each object also has its displacement, its number of blocks and the
+bounding box of its blocks.
+
+For compatibility the result still behaves as the old list of objects:
+``clusters[k]`` is the list of (x, y) tuples of the object k.
+
+Example
+-------
+>>> from blockmatching import *
+>>> XP, YP, XD, YD = block_matching(img0, img1, 9, 9)
+>>> U, V, clusters, meand = clustering(XD, YD, XP, YP)
+>>> for k in range(len(clusters)):
+>>>     rows, cols = clusters.blocks(k)
+>>>     print(clusters.counts[k], clusters.bboxes[k], meand[k])
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from numpy import array, asarray, concatenate, cumsum, diff, empty, zeros
+from numpy import array_equal, minimum, maximum, float64, int32, int64
+
+
+class Clusters:
+    r'''
+    Moving objects of a frame.
+
+    :param 1d_array offsets: int64, n + 1 values, the blocks of the object k
+                             are the ones from offsets[k] to offsets[k + 1].
+    :param 1d_array rows: int32, line of the initial position, in pixels, of
+                          each block.
+    :param 1d_array cols: int32, column of the initial position, in pixels,
+                          of each block.
+    :param 2d_array displacement: (n, 2) float64, displacement in lines and
+                                  columns of each object.
+
+    Attributes ``counts`` (number of blocks of each object) and ``bboxes``
+    ((n, 4) int32 with the first line, first column, last line and last
+    column of the block positions of each object) are computed from the
+    blocks.
+    '''
+
+    def __init__(self, offsets, rows, cols, displacement):
+        self.offsets = asarray(offsets, dtype=int64)
+        self.rows = asarray(rows, dtype=int32)
+        self.cols = asarray(cols, dtype=int32)
+        self.displacement = asarray(displacement,
+                                    dtype=float64).reshape(-1, 2)
+        self.counts = diff(self.offsets)
+
+        n = len(self.counts)
+        self.bboxes = zeros((n, 4), dtype=int32)
+        if n > 0:
+            starts = self.offsets[:-1]
+            self.bboxes[:, 0] = minimum.reduceat(self.rows, starts)
+            self.bboxes[:, 1] = minimum.reduceat(self.cols, starts)
+            self.bboxes[:, 2] = maximum.reduceat(self.rows, starts)
+            self.bboxes[:, 3] = maximum.reduceat(self.cols, starts)
+
+    @classmethod
+    def from_blocks(cls, blocks, displacement=None):
+        r'''
+        Build the clusters from the blocks of each object.
+
+        :param list blocks: (rows, cols) arrays of each object.
+        :param displacement: (n, 2) displacement of each object, default 0.
+
+        :return Clusters: the clusters.
+        '''
+        counts = [len(rows) for rows, _ in blocks]
+        offsets = zeros(len(counts) + 1, dtype=int64)
+        offsets[1:] = cumsum(counts)
+        if blocks:
+            rows = concatenate([rows for rows, _ in blocks])
+            cols = concatenate([cols for _, cols in blocks])
+        else:
+            rows = cols = empty(0, dtype=int32)
+        if displacement is None:
+            displacement = zeros((len(counts), 2))
+        return cls(offsets, rows, cols, displacement)
+
+    @classmethod
+    def from_tops(cls, object_tops, displacement=None):
+        r'''
+        Build the clusters from the old list of lists of (x, y) tuples.
+
+        :param list object_tops: (x, y) positions of the blocks of each
+                                 object.
+        :param displacement: (n, 2) displacement of each object, default 0.
+
+        :return Clusters: the clusters.
+        '''
+        blocks = []
+        for tops in object_tops:
+            tops = array(list(tops), dtype=int32).reshape(-1, 2)
+            blocks.append((tops[:, 0], tops[:, 1]))
+        return cls.from_blocks(blocks, displacement)
+
+    def blocks(self, k):
+        r'''
+        Block positions of one object.
+
+        :param int k: object index.
+
+        :return 1d_array rows: lines of the blocks.
+        :return 1d_array cols: columns of the blocks.
+        '''
+        a, b = self.offsets[k], self.offsets[k + 1]
+        return self.rows[a:b], self.cols[a:b]
+
+    def labels(self):
+        r'''
+        Object index of each block.
+
+        :return 1d_array labels: int64, same size as rows.
+        '''
+        return self.counts.nonzero()[0].repeat(self.counts[self.counts > 0])
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getitem__(self, k):
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("cluster index out of range")
+        rows, cols = self.blocks(k)
+        return list(zip(rows.tolist(), cols.tolist()))
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def __eq__(self, other):
+        if not isinstance(other, Clusters):
+            return NotImplemented
+        return array_equal(self.offsets, other.offsets) and \
+            array_equal(self.rows, other.rows) and \
+            array_equal(self.cols, other.cols) and \
+            array_equal(self.displacement, other.displacement)
+
+    def __repr__(self):
+        return "Clusters({} objects, {} blocks)".format(len(self),
+                                                        self.rows.size)
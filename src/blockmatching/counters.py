@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Counters of the matching kernels.
+
+The time of a matching depends on the traffic: the blocks skipped by the
+masks of an incremental matcher, the candidates evaluated by each block and
+the ones rejected before the end of the cost. :class:`KernelCounters`,
+given to ``block_matching`` or to ``IncrementalMatcher``, selects a kernel
+that counts, for each block searched, the candidates tested and the early
+exits, and aggregates them over the calls of a session with the
+blocks skipped and the histogram of the chosen displacements.
+
+Without counters the kernels are compiled with the counting code removed,
+so they cost nothing when disabled.
+
+Example
+-------
+>>> from blockmatching import *
+>>>
+>>> counters = KernelCounters()
+>>> matcher = IncrementalMatcher(9, 9, tolerance=2, counters=counters)
+>>> for frame in frames:
+>>>     XP, YP, XD, YD = matcher.update(frame)
+>>>
+>>> print(counters.summary())
+>>> print(counters.top(5))
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from collections import Counter
+from threading import Lock
+
+from numpy import stack, unique
+
+
+class KernelCounters:
+    r'''
+    Counters of the matchings of a session.
+
+    Attributes:
+
+    - ``calls``: number of matchings.
+    - ``blocks``: blocks of the grids.
+    - ``searched``: blocks searched.
+    - ``skipped``: blocks not searched, by the masks or on the borders.
+    - ``candidates``: candidates tested.
+    - ``early_exits``: candidates rejected before the end of their cost.
+    - ``histogram``: Counter of the chosen (dy, dx) of the blocks searched.
+    - ``last``: dict with the counters of the last matching, with
+      ``per_block``, the candidates tested by each block searched.
+
+    The counters can be shared by threads.
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        r'''
+        Set the counters to zero.
+        '''
+        self.calls = 0
+        self.blocks = 0
+        self.searched = 0
+        self.skipped = 0
+        self.candidates = 0
+        self.early_exits = 0
+        self.histogram = Counter()
+        self.last = None
+
+    def record(self, out, blocks, counts):
+        r'''
+        Add the counters of one matching, called by the kernels' callers.
+
+        :param 2d_array out: (blocks, 4) output of the kernel.
+        :param 1d_array blocks: index of the blocks searched.
+        :param 2d_array counts: (blocks, 2) candidates tested and early
+                                exits of each block.
+        '''
+        per_block = counts[blocks, 0]
+        exits = int(counts[blocks, 1].sum())
+        moves = stack((out[blocks, 2] - out[blocks, 0],
+                       out[blocks, 3] - out[blocks, 1]), axis=1)
+        values, nvalues = unique(moves, axis=0, return_counts=True)
+        last = dict(blocks=out.shape[0], searched=blocks.size,
+                    skipped=out.shape[0] - blocks.size,
+                    candidates=int(per_block.sum()), early_exits=exits,
+                    per_block=per_block)
+        with self._lock:
+            self.calls += 1
+            self.blocks += last['blocks']
+            self.searched += last['searched']
+            self.skipped += last['skipped']
+            self.candidates += last['candidates']
+            self.early_exits += exits
+            for (dy, dx), n in zip(values.tolist(), nvalues.tolist()):
+                self.histogram[(dy, dx)] += n
+            self.last = last
+
+    @property
+    def candidates_per_block(self):
+        r'''
+        Mean number of candidates tested by a block searched.
+        '''
+        return self.candidates / max(self.searched, 1)
+
+    @property
+    def early_exit_fraction(self):
+        r'''
+        Fraction of the candidates rejected before the end of their cost.
+        '''
+        return self.early_exits / max(self.candidates, 1)
+
+    @property
+    def skipped_fraction(self):
+        r'''
+        Fraction of the blocks not searched.
+        '''
+        return self.skipped / max(self.blocks, 1)
+
+    def top(self, n=10):
+        r'''
+        Most frequent displacements.
+
+        :param int n: number of displacements.
+
+        :return list: ((dy, dx), count) pairs.
+        '''
+        return self.histogram.most_common(n)
+
+    def summary(self):
+        r'''
+        Counters of the session.
+
+        :return dict: the counters, the mean candidates by block and the
+                      fractions of early exits and of blocks skipped.
+        '''
+        return dict(calls=self.calls, blocks=self.blocks,
+                    searched=self.searched, skipped=self.skipped,
+                    candidates=self.candidates,
+                    early_exits=self.early_exits,
+                    candidates_per_block=self.candidates_per_block,
+                    early_exit_fraction=self.early_exit_fraction,
+                    skipped_fraction=self.skipped_fraction)
@@ -31,7 +31,8 @@ Return
     :return 2d_array background: Background in video
     :return 2d_array foreground: foreground in video
     :return 2d_array vectormask: vector field image
-    :return list mean_velocity: mean velocity of connected objects
+    :return 2d_array mean_velocity: (n, 2) mean velocity of connected
+                                    objects, (0, 2) on the first frame.
     :return list layers: connected objects separated in layers.
 
 Example
@@ -62,14 +63,23 @@ Example
 
 
 from .blockmatching import block_matching
+from .incremental import IncrementalMatcher
 from .background import BackgroundSubtractor
+from .framering import FrameRing
 from .clustering import clustering
 from .motionlayers import layers
 from .vectormask import vectormask
+from .pipelinestats import moving_blocks
+from .scaling import downsample, upsample, full_layers
+from .realtime import LatencyBudget, REUSE, _backlog
 import cv2
+from numpy import empty
 
 
-def dlayers(alpha=0.01, width=9, height=9, sigma=7):
+def dlayers(alpha=0.01, width=9, height=9, sigma=7, stats=None,
+            incremental=None, velocity_tolerance=None, scale=1,
+            state=None, budget=None, period=None, edges=True,
+            parallel=True):
     '''
     Layer decorator.
 
@@ -92,13 +102,60 @@ def dlayers(alpha=0.01, width=9, height=9, sigma=7):
     :parameter int sigma: int - default 7. Used to create a smoothed mask to separete
                      moving areas.
 
+    :parameter float incremental: optional, tolerance of an
+                     IncrementalMatcher that searches again only the
+                     blocks that changed. None (default) searches every
+                     block of every frame.
+
+    :parameter PipelineStats stats: optional, records the time of each stage
+                     and the number of moving blocks and objects of each
+                     frame.
+
+    :parameter int velocity_tolerance: optional, largest difference of
+                     displacement of two neighbor blocks of the same object.
+                     With it the objects are found by the velocity-aware
+                     clustering, see clustering. Default None.
+
+    :parameter float scale: default 1. With a scale in (0, 1), as 0.5 or
+                     0.25, the background subtraction, the matching, the
+                     clustering and the layers run on the frame resized by
+                     scale. The outputs are brought back to the input size
+                     and the mean velocities are given in input pixels.
+                     width and height are block sizes at the reduced
+                     resolution.
+
+    :parameter PipelineState state: optional, follows the state of the
+                     pipeline to save it. A loaded state resumes the stream:
+                     the saved background model is used and the first frame
+                     is matched with the saved foreground.
+
+    :parameter float budget: optional, latency budget of a frame, in
+                     seconds, for live streams. The matching is degraded
+                     and the stale frames are skipped to keep it, see
+                     LatencyBudget, and each result ends with the report of
+                     the frame.
+
+    :parameter float period: time between two frames of the source, in
+                     seconds, used with budget. Default the budget.
+
+    :parameter bool edges: default True, the blocks of the last line and
+                     column are also searched, see block_matching. With
+                     False their vectors are zero.
+
+    :parameter bool parallel: default True, the matching uses the threads
+                     of numba. With False the serial kernels are used, for
+                     pipelines run from threads, as the async pipelines.
+
     Return
     ------
         :return 2d_array background: Background in video
         :return 2d_array foreground: foreground in video
         :return 2d_array vectormask: vector field image
-        :return list mean_velocity: mean velocity of connected objects
+        :return 2d_array mean_velocity: (n, 2) mean velocity of connected
+                                        objects, (0, 2) on the first frame.
         :return list layers: connected objects separated in layers.
+        :return dict report: only with a budget, level and latency of the
+                             frame, see LatencyBudget.finish.
 
     Example
     -------
@@ -128,46 +185,130 @@ def dlayers(alpha=0.01, width=9, height=9, sigma=7):
     def wrap(func):
         def wrapped_func(*args, **kwargs):
 
+            matcher = None
+            deadline = None
+            if budget is not None:
+                deadline = LatencyBudget(width, height, budget, period,
+                                         incremental=incremental,
+                                         edges=edges, parallel=parallel)
+            elif incremental is not None:
+                matcher = IncrementalMatcher(width, height, incremental,
+                                             edges=edges, parallel=parallel)
+
             first_frame = True
+            history = None
             background = None
             foreground = None
             maskvector = None
-            old_frame = None
-            meand = []
+            meand = empty((0, 2))
             lyrs = []
+            clustered = None
+
+            if state is not None and state.ready:
+                # Warm start: the first frame is matched with the saved
+                # foreground by the saved background model.
+                background = state.background
+                history = FrameRing(state.foreground.shape,
+                                    state.foreground.dtype)
+                history.push(state.foreground)
+                first_frame = False
+                if matcher is not None:
+                    matcher.update(history.current)
+
+            for full in func(*args, **kwargs):
+                if deadline is not None:
+                    if deadline.stale():
+                        continue
+                    deadline.begin()
+                timer = stats.start() if stats is not None else None
+                frame = downsample(full, scale)
 
-            for frame in func(*args, **kwargs):
                 if first_frame is True:
 
                     background = BackgroundSubtractor(alpha, frame)
-                    foreground = background.foreground(frame)
-                    old_frame = foreground.copy()
+                    history = FrameRing(frame.shape, frame.dtype)
+                    background.foreground(frame, out=history.next_slot())
+                    foreground = history.commit()
                     first_frame = False
 
+                    if matcher is not None:
+                        matcher.update(foreground)
+
+                    if state is not None:
+                        state.update(background, foreground)
+
+                    output = upsample(foreground, full.shape, nearest=True,
+                                      copy=True)
+                    if timer is not None:
+                        timer.lap('background')
+                        stats.finish(timer, queue_depth=_backlog(deadline))
+
                 else:
 
-                    foreground = background.foreground(frame)
+                    # The foreground is written in the ring, the one
+                    # yielded is a copy, the consumer's.
+                    background.foreground(frame, out=history.next_slot())
+                    foreground = history.commit()
+                    if timer is not None:
+                        timer.lap('background')
 
-                    XP, YP, XD, YD = block_matching(old_frame,
-                                                    foreground,
-                                                    width,
-                                                    height)
+                    bwidth, bheight, level = width, height, None
+                    if deadline is not None:
+                        (XP, YP, XD, YD), bwidth, bheight, level = \
+                            deadline.match(history.previous, foreground)
+                    elif matcher is not None:
+                        XP, YP, XD, YD = matcher.update(foreground)
+                    else:
+                        XP, YP, XD, YD = block_matching(history.previous,
+                                                        foreground,
+                                                        width,
+                                                        height,
+                                                        edges=edges,
+                                                        parallel=parallel)
+                    if timer is not None:
+                        timer.lap('matching')
 
-                    U, V, object_tops, meand = clustering(XD, YD, XP, YP)
+                    if level != REUSE or clustered is None:
+                        clustered = clustering(
+                            XD, YD, XP, YP, tolerance=velocity_tolerance)
+                    U, V, object_tops, meand = clustered
+                    if timer is not None:
+                        timer.lap('clustering')
 
                     lyrs = layers(frame,
                                   object_tops,
-                                  width,
-                                  height,
+                                  bwidth,
+                                  bheight,
                                   sigma=sigma)
+                    if scale != 1:
+                        lyrs = full_layers(full, lyrs)
+                        meand = meand / scale
+                    if timer is not None:
+                        timer.lap('layers')
 
-                    old_frame = foreground.copy()
-                    maskvector = vectormask(foreground,
-                                            XD,
-                                            YD,
-                                            (XD + U).astype(int),
-                                            (YD + V).astype(int))
+                    output = upsample(foreground, full.shape, nearest=True,
+                                      copy=True)
+                    maskvector = vectormask(output,
+                                            (XD / scale).astype(int),
+                                            (YD / scale).astype(int),
+                                            ((XD + U) / scale).astype(int),
+                                            ((YD + V) / scale).astype(int))
+                    if state is not None:
+                        state.update(background, foreground,
+                                     (XP, YP, XD, YD), meand,
+                                     clusters=object_tops)
+                    if timer is not None:
+                        timer.lap('vectormask')
+                        stats.finish(timer,
+                                     queue_depth=_backlog(deadline),
+                                     moving_blocks=moving_blocks(XP, YP,
+                                                                 XD, YD),
+                                     components=len(meand))
 
-                yield background.background, foreground, maskvector, meand, lyrs
+                results = (upsample(background.background, full.shape),
+                           output, maskvector, meand, lyrs)
+                if deadline is not None:
+                    results += (deadline.finish(),)
+                yield results
         return wrapped_func
     return wrap
@@ -57,17 +57,37 @@ Example
 >>>     if cv2.waitKey(25) & 0xFF == ord('q'):
 >>>         break
 """
-from numpy import zeros_like, pad, ones, float32
+from numpy import zeros_like, ones, float32, empty
 
 from .blockmatching import block_matching
+from .incremental import IncrementalMatcher
 from .background import BackgroundSubtractor
+from .framering import FrameRing
 from .clustering import clustering
 from .motionlayers import layers
+from .pipelinestats import moving_blocks
+from .realtime import LatencyBudget, REUSE, _backlog
+from .scaling import downsample, upsample
 import cv2
 
 
+def _shift_add(r, layer, dsy, dsx):
+    """
+    Add to r the layer shifted by dsy lines and dsx columns, the pixels
+    shifted out of the frame are lost.
+    """
+    lins, cols = layer.shape[:2]
+    if abs(dsy) >= lins or abs(dsx) >= cols:
+        return
+    r[max(dsy, 0):lins + min(dsy, 0), max(dsx, 0):cols + min(dsx, 0)] += \
+        layer[max(-dsy, 0):lins - max(dsy, 0),
+              max(-dsx, 0):cols - max(dsx, 0)]
+
+
 def forecasting(seconds, dt, alpha=0.01, width=9, height=9, sigma=7,
-                smooth=10, maxsizegraph=30):
+                smooth=10, maxsizegraph=30, stats=None, incremental=None,
+                velocity_tolerance=None, scale=1, state=None, budget=None,
+                period=None, edges=True, parallel=True):
     """
     Forecasting using block matching algorithm.
 
@@ -93,11 +113,57 @@ def forecasting(seconds, dt, alpha=0.01, width=9, height=9, sigma=7,
         :parameter int sigma: int - default 7. Used to create a smoothed mask to separete
                          moving areas.
 
+        :parameter float incremental: optional, tolerance of an
+                         IncrementalMatcher that searches again only the
+                         blocks that changed. None (default) searches every
+                         block of every frame.
+
+        :parameter PipelineStats stats: optional, records the time of each
+                         stage and the number of moving blocks and objects of
+                         each frame.
+
+        :parameter int velocity_tolerance: optional, largest difference of
+                         displacement of two neighbor blocks of the same
+                         object. With it the objects are found by the
+                         velocity-aware clustering, see clustering.
+
+        :parameter float scale: default 1. With a scale in (0, 1), as 0.5 or
+                         0.25, every stage runs on the frame resized by scale
+                         and the forecast, the foreground and the background
+                         are brought back to the input size. width, height
+                         and sigma are sizes at the reduced resolution.
+
+        :parameter PipelineState state: optional, follows the state of the
+                         pipeline to save it. A loaded state resumes the
+                         stream from the saved background model and
+                         foreground.
+
+        :parameter float budget: optional, latency budget of a frame, in
+                         seconds, for live streams. The matching is degraded
+                         and the stale frames are skipped to keep it, see
+                         LatencyBudget, and each result ends with the report
+                         of the frame.
+
+        :parameter float period: time between two frames of the source, in
+                         seconds, used with budget. Default the budget.
+
+        :parameter bool edges: default True, the blocks of the last line
+                         and column are also searched, see block_matching.
+                         With False their vectors are zero.
+
+        :parameter bool parallel: default True, the matching uses the
+                         threads of numba. With False the serial kernels are
+                         used, for pipelines run from threads, as the async
+                         pipelines.
+
     Return
     ------
         :return 2d_array background: Current frame;
         :return 2d_array foreground: Forecasting frame;
 
+        With a budget the report of the frame, a dict, is yielded after
+        the background.
+
     Example
     -------
 
@@ -124,80 +190,134 @@ def forecasting(seconds, dt, alpha=0.01, width=9, height=9, sigma=7,
     def wrap(func):
         def wrapped_func(*args, **kwargs):
 
+            matcher = None
+            deadline = None
+            if budget is not None:
+                deadline = LatencyBudget(width, height, budget, period,
+                                         incremental=incremental,
+                                         edges=edges, parallel=parallel)
+            elif incremental is not None:
+                matcher = IncrementalMatcher(width, height, incremental,
+                                             edges=edges, parallel=parallel)
+
             first_frame = True
+            history = None
             forecast = None
             background = None
             foreground = None
-            old_frame = None
-            meand = []
+            meand = empty((0, 2))
             lyrs = []
+            clustered = None
+
+            if state is not None and state.ready:
+                # Warm start: the first frame is matched with the saved
+                # foreground by the saved background model.
+                background = state.background
+                history = FrameRing(state.foreground.shape,
+                                    state.foreground.dtype)
+                history.push(state.foreground)
+                first_frame = False
+                if matcher is not None:
+                    matcher.update(history.current)
+
+            for full in func(*args, **kwargs):
+                if deadline is not None:
+                    if deadline.stale():
+                        continue
+                    deadline.begin()
+                timer = stats.start() if stats is not None else None
+                frame = downsample(full, scale)
 
-            for frame in func(*args, **kwargs):
                 if first_frame is True:
 
                     background = BackgroundSubtractor(alpha, frame)
-                    foreground = background.foreground(frame)
-                    old_frame = foreground.copy()
+                    history = FrameRing(frame.shape, frame.dtype)
+                    background.foreground(frame, out=history.next_slot())
+                    foreground = history.commit()
                     first_frame = False
 
-                else:
+                    if matcher is not None:
+                        matcher.update(foreground)
 
-                    foreground = background.foreground(frame)
+                    if state is not None:
+                        state.update(background, foreground)
 
-                    XP, YP, XD, YD = block_matching(old_frame,
-                                                    foreground,
-                                                    width,
-                                                    height)
+                    if timer is not None:
+                        timer.lap('background')
+                        stats.finish(timer, queue_depth=_backlog(deadline))
 
-                    U, V, object_tops, meand = clustering(XD, YD, XP, YP,
-                                                          smooth=smooth,
-                                                          maxsizegraph=maxsizegraph)
+                else:
+
+                    # The foreground is written in the ring, the one
+                    # yielded is a copy, the consumer's.
+                    background.foreground(frame, out=history.next_slot())
+                    foreground = history.commit()
+                    if timer is not None:
+                        timer.lap('background')
+
+                    bwidth, bheight, level = width, height, None
+                    if deadline is not None:
+                        (XP, YP, XD, YD), bwidth, bheight, level = \
+                            deadline.match(history.previous, foreground)
+                    elif matcher is not None:
+                        XP, YP, XD, YD = matcher.update(foreground)
+                    else:
+                        XP, YP, XD, YD = block_matching(history.previous,
+                                                        foreground,
+                                                        width,
+                                                        height,
+                                                        edges=edges,
+                                                        parallel=parallel)
+                    if timer is not None:
+                        timer.lap('matching')
+
+                    if level != REUSE or clustered is None:
+                        clustered = clustering(
+                            XD, YD, XP, YP, smooth=smooth,
+                            maxsizegraph=maxsizegraph,
+                            tolerance=velocity_tolerance)
+                    U, V, object_tops, meand = clustered
+                    if timer is not None:
+                        timer.lap('clustering')
 
                     lars = layers(frame,
                                   object_tops,
-                                  width,
-                                  height,
+                                  bwidth,
+                                  bheight,
                                   sigma=sigma)
-
-                    old_frame = foreground.copy()
+                    if timer is not None:
+                        timer.lap('layers')
 
                     r = zeros_like(frame)
-                    for i in range(len(meand)):
-                        c = seconds / dt
-                        dsy, dsx = int(c * meand[i][0]), int(c * meand[i][1])
-
-                        fill_width = (0, abs(dsx)) if dsx < 0 \
-                            else (abs(dsx), 0)
-                        fill_height = (0, abs(dsy)) if dsy < 0 \
-                            else (abs(dsy), 0)
-
-                        tmp = pad(lars[i],
-                                  (fill_height, fill_width),
-                                  mode='constant')
-
-                        if dsy == 0 and dsx < 0:
-                            tmp = tmp[:, abs(dsx):]
-                        elif dsy == 0 and dsx > 0:
-                            tmp = tmp[:, :-abs(dsx)]
-                        elif dsy > 0 and dsx == 0:
-                            tmp = tmp[:-abs(dsy), :]
-                        elif dsy < 0 and dsx == 0:
-                            tmp = tmp[abs(dsy):, :]
-                        elif dsy < 0 and dsx < 0:
-                            tmp = tmp[abs(dsy):, abs(dsx):]
-                        elif dsy < 0 and dsx > 0:
-                            tmp = tmp[abs(dsy):, :-abs(dsx)]
-                        elif dsy > 0 and dsx < 0:
-                            tmp = tmp[:-abs(dsy), abs(dsx):]
-                        elif dsy > 0 and dsx > 0:
-                            tmp = tmp[:-abs(dsy), :-abs(dsx)]
-
-                        r = r + tmp
+                    shifts = (seconds / dt * meand).astype(int)
+                    for (dsy, dsx), layer in zip(shifts, lars):
+                        _shift_add(r, layer, dsy, dsx)
 
                     kernel = ones((sigma, sigma), float32) / sigma ** 2
                     forecast = cv2.filter2D(r, -1, kernel)
                     #forecast = cv2.add(background.background, forecast)
 
-                yield frame, forecast, foreground, background.background
+                    if state is not None:
+                        state.update(background, foreground,
+                                     (XP, YP, XD, YD), meand, forecast,
+                                     object_tops)
+
+                    if timer is not None:
+                        timer.lap('forecast')
+                        stats.finish(timer,
+                                     queue_depth=_backlog(deadline),
+                                     moving_blocks=moving_blocks(XP, YP,
+                                                                 XD, YD),
+                                     components=len(meand))
+
+                if forecast is not None:
+                    forecast = upsample(forecast, full.shape)
+                results = (full, forecast,
+                           upsample(foreground, full.shape, nearest=True,
+                                    copy=True),
+                           upsample(background.background, full.shape))
+                if deadline is not None:
+                    results += (deadline.finish(),)
+                yield results
         return wrapped_func
     return wrap
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Cache of the data derived from the frames.
+
+In a stream each frame is ``img1`` of one matching and ``img0`` of the next
+one. The data the search modes derive from a frame, the float64 pixels, the
+integral images of the successive elimination and of zncc, are computed
+again at each call. A :class:`FrameCache` given to ``block_matching`` keeps
+them for the last frames, so the data of the reference frame computed in one
+call is reused in the next one.
+
+The frames are found by identity, the same array object, or by the keys
+given by the caller, as sequence numbers. Frames written in place, as the
+slots of a ``FrameRing``, must be given keys: the same object holds a new
+frame at each call.
+
+Example
+-------
+>>> from blockmatching import *
+>>>
+>>> cache = FrameCache(size=4)
+>>> for k in range(1, len(frames)):
+>>>     dy, dx = block_matching(frames[k - 1], frames[k], 9, 9,
+>>>                             compact='dense', metric='sad', sea=1,
+>>>                             cache=cache, keys=(k - 1, k))
+>>> print(cache.hits, cache.misses)
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from collections import OrderedDict
+from threading import Lock
+from weakref import ref
+
+
+class FrameCache:
+    r'''
+    Bounded cache of the data derived from the last frames.
+
+    :param int size: number of frames kept, the least recently used frame
+                     is dropped. Default 4.
+
+    Attributes ``hits`` and ``misses`` count the derived data found and
+    computed.
+    '''
+
+    def __init__(self, size=4):
+        if size < 1:
+            raise ValueError("The cache must keep at least one frame.")
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        r'''
+        Drop every frame.
+        '''
+        with self._lock:
+            self._entries.clear()
+
+    def _entry(self, frame, key):
+        "Derived data of a frame, a new entry if it is not in the cache."
+        if key is None:
+            # The id of a freed array can be reused, the weak reference
+            # tells if the entry is still the same object.
+            key = ('id', id(frame))
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or
+                                      entry[0]() is not frame):
+                entry = None
+        else:
+            key = ('key', key)
+            entry = self._entries.get(key)
+        if entry is None:
+            try:
+                owner = ref(frame)
+            except TypeError:
+                owner = None
+            entry = (owner, {})
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(key)
+        return entry[1]
+
+    def get(self, frame, name, compute, key=None):
+        r'''
+        Data derived from a frame, computed at the first request.
+
+        :param 2d_array frame: the frame.
+        :param str name: name of the data, as 'integral'.
+        :param callable compute: function of the frame computing the data.
+        :param key: optional, key of the frame, as its sequence number. By
+                    default the frame is found by identity.
+
+        :return: the derived data.
+        '''
+        with self._lock:
+            data = self._entry(frame, key)
+            if name in data:
+                self.hits += 1
+                return data[name]
+            self.misses += 1
+        value = compute(frame)
+        with self._lock:
+            data[name] = value
+        return value
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Preallocated history of frames.
+
+The pipelines need the foreground of the previous frame to match it with
+the current one. Instead of copying each foreground to keep it, a
+:class:`FrameRing` holds a few preallocated slots: each new foreground is
+written in the next slot, overwriting the oldest one, and the stages receive
+read only views of the slots. No frame is copied just to keep history.
+
+A view returned by the ring is valid until its slot is written again, that
+is for ``size - 1`` more frames.
+
+Example
+-------
+>>> from blockmatching import *
+>>>
+>>> ring = FrameRing((480, 640), 'uint8', size=2)
+>>> for frame in frames:
+>>>     fg = background.foreground(frame, out=ring.next_slot())
+>>>     current = ring.commit()
+>>>     if ring.previous is not None:
+>>>         XP, YP, XD, YD = block_matching(ring.previous, current, 9, 9)
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from numpy import empty
+
+
+class FrameRing:
+    r'''
+    Ring of preallocated frame slots.
+
+    :param tuple shape: shape of each frame.
+    :param dtype: type of the pixels.
+    :param int size: number of frames kept, at least 2.
+    '''
+
+    def __init__(self, shape, dtype, size=2):
+        if size < 2:
+            raise ValueError("The ring must keep at least 2 frames.")
+        self.size = size
+        self._slots = empty((size,) + tuple(shape), dtype=dtype)
+        self._views = []
+        for slot in self._slots:
+            view = slot.view()
+            view.flags.writeable = False
+            self._views.append(view)
+        self._head = -1
+        self._count = 0
+
+    @property
+    def shape(self):
+        r'''
+        Shape of the frames.
+        '''
+        return self._slots.shape[1:]
+
+    @property
+    def dtype(self):
+        r'''
+        Type of the pixels.
+        '''
+        return self._slots.dtype
+
+    def __len__(self):
+        return self._count
+
+    def next_slot(self):
+        r'''
+        Writable slot of the next frame, the one of the oldest frame.
+
+        The frame is added to the history by :meth:`commit`.
+
+        :return 2d_array slot: slot to be written.
+        '''
+        return self._slots[(self._head + 1) % self.size]
+
+    def commit(self):
+        r'''
+        Add the frame written in :meth:`next_slot` to the history.
+
+        :return 2d_array frame: read only view of the new current frame.
+        '''
+        self._head = (self._head + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+        return self._views[self._head]
+
+    def push(self, frame):
+        r'''
+        Copy a frame in the next slot and add it to the history.
+
+        :param 2d_array frame: new frame.
+
+        :return 2d_array frame: read only view of the new current frame.
+        '''
+        self.next_slot()[...] = frame
+        return self.commit()
+
+    def __getitem__(self, age):
+        r'''
+        Read only view of a frame of the history.
+
+        :param int age: 0 for the current frame, 1 for the previous one...
+
+        :return 2d_array frame: the frame.
+        '''
+        if not 0 <= age < self._count:
+            raise IndexError("No frame of age {} in the ring.".format(age))
+        return self._views[(self._head - age) % self.size]
+
+    @property
+    def current(self):
+        r'''
+        Read only view of the current frame, None when empty.
+        '''
+        return self[0] if self._count > 0 else None
+
+    @property
+    def previous(self):
+        r'''
+        Read only view of the previous frame, None before the second frame.
+        '''
+        return self[1] if self._count > 1 else None
+
+    def clear(self):
+        r'''
+        Forget the frames of the history, keeping the slots.
+        '''
+        self._head = -1
+        self._count = 0
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Global motion of a frame by phase correlation.
+
+When the camera shakes or a cloud field drifts as a whole, the vectors of
+every block are far from zero: ``block_matching`` needs blocks larger than
+the motion, or misses it. :func:`global_motion` estimates the shift common
+to the whole frame by phase correlation of downsampled frames, and
+``block_matching(..., offset='auto')`` centers the search window of each
+block on that shift. The windows stay small while the common motion is
+large, and each block only searches the motion of the objects relative to
+the scene.
+
+The frames are reduced by an area average, centered, weighted by a Hann
+window and transformed by FFT. The peak of the inverse transform of the
+normalized cross power spectrum gives the shift, refined by a parabola
+through its neighbors and scaled back to the pixels of the frames. The
+spectrum of a frame can be kept in a :class:`FrameCache`, so in a stream
+each frame is transformed once.
+
+Example
+-------
+>>> from blockmatching import *
+>>>
+>>> dy, dx = global_motion(img0, img1, factor=4)
+>>> motion = block_matching(img0, img1, 9, 9, compact='dense',
+>>>                         offset=(dy, dx))
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from numpy import asarray, ascontiguousarray, conj, abs, argmax, hanning
+from numpy import outer, unravel_index, float64
+from numpy.fft import fft2, ifft2
+import cv2
+
+from .blockmatching import ImageSizeError, BlockError
+
+
+def _reduce(frame, factor):
+    "Frame reduced by an area average of factor x factor pixels."
+    frame = ascontiguousarray(asarray(frame, dtype=float64))
+    if factor == 1:
+        return frame
+    lins, cols = frame.shape
+    return cv2.resize(frame, (cols // factor, lins // factor),
+                      interpolation=cv2.INTER_AREA)
+
+
+def _spectrum(frame, factor):
+    "FFT of the reduced frame, centered and weighted by a Hann window."
+    small = _reduce(frame, factor)
+    small = (small - small.mean()) * outer(hanning(small.shape[0]),
+                                           hanning(small.shape[1]))
+    return fft2(small)
+
+
+def _peak(corr, k, axis, n):
+    "Position of the peak in one axis, refined by a parabola."
+    index = list(k)
+    index[axis] = (k[axis] - 1) % n
+    left = corr[tuple(index)]
+    index[axis] = (k[axis] + 1) % n
+    right = corr[tuple(index)]
+    center = corr[k]
+    pos = float(k[axis])
+    curve = left - 2.0 * center + right
+    if curve < 0:
+        pos += 0.5 * (left - right) / curve
+    if pos > n / 2.0:
+        pos -= n
+    return pos
+
+
+def global_motion(img0, img1, factor=4, cache=None, keys=None):
+    '''
+    Shift of the whole frame from img0 to img1.
+
+    :param 2d_array img0: Image in time t0 + kdt
+    :param 2d_array img1: Image in time t0 + (k+1)dt
+    :param int factor: the frames are reduced by factor in each direction
+                       before the correlation. Default 4. The shift is found
+                       up to half of the reduced frame.
+    :param FrameCache cache: optional, keeps the spectrum of each frame for
+                             the next calls, see block_matching.
+    :param tuple keys: optional, (key0, key1) of the frames in the cache.
+
+    :return int dy: shift in lines, as the displacements of block_matching.
+    :return int dx: shift in columns.
+    '''
+    if img0.shape != img1.shape:
+        raise ImageSizeError("The images have diferent shapes")
+    factor = int(factor)
+    if factor < 1:
+        raise ValueError("factor must be >= 1.")
+    if min(img0.shape) // factor < 4:
+        raise BlockError("factor too large for the image.")
+
+    keys = (None, None) if keys is None else keys
+    name = 'spectrum{}'.format(factor)
+    spectra = []
+    for frame, key in zip((img0, img1), keys):
+        if cache is None:
+            spectra.append(_spectrum(frame, factor))
+        else:
+            spectra.append(cache.get(frame, name,
+                                     lambda f: _spectrum(f, factor), key))
+    cross = spectra[1] * conj(spectra[0])
+    cross /= abs(cross) + 1e-12
+    corr = ifft2(cross).real
+
+    k = unravel_index(argmax(corr), corr.shape)
+    dy = _peak(corr, k, 0, corr.shape[0])
+    dx = _peak(corr, k, 1, corr.shape[1])
+    return int(round(dy * factor)), int(round(dx * factor))
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Incremental block matching.
+
+With a static camera only a few blocks change from one frame to the next.
+The :class:`IncrementalMatcher` keeps the vectors of the previous call and a
+cheap signature of each search window, the mean and the root mean square of
+its pixels, read from integral images. A block is searched again only when
+the signature of its window changed by more than a tolerance in one of the
+two frames; the other blocks keep their previous vectors.
+
+The signature does not see changes that keep both the mean and the root
+mean square of the window, so a small tolerance is a trade of exactness for
+speed.
+
+Example
+-------
+>>> import cv2
+>>> from blockmatching import *
+>>> cap = cv2.VideoCapture('./videos/car.mp4')
+>>> matcher = IncrementalMatcher(width=9, height=9, tolerance=0.5)
+>>> while cap.isOpened():
+>>>    ret, frame = cap.read()
+>>>    if ret == True:
+>>>        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+>>>        grids = matcher.update(frame)
+>>>        if grids is not None:
+>>>            XP, YP, XD, YD = grids
+>>>            print(matcher.dirty.mean())
+>>>    else:
+>>>         break
+>>>
+>>> cap.release()
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import cv2
+from numpy import arange, minimum, ix_, sqrt, abs, zeros, ones, int64, uint8
+
+from .blockmatching import _grid_shape, _search, _output
+
+
+def window_signature(frame, width, height):
+    '''
+    Mean and root mean square of the search window of each block.
+
+    :parameter 2d_array frame: gray level frame.
+    :parameter int width: block width in pixels.
+    :parameter int height: block height in pixels.
+
+    :return 2d_array mean: mean of each window.
+    :return 2d_array rms: root mean square of each window.
+    '''
+    lins, cols = frame.shape
+    hblock = lins // height
+    wblock = cols // width
+    S, SQ = cv2.integral2(frame, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+
+    # The blocks of the last line and column are moved inside the frame.
+    i0 = minimum(arange(hblock) * height + height // 2,
+                 lins - height) - height // 2
+    i1 = minimum(i0 + 2 * height, lins)
+    j0 = minimum(arange(wblock) * width + width // 2,
+                 cols - width) - width // 2
+    j1 = minimum(j0 + 2 * width, cols)
+    area = ((i1 - i0)[:, None] * (j1 - j0)[None, :]).astype(float)
+
+    def box(I):
+        return I[ix_(i1, j1)] - I[ix_(i0, j1)] - I[ix_(i1, j0)] + \
+            I[ix_(i0, j0)]
+
+    return box(S) / area, sqrt(box(SQ) / area)
+
+
+class IncrementalMatcher:
+    r'''
+    Block matching that searches again only the blocks that changed.
+
+    :param int width: matching block width.
+    :param int height: matching block height.
+    :param float tolerance: largest change, in gray levels, of the mean or of
+                            the root mean square of a window for the block
+                            to keep its previous vector. With 0 any change
+                            of the signature triggers a new search.
+    :param str metric: cost of a candidate block, as in block_matching.
+    :param KernelCounters counters: optional, counters of the searches, the
+                                    blocks reused are counted as skipped.
+    :param bool edges: search the blocks of the last line and column, as in
+                       block_matching. Default False.
+    :param bool parallel: default True. With False the serial kernel is
+                          used, as in block_matching.
+
+    After each call the attribute ``dirty`` holds the mask of the blocks
+    that were searched.
+    '''
+
+    def __init__(self, width, height, tolerance=0.0, metric='clamped',
+                 counters=None, edges=False, parallel=True):
+        self.width = width
+        self.height = height
+        self.tolerance = tolerance
+        self.metric = metric
+        self.counters = counters
+        self.edges = edges
+        self.parallel = parallel
+        self.dirty = None
+        self._out = None
+        self._sig0 = None
+        self._sig1 = None
+        self._frame = None
+        self._frame_sig = None
+
+    def reset(self):
+        r'''
+        Forget the previous vectors, the next call searches every block.
+        '''
+        self.dirty = None
+        self._out = None
+        self._sig0 = None
+        self._sig1 = None
+        self._frame = None
+        self._frame_sig = None
+
+    def _changed(self, sig, old):
+        return (abs(sig[0] - old[0]) > self.tolerance) | \
+            (abs(sig[1] - old[1]) > self.tolerance)
+
+    def _match(self, img0, img1, sig0, sig1, compact):
+        hblock, wblock = _grid_shape(img0, img1, self.width, self.height)
+
+        if self._out is None or self._out.shape[0] != hblock * wblock:
+            self._out = zeros((hblock * wblock, 4), dtype=int64)
+            mask = ones((hblock, wblock), dtype=uint8)
+        else:
+            mask = (self._changed(sig0, self._sig0) |
+                    self._changed(sig1, self._sig1)).astype(uint8)
+
+        if mask.any() or self.counters is not None:
+            _search(img0, img1, self.width, self.height, mask, self._out,
+                    parallel=self.parallel, metric=self.metric,
+                    edges=self.edges, counters=self.counters)
+
+        self._sig0 = sig0
+        self._sig1 = sig1
+        self.dirty = mask.astype(bool)
+        return _output(self._out.copy(), hblock, wblock, self.width,
+                       self.height, compact, frame=img0.shape[:2])
+
+    def match(self, img0, img1, compact=None):
+        r'''
+        Block matching reusing the vectors of the previous call.
+
+        :param 2d_array img0: Image in time t0 + kdt
+        :param 2d_array img1: Image in time t0 + (k+1)dt
+        :param str compact: output format, as in block_matching.
+
+        :return: the same as block_matching.
+        '''
+        sig0 = window_signature(img0, self.width, self.height)
+        sig1 = window_signature(img1, self.width, self.height)
+        return self._match(img0, img1, sig0, sig1, compact)
+
+    def update(self, frame, compact=None):
+        r'''
+        Match the previous frame given to update with the current one.
+
+        The signature of each frame is computed only once.
+
+        :param 2d_array frame: current frame.
+        :param str compact: output format, as in block_matching.
+
+        :return: None for the first frame, then the same as block_matching.
+        '''
+        sig = window_signature(frame, self.width, self.height)
+        previous, psig = self._frame, self._frame_sig
+        self._frame, self._frame_sig = frame, sig
+        if previous is None:
+            return None
+        return self._match(previous, frame, psig, sig, compact)
+
+    def __call__(self, img0, img1, compact=None):
+        return self.match(img0, img1, compact)
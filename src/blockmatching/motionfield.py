@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Compact motion fields.
+
+The four grids returned by the block matching algorithm carry redundant
+information: the initial positions ``XP, YP`` depend only on the block size
+and on the frame shape, and the final positions ``XD, YD`` differ from them
+by small displacements. The classes of this module store only the
+displacements, as ``int8``/``int16`` grids (:class:`MotionField`) or as a
+sparse list of the moving blocks (:class:`SparseMotion`).
+
+Both forms are accepted directly by :func:`blockmatching.clustering` and by
+:func:`blockmatching.vectormask`.
+
+Example
+-------
+>>> import cv2
+>>> from blockmatching import *
+>>> cap = cv2.VideoCapture('./videos/car.mp4')
+>>> started = False
+>>> old_frame = None
+>>> while cap.isOpened():
+>>>    ret, frame = cap.read()
+>>>    if ret == True:
+>>>        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+>>>        if started is False:
+>>>            old_frame = frame
+>>>            started = True
+>>>        else:
+>>>            motion = block_matching(old_frame, frame, width, height,
+>>>                                    compact='sparse')
+>>>            U, V, object_tops, meand = clustering(motion)
+>>>            maskvector = vectormask(frame, motion)
+>>>            old_frame = frame
+>>>    else:
+>>>         break
+>>>
+>>> cap.release()
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from numpy import arange, int8, int16, int32, int64, zeros, nonzero, minimum
+
+
+def displacement_dtype(width, height):
+    '''
+    Smallest integer type able to hold the displacements of a block.
+
+    :parameter int width: block width in pixels.
+    :parameter int height: block height in pixels.
+
+    :return dtype: int8 for blocks smaller than 128 pixels, int16 otherwise.
+    '''
+    if max(width, height) < 128:
+        return int8
+    return int16
+
+
+def _starts(index, size, length=None):
+    "Position of the blocks of the given index, inside length pixels."
+    start = index * size + size // 2
+    if length is not None:
+        # The last blocks are moved inside the frame, as by the kernel.
+        start = minimum(start, length - size)
+    return start
+
+
+def block_origins(shape, width, height, frame=None):
+    '''
+    Initial position of each block of the matching grid.
+
+    :parameter tuple shape: (lines, columns) of the block grid.
+    :parameter int width: block width in pixels.
+    :parameter int height: block height in pixels.
+    :parameter tuple frame: optional (lines, columns) of the matched images.
+                            The last line and column of blocks are then
+                            inside the frame, as searched with edges=True.
+
+    :return 2d_array XP: 2d int64 array - Grid with initial x (line).
+    :return 2d_array YP: 2d int64 array - Grid with initial y (column).
+    '''
+    hblock, wblock = shape
+    lins, cols = (None, None) if frame is None else frame[:2]
+    XP = zeros(shape, dtype=int64)
+    YP = zeros(shape, dtype=int64)
+    XP[:, :] = _starts(arange(hblock), height, lins)[:, None]
+    YP[:, :] = _starts(arange(wblock), width, cols)[None, :]
+    return XP, YP
+
+
+class MotionField:
+    r'''
+    Dense displacement grids.
+
+    :param 2d_array dy: displacement, in lines, of each block.
+    :param 2d_array dx: displacement, in columns, of each block.
+    :param int width: block width in pixels.
+    :param int height: block height in pixels.
+    :param tuple frame: optional (lines, columns) of the matched images,
+                        for the origins of the last blocks, see
+                        :func:`block_origins`.
+
+    The instance unpacks as ``dy, dx``.
+    '''
+
+    def __init__(self, dy, dx, width, height, frame=None):
+        self.dy = dy
+        self.dx = dx
+        self.width = width
+        self.height = height
+        self.frame = frame
+
+    def __iter__(self):
+        return iter((self.dy, self.dx))
+
+    @property
+    def shape(self):
+        r'''
+        Shape of the block grid.
+        '''
+        return self.dy.shape
+
+    def origins(self):
+        r'''
+        Initial position of each block.
+
+        :return 2d_array XP: Grid with initial x (line).
+        :return 2d_array YP: Grid with initial y (column).
+        '''
+        return block_origins(self.shape, self.width, self.height,
+                             self.frame)
+
+    def grids(self):
+        r'''
+        The four grids returned by the block matching algorithm.
+
+        :return 2d_array XP: Grid with initial x
+        :return 2d_array YP: Grid with initial y
+        :return 2d_array XD: Final matching Grid with x
+        :return 2d_array YD: Final matching Grid with y
+        '''
+        XP, YP = self.origins()
+        return XP, YP, XP + self.dy, YP + self.dx
+
+    def sparse(self):
+        r'''
+        Moving blocks as a :class:`SparseMotion`.
+        '''
+        rows, cols = nonzero((self.dy != 0) | (self.dx != 0))
+        return SparseMotion(rows.astype(int32), cols.astype(int32),
+                            self.dy[rows, cols], self.dx[rows, cols],
+                            self.shape, self.width, self.height,
+                            self.frame)
+
+
+class SparseMotion:
+    r'''
+    Coordinate list (COO) of the moving blocks.
+
+    :param 1d_array rows: block line of each moving block, in raster order.
+    :param 1d_array cols: block column of each moving block.
+    :param 1d_array dy: displacement, in lines, of each moving block.
+    :param 1d_array dx: displacement, in columns, of each moving block.
+    :param tuple shape: shape of the full block grid.
+    :param int width: block width in pixels.
+    :param int height: block height in pixels.
+    :param tuple frame: optional (lines, columns) of the matched images,
+                        for the origins of the last blocks, see
+                        :func:`block_origins`.
+
+    The instance unpacks as ``rows, cols, dy, dx``.
+    '''
+
+    def __init__(self, rows, cols, dy, dx, shape, width, height,
+                 frame=None):
+        self.rows = rows
+        self.cols = cols
+        self.dy = dy
+        self.dx = dx
+        self.shape = tuple(shape)
+        self.width = width
+        self.height = height
+        self.frame = frame
+
+    def __iter__(self):
+        return iter((self.rows, self.cols, self.dy, self.dx))
+
+    def __len__(self):
+        return self.rows.size
+
+    def origins(self):
+        r'''
+        Initial position, in pixels, of each moving block.
+
+        :return 1d_array x: initial line of each moving block.
+        :return 1d_array y: initial column of each moving block.
+        '''
+        lins, cols = (None, None) if self.frame is None else self.frame[:2]
+        x = _starts(self.rows.astype(int64), self.height, lins)
+        y = _starts(self.cols.astype(int64), self.width, cols)
+        return x, y
+
+    def dense(self):
+        r'''
+        Moving blocks as a :class:`MotionField`.
+        '''
+        dy = zeros(self.shape, dtype=self.dy.dtype)
+        dx = zeros(self.shape, dtype=self.dx.dtype)
+        dy[self.rows, self.cols] = self.dy
+        dx[self.rows, self.cols] = self.dx
+        return MotionField(dy, dx, self.width, self.height, self.frame)
+
+    def sparse(self):
+        r'''
+        The instance itself, for symmetry with :class:`MotionField`.
+        '''
+        return self
@@ -47,15 +47,35 @@ Copyright [2019] [E. S. Pereira]
    See the License for the specific language governing permissions and
    limitations under the License.
 """
-from numpy import zeros_like, ones
+from numpy import zeros_like, arange
 from scipy.ndimage.filters import gaussian_filter
 
+from .clusters import Clusters
+
+
+def _paint(frame, rows, cols, width, height):
+    """
+    Copy of frame with only the blocks at (rows, cols).
+    """
+    lins, ncols = frame.shape[:2]
+    ii = (rows[:, None, None] + arange(height)[None, :, None]).repeat(
+        width, axis=2).ravel()
+    jj = (cols[:, None, None] + arange(width)[None, None, :]).repeat(
+        height, axis=1).ravel()
+    inside = (ii >= 0) & (ii < lins) & (jj >= 0) & (jj < ncols)
+    ii = ii[inside]
+    jj = jj[inside]
+    tmp = zeros_like(frame)
+    tmp[ii, jj] = frame[ii, jj]
+    return tmp
+
+
 def layers(frame, object_tops, width, height, sigma=7):
     '''
     Parameter:
     :parameter 2d_array frame: 2d array representing the current  image frame.
-    :parameter list object_tops: list of lists with x, y for each graph from clustering
-                     algorithm.
+    :parameter Clusters object_tops: clusters from clustering algorithm, or
+                     list of lists with x, y for each graph.
     :parameter int width: int - width used in block matching algorithm (size of block)
     :parameter int height: int - height used in block matching algorithm (size of block)
     :parameter int sigma: int - default 7. Used to create a smoothed mask to separete
@@ -63,12 +83,13 @@ def layers(frame, object_tops, width, height, sigma=7):
     Return:
     :return list layers: list of 2d array like frame.
     '''
+    if not isinstance(object_tops, Clusters):
+        object_tops = Clusters.from_tops(object_tops)
+
     layers = []
-    for clt in object_tops:
-        tmp = zeros_like(frame)
-        for i, j in clt:
-            tmp[i: i + height, j: j + width] = frame[i: i + height,
-                                                     j: j + width]
+    for k in range(len(object_tops)):
+        rows, cols = object_tops.blocks(k)
+        tmp = _paint(frame, rows, cols, width, height)
         dst = gaussian_filter(tmp, sigma=sigma)
         tmp = zeros_like(frame)
         tmp[dst != 0] = frame[dst!=0]
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Per-stage timing and statistics of the pipelines.
+
+A :class:`PipelineStats` given to the ``dlayers`` or ``forecasting``
+decorators records, for each frame, the wall time spent in each stage
+(background subtraction, block matching, clustering, layers, vector mask and
+forecast), the number of moving blocks, the number of connected components
+and the queue depth. The last ``window`` frames are kept to compute rolling
+percentiles.
+
+The queue depth is the number of frames waiting behind the one finished:
+the frames in flight of the process and async runners and, with a latency
+budget, the frames that arrived at the source while the pipeline was late.
+A plain ``dlayers`` pulls its frames when it is ready, it has no queue and
+records no depth.
+
+Without a stats object the pipelines only pay a ``None`` test per stage.
+
+Example
+-------
+>>> import cv2
+>>> from blockmatching import *
+>>>
+>>> stats = PipelineStats(window=500)
+>>>
+>>> @dlayers(alpha=0.01, width=9, height=9, stats=stats)
+>>> def background(videofile):
+>>>     cap = cv2.VideoCapture(videofile)
+>>>     while cap.isOpened():
+>>>         ret, frame = cap.read()
+>>>         if ret == True:
+>>>             frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+>>>             yield frame
+>>>
+>>> for bg, fg, mask, meand, layers in background("./videos/car.mp4"):
+>>>     pass
+>>>
+>>> print(stats.summary()['matching'])
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from collections import defaultdict, deque
+from itertools import count
+from time import perf_counter
+
+from numpy import percentile, array, count_nonzero
+
+
+def moving_blocks(x0, y0, x1, y1):
+    r'''
+    Number of blocks with non null displacement.
+
+    :param 2d_array x0: Grid with x initial position of vector
+    :param 2d_array y0: Grid with y initial position of vector
+    :param 2d_array x1: Grid with x final position of vector
+    :param 2d_array y1: Grid with y final position of vector
+
+    :return int: number of moving blocks.
+    '''
+    return int(count_nonzero((x0 != x1) | (y0 != y1)))
+
+
+class FrameTimer:
+    r'''
+    Wall time of the stages of one frame.
+
+    Created by :meth:`PipelineStats.start`. Each call to :meth:`lap` closes
+    the current stage and starts the next one.
+    '''
+
+    def __init__(self, index):
+        self.index = index
+        self.start = perf_counter()
+        self._last = self.start
+        self.stages = {}
+
+    def lap(self, stage):
+        r'''
+        Record the time since the previous lap as the time of stage.
+
+        :param str stage: name of the stage that just finished.
+        '''
+        now = perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._last
+        self._last = now
+
+
+class PipelineStats:
+    r'''
+    Rolling statistics of the frames processed by a pipeline.
+
+    :param int window: number of frames kept to compute the percentiles.
+    :param callable callback: optional function called with a dict
+                              describing each finished frame.
+    :param callable queue: optional function that returns the number of
+                           frames waiting in the pipeline, recorded as the
+                           queue depth of the frames finished without one.
+                           The runners with queues, as AsyncMotionPipeline,
+                           set it when it is None.
+    '''
+
+    def __init__(self, window=1000, callback=None, queue=None):
+        self.window = window
+        self.callback = callback
+        self.queue = queue
+        self.frames = 0
+        self._started = count()
+        self._times = defaultdict(lambda: deque(maxlen=self.window))
+        self._counts = defaultdict(lambda: deque(maxlen=self.window))
+
+    def start(self, index=None):
+        r'''
+        Start the timing of a new frame.
+
+        :param int index: optional, index of the frame in the stream. By
+                          default the frames are numbered in the order of
+                          the calls to start, the runners that start several
+                          frames before finishing them get distinct indices.
+
+        :return FrameTimer timer: timer of the frame.
+        '''
+        started = next(self._started)
+        return FrameTimer(started if index is None else index)
+
+    def finish(self, timer, moving_blocks=None, components=None,
+               queue_depth=None):
+        r'''
+        Record a finished frame.
+
+        :param FrameTimer timer: timer returned by :meth:`start`.
+        :param int moving_blocks: number of blocks with displacement.
+        :param int components: number of connected moving objects.
+        :param int queue_depth: number of frames waiting in the pipeline.
+        '''
+        total = perf_counter() - timer.start
+        if queue_depth is None and self.queue is not None:
+            queue_depth = self.queue()
+        for stage, elapsed in timer.stages.items():
+            self._times[stage].append(elapsed)
+        self._times['total'].append(total)
+
+        counts = {'moving_blocks': moving_blocks,
+                  'components': components,
+                  'queue_depth': queue_depth}
+        for name, value in counts.items():
+            if value is not None:
+                self._counts[name].append(value)
+
+        self.frames += 1
+        if self.callback is not None:
+            record = {'frame': timer.index, 'total': total}
+            record.update(timer.stages)
+            record.update(counts)
+            self.callback(record)
+
+    def stages(self):
+        r'''
+        Names of the recorded stages.
+        '''
+        return list(self._times.keys())
+
+    def percentiles(self, name, q=(50, 90, 99)):
+        r'''
+        Rolling percentiles of a stage time or of a counter.
+
+        :param str name: stage name, 'total', 'moving_blocks', 'components'
+                         or 'queue_depth'.
+        :param tuple q: percentiles to compute.
+
+        :return list: one value for each percentile.
+        '''
+        values = self._times.get(name, self._counts.get(name))
+        if not values:
+            return [None] * len(q)
+        return [float(v) for v in percentile(array(values), q)]
+
+    def summary(self, q=(50, 90, 99)):
+        r'''
+        Rolling statistics of every stage and counter.
+
+        :return dict: for each name a dict with the count, the mean, the
+                      maximum and the percentiles ('p50', 'p90', ...).
+        '''
+        out = {}
+        for group in (self._times, self._counts):
+            for name, values in group.items():
+                if not values:
+                    continue
+                values = array(values)
+                item = {'count': int(values.size),
+                        'mean': float(values.mean()),
+                        'max': float(values.max())}
+                for qi, value in zip(q, percentile(values, q)):
+                    item['p{}'.format(qi)] = float(value)
+                out[name] = item
+        return out
+
+    def reset(self):
+        r'''
+        Forget all recorded frames.
+        '''
+        self.frames = 0
+        self._started = count()
+        self._times.clear()
+        self._counts.clear()
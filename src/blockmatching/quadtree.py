@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Variable block size matching with an adaptive quadtree.
+
+``block_matching`` uses one block size for the whole frame: small blocks are
+needed on the borders of the objects, while large uniform regions, as sky or
+road, waste work. :func:`quadtree_matching` starts from large blocks and
+splits a block in four only when its best cost, per pixel, is larger than a
+threshold or when its vector disagrees with the vectors of its neighbors.
+The number of matched blocks follows the complexity of the scene instead of
+the resolution.
+
+The initial blocks search the displacements from -radius to radius in lines
+and columns, with the cost functions of ``block_matching``. The four blocks
+of a split search around the vector of their parent, with half of the
+radius of the parent (at least one pixel), which keeps the small blocks from
+the false matches of a large search. As in ``block_matching`` the zero
+displacement is tested first and wins the ties.
+
+The result is a :class:`QuadTree` with the position, the size and the vector
+of each leaf, that can be rasterized in a per-pixel displacement field.
+
+Example
+-------
+>>> from blockmatching import *
+>>> tree = quadtree_matching(img0, img1, size=32, min_size=4, threshold=8)
+>>> print(len(tree), tree.heights.min())
+>>> dy, dx = tree.raster()
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from numba import njit, prange
+from numpy import arange, concatenate, zeros, empty, int64, float64
+
+from .blockmatching import METRICS, ImageSizeError, BlockError, _prepare
+
+
+def _make_list_kernel(cost, prep):
+    """
+    Kernel matching a list of blocks of any size with the cost function.
+    """
+    def kernel(img0, img1, s1, q1, rows, cols, heights, widths, cy, cx,
+               radius, out):
+        """
+        input:
+            img0, img1 - 2d arrays - images in time t and t + dt
+            s1, q1 - 2d float64 arrays - integral images of img1
+            rows, cols - 1d int64 arrays - first pixel of each block
+            heights, widths - 1d int64 arrays - size of each block
+            cy, cx - 1d int64 arrays - center of the search of each block
+            radius - int64 - largest distance to the center searched
+            out - 2d float64 array - n x 3, displacement in lines, in
+                  columns and cost of each block.
+        """
+        lins, ncols = img0.shape
+        for k in prange(rows.size):
+            r0 = rows[k]
+            c0 = cols[k]
+            h = heights[k]
+            w = widths[k]
+            m0, n0 = prep(img0, r0, c0, h, w)
+            best = cost(img0, img1, s1, q1, r0, c0, r0, c0, h, w, m0, n0)
+            bdy = 0
+            bdx = 0
+            for dy in range(cy[k] - radius, cy[k] + radius + 1):
+                r1 = r0 + dy
+                if r1 < 0 or r1 + h > lins:
+                    continue
+                for dx in range(cx[k] - radius, cx[k] + radius + 1):
+                    c1 = c0 + dx
+                    if c1 < 0 or c1 + w > ncols:
+                        continue
+                    if dy == 0 and dx == 0:
+                        continue
+                    diff = cost(img0, img1, s1, q1, r0, c0, r1, c1, h, w,
+                                m0, n0)
+                    if diff < best:
+                        best = diff
+                        bdy = dy
+                        bdx = dx
+            out[k, 0] = bdy
+            out[k, 1] = bdx
+            out[k, 2] = best
+        return out
+
+    return njit(parallel=True, nogil=True)(kernel)
+
+
+_LIST_KERNELS = {}
+
+
+def _list_kernel(metric):
+    "Kernel of the metric, compiled at the first call."
+    if metric not in _LIST_KERNELS:
+        if metric not in METRICS:
+            raise ValueError("Unknown metric {}, use one of {}".format(
+                metric, ", ".join(sorted(METRICS))))
+        _LIST_KERNELS[metric] = _make_list_kernel(*METRICS[metric])
+    return _LIST_KERNELS[metric]
+
+
+@njit(nogil=True)
+def _paint(field, rows, cols, heights, widths, values):
+    "Fill the rectangle of each block of field with its value."
+    for k in range(rows.size):
+        field[rows[k]:rows[k] + heights[k],
+              cols[k]:cols[k] + widths[k]] = values[k]
+
+
+@njit(nogil=True)
+def _disagreement(fdy, fdx, rows, cols, heights, widths, dy, dx):
+    """
+    Largest difference, in lines or columns, between the vector of each
+    block and the vectors of the pixels just outside its borders.
+    """
+    lins, ncols = fdy.shape
+    out = zeros(rows.size, dtype=int64)
+    for k in range(rows.size):
+        r0 = rows[k]
+        c0 = cols[k]
+        r1 = r0 + heights[k]
+        c1 = c0 + widths[k]
+        worst = 0
+        for i in range(r0, r1):
+            for j in (c0 - 1, c1):
+                if 0 <= j < ncols:
+                    worst = max(worst, abs(fdy[i, j] - dy[k]),
+                                abs(fdx[i, j] - dx[k]))
+        for j in range(c0, c1):
+            for i in (r0 - 1, r1):
+                if 0 <= i < lins:
+                    worst = max(worst, abs(fdy[i, j] - dy[k]),
+                                abs(fdx[i, j] - dx[k]))
+        out[k] = worst
+    return out
+
+
+class QuadTree:
+    r'''
+    Leaves of the adaptive block matching.
+
+    :param tuple shape: (lines, columns) of the frames.
+    :param 1d_array rows: first line of each leaf.
+    :param 1d_array cols: first column of each leaf.
+    :param 1d_array heights: number of lines of each leaf.
+    :param 1d_array widths: number of columns of each leaf.
+    :param 1d_array dy: displacement in lines of each leaf.
+    :param 1d_array dx: displacement in columns of each leaf.
+    :param 1d_array cost: best cost, per pixel, of each leaf.
+    :param 1d_array level: number of splits from the initial block.
+    '''
+
+    def __init__(self, shape, rows, cols, heights, widths, dy, dx, cost,
+                 level):
+        self.shape = tuple(shape)
+        self.rows = rows
+        self.cols = cols
+        self.heights = heights
+        self.widths = widths
+        self.dy = dy
+        self.dx = dx
+        self.cost = cost
+        self.level = level
+
+    def __len__(self):
+        return self.rows.size
+
+    def raster(self):
+        r'''
+        Per pixel displacement field.
+
+        :return 2d_array dy: displacement in lines of each pixel.
+        :return 2d_array dx: displacement in columns of each pixel.
+        '''
+        dy = zeros(self.shape, dtype=int64)
+        dx = zeros(self.shape, dtype=int64)
+        _paint(dy, self.rows, self.cols, self.heights, self.widths, self.dy)
+        _paint(dx, self.rows, self.cols, self.heights, self.widths, self.dx)
+        return dy, dx
+
+
+def _root_blocks(shape, size):
+    "Blocks of the first level, the ones on the borders are clipped."
+    lins, cols = shape
+    r = arange(0, lins, size)
+    c = arange(0, cols, size)
+    rows = r.repeat(c.size)
+    cols = (c[None, :].repeat(r.size, axis=0)).ravel()
+    return rows, cols, (lins - rows).clip(max=size), \
+        (shape[1] - cols).clip(max=size)
+
+
+def _children(rows, cols, heights, widths, cy, cx, half):
+    """
+    The four quadrants of each block, with the vector of the block as the
+    center of their search. The empty quadrants are dropped.
+    """
+    out = [[] for _ in range(6)]
+    for di, dj in ((0, 0), (0, 1), (1, 0), (1, 1)):
+        h = (heights - di * half).clip(0, half)
+        w = (widths - dj * half).clip(0, half)
+        keep = (h > 0) & (w > 0)
+        for lst, val in zip(out, (rows + di * half, cols + dj * half, h, w,
+                                  cy, cx)):
+            lst.append(val[keep])
+    return [concatenate(lst) for lst in out]
+
+
+def quadtree_matching(img0, img1, size=32, min_size=4, threshold=10.0,
+                      disagreement=1, radius=None, metric='sad',
+                      rasterize=False, cache=None, keys=None):
+    '''
+    Block matching with blocks that are split where the scene needs them.
+
+    :parameter 2d_array img0: Image in time t0 + kdt
+    :parameter 2d_array img1: Image in time t0 + (k+1)dt
+    :parameter int size: size of the initial blocks, in pixels.
+    :parameter int min_size: smallest block size. The sizes are size,
+                             size // 2, ... down to min_size.
+    :parameter float threshold: largest best cost, per pixel, of a leaf. For
+                                'sad' it is the mean absolute difference in
+                                gray levels, for 'zncc' one minus the
+                                correlation.
+    :parameter int disagreement: largest difference, in pixels, between the
+                                 vector of a leaf and the vectors around it.
+                                 None disables the test.
+    :parameter int radius: largest displacement searched by the initial
+                           blocks, default size // 2.
+    :parameter str metric: cost of a candidate block, as in block_matching.
+                           Default 'sad'.
+    :parameter bool rasterize: with True return the per pixel field instead
+                               of the tree.
+    :parameter FrameCache cache: optional, keeps the data derived from the
+                                 frames for the next calls, see
+                                 block_matching.
+    :parameter tuple keys: optional, (key0, key1) of the frames in the cache.
+
+    :return QuadTree tree: the leaves, or with rasterize=True the 2d arrays
+                           dy, dx with the displacement of each pixel.
+    '''
+    if img0.shape != img1.shape:
+        raise ImageSizeError("The images have diferent shapes")
+    if min_size < 1 or size < min_size:
+        raise BlockError("size must be larger than min_size.")
+
+    if radius is None:
+        radius = size // 2
+    kernel = _list_kernel(metric)
+    img0, img1, s1, q1 = _prepare(img0, img1, metric, cache,
+                                  (None, None) if keys is None else keys)
+
+    shape = img0.shape
+    fdy = zeros(shape, dtype=int64)
+    fdx = zeros(shape, dtype=int64)
+    leaves = []
+
+    rows, cols, heights, widths = _root_blocks(shape, size)
+    cy = zeros(rows.size, dtype=int64)
+    cx = zeros(rows.size, dtype=int64)
+    level = 0
+    while rows.size > 0:
+        res = kernel(img0, img1, s1, q1, rows, cols, heights, widths, cy, cx,
+                     max(radius >> level, 1),
+                     empty((rows.size, 3), dtype=float64))
+        dy = res[:, 0].astype(int64)
+        dx = res[:, 1].astype(int64)
+        cost = res[:, 2]
+        if metric != 'zncc':
+            cost = cost / (heights * widths)
+        _paint(fdy, rows, cols, heights, widths, dy)
+        _paint(fdx, rows, cols, heights, widths, dx)
+
+        half = size >> (level + 1)
+        split = cost > threshold
+        if disagreement is not None:
+            split |= _disagreement(fdy, fdx, rows, cols, heights, widths,
+                                   dy, dx) > disagreement
+        if half < min_size:
+            split[:] = False
+
+        keep = ~split
+        leaves.append((rows[keep], cols[keep], heights[keep], widths[keep],
+                       dy[keep], dx[keep], cost[keep],
+                       zeros(keep.sum(), dtype=int64) + level))
+
+        rows, cols, heights, widths, cy, cx = _children(
+            rows[split], cols[split], heights[split], widths[split],
+            dy[split], dx[split], half)
+        level += 1
+
+    tree = QuadTree(shape, *[concatenate(arr) for arr in zip(*leaves)])
+    if rasterize:
+        return tree.raster()
+    return tree
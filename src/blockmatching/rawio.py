@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Memory mapped frame sources and sinks.
+
+Decoding a video costs more than the background subtraction of its frames.
+For offline work and for reproducible benchmarks the frames can be converted
+once to a raw array, a ``(N, H, W)`` ``.npy`` file or a raw file without
+header, and read again through memory mapping: :class:`MemmapSource` yields
+read only views of the mapped file, without decoding and without copying the
+frames, to ``dlayers``, ``forecasting`` or to ``block_matching`` with
+:meth:`MemmapSource.pairs`.
+
+:class:`MemmapSink` writes the outputs of a pipeline, foregrounds, vector
+masks, layers or forecasts, in preallocated memory mapped ``.npy`` files,
+one per output, with one entry per frame. The files are created at the first
+array written, with the shape of that array.
+
+Example
+-------
+>>> from blockmatching import *
+>>> from blockmatching.batch import video_frames
+>>>
+>>> save_raw(video_frames('car.mp4'), 'car.raw')
+>>> source = MemmapSource('car.raw', shape=(480, 640))
+>>>
+>>> @dlayers(alpha=0.01, width=9, height=9)
+>>> def background():
+>>>     yield from source
+>>>
+>>> with MemmapSink('car-out', len(source)) as sink:
+>>>     sink.drain(background(), ('background', 'foreground', 'vectormask',
+>>>                               None, 'layers'))
+>>>
+>>> foregrounds = MemmapSource('car-out/foreground.npy')
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+
+from numpy import asarray, dtype as npdtype, load, memmap, ndarray, int64
+from numpy.lib.format import open_memmap
+
+
+class MemmapSource:
+    r'''
+    Frames of a ``.npy`` or raw file, read through memory mapping.
+
+    :param str path: ``.npy`` file with a (N, H, W) array, or raw file with
+                     the frames one after the other.
+    :param tuple shape: (H, W) of the frames of a raw file. The number of
+                        frames is given by the size of the file.
+    :param dtype: type of the pixels of a raw file, default uint8.
+    :param int offset: bytes before the first frame of a raw file.
+
+    Iterating the source yields read only views of the frames, valid as
+    long as the source exists.
+    '''
+
+    def __init__(self, path, shape=None, dtype='uint8', offset=0):
+        self.path = path
+        if path.endswith('.npy'):
+            array = load(path, mmap_mode='r')
+        else:
+            if shape is None:
+                raise ValueError("The shape of the frames of a raw file is "
+                                 "needed.")
+            dtype = npdtype(dtype)
+            frame = int(shape[0]) * int(shape[1]) * dtype.itemsize
+            count = (os.path.getsize(path) - offset) // frame
+            array = memmap(path, dtype=dtype, mode='r', offset=offset,
+                           shape=(count,) + tuple(shape))
+        if array.ndim != 3:
+            raise ValueError("The frames must be a (N, H, W) array.")
+        # Plain ndarray views of the map, numba does not type memmap.
+        self._array = array.view(ndarray)
+
+    @property
+    def shape(self):
+        r'''
+        (H, W) of the frames.
+        '''
+        return self._array.shape[1:]
+
+    @property
+    def dtype(self):
+        r'''
+        Type of the pixels.
+        '''
+        return self._array.dtype
+
+    def __len__(self):
+        return self._array.shape[0]
+
+    def __getitem__(self, index):
+        return self._array[index]
+
+    def __iter__(self):
+        return self.frames()
+
+    def frames(self, start=0, stop=None, step=1):
+        r'''
+        Views of the frames.
+
+        :param int start: first frame.
+        :param int stop: frame after the last one, default the end.
+        :param int step: step between the frames.
+
+        :return generator: read only 2d arrays.
+        '''
+        for k in range(*slice(start, stop, step).indices(len(self))):
+            yield self._array[k]
+
+    def pairs(self, start=0, stop=None):
+        r'''
+        Consecutive frames, for block_matching.
+
+        :param int start: first frame.
+        :param int stop: frame after the last one, default the end.
+
+        :return generator: (previous, current) views.
+        '''
+        prev = None
+        for frame in self.frames(start, stop):
+            if prev is not None:
+                yield prev, frame
+            prev = frame
+
+
+def save_raw(frames, path, append=False):
+    r'''
+    Write frames in a raw file, to be read by MemmapSource.
+
+    :param iterable frames: 2d arrays with the same shape and type.
+    :param str path: raw file.
+    :param bool append: add the frames at the end of the file.
+
+    :return int count: number of frames written.
+    '''
+    count = 0
+    with open(path, 'ab' if append else 'wb') as out:
+        for frame in frames:
+            out.write(asarray(frame).tobytes())
+            count += 1
+    return count
+
+
+class MemmapSink:
+    r'''
+    Preallocated memory mapped outputs of a pipeline.
+
+    :param str directory: the output ``name`` is written in
+                          directory/name.npy.
+    :param int count: number of frames.
+    :param int max_layers: for the outputs given as lists of arrays, as the
+                           layers, the first max_layers arrays of each frame
+                           are kept, and the number of arrays of each frame
+                           is written in name_count.npy.
+
+    An output given as None in a frame, as the vector mask of the first
+    frame, is left with zeros. The shape of an output is fixed by its first
+    frame: the mean velocities, with a row for each object, are not written.
+    A ValueError is raised for an array of another shape.
+    '''
+
+    def __init__(self, directory, count, max_layers=8):
+        self.directory = directory
+        self.count = count
+        self.max_layers = max_layers
+        self.arrays = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self, name, shape, dtype):
+        if name not in self.arrays:
+            path = os.path.join(self.directory, name + '.npy')
+            self.arrays[name] = open_memmap(path, mode='w+', dtype=dtype,
+                                            shape=(self.count,) +
+                                            tuple(shape))
+        array = self.arrays[name]
+        if array.shape[1:] != tuple(shape):
+            raise ValueError("The output {} has the shape {}, expected {}."
+                             .format(name, tuple(shape), array.shape[1:]))
+        return array
+
+    def put(self, index, **outputs):
+        r'''
+        Write the outputs of one frame.
+
+        :param int index: frame index.
+        :param outputs: name=array, or name=list of arrays.
+        '''
+        for name, value in outputs.items():
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple)):
+                nkeep = min(len(value), self.max_layers)
+                self._open(name + '_count', (), int64)[index] = len(value)
+                if nkeep == 0:
+                    continue
+                first = asarray(value[0])
+                out = self._open(name, (self.max_layers,) + first.shape,
+                                 first.dtype)
+                for k in range(nkeep):
+                    layer = asarray(value[k])
+                    if layer.shape != first.shape:
+                        raise ValueError(
+                            "The output {} has the shape {}, expected {}."
+                            .format(name, layer.shape, first.shape))
+                    out[index, k] = layer
+            else:
+                value = asarray(value)
+                self._open(name, value.shape, value.dtype)[index] = value
+
+    def drain(self, stream, names):
+        r'''
+        Write every frame of a pipeline.
+
+        :param iterable stream: outputs of a pipeline, as dlayers.
+        :param tuple names: name of each output of the pipeline, None for
+                            the outputs not written.
+
+        :return int frames: number of frames written.
+        '''
+        frames = 0
+        for index, outputs in enumerate(stream):
+            self.put(index, **{name: value
+                               for name, value in zip(names, outputs)
+                               if name is not None})
+            frames += 1
+        return frames
+
+    def flush(self):
+        r'''
+        Write the changes of the maps to the files.
+        '''
+        for array in self.arrays.values():
+            array.flush()
+
+    def close(self):
+        r'''
+        Flush and release the maps.
+        '''
+        self.flush()
+        self.arrays = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
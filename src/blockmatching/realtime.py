@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Deadline-aware processing of live streams.
+
+``dlayers`` and ``forecasting`` process every frame they are given. Behind a
+camera, a slow frame delays the next ones and the latency grows without
+limit. With a latency budget, ``dlayers(..., budget=0.04)``, a
+:class:`LatencyBudget` keeps each frame within the budget:
+
+- the matching is degraded, level by level: the full search, an incremental
+  search of the blocks that changed, the search on frames reduced to half
+  resolution, and the reuse of the last motion field;
+- the frames that arrived while the pipeline was late are skipped, so the
+  frames processed are the recent ones.
+
+The level of each frame is the best one whose expected time fits in the
+budget. The time of the matching at each level and of the other stages
+are followed by moving averages. The estimates of the levels not used decay,
+so the better levels are tried again when a burst ends.
+
+The frames are assumed to come from a live source at a period, by default
+the budget: the lag is the time spent beyond the period by the frames
+processed, and a frame is skipped for each period of lag.
+
+Each result of the pipelines ends with a report, a dict with the frame
+index, the level and its name, the latency of the frame, the lag and the
+number of frames skipped before it.
+
+Example
+-------
+>>> import cv2
+>>> from blockmatching import *
+>>>
+>>> @dlayers(alpha=0.01, width=9, height=9, budget=1 / 25.)
+>>> def camera(device):
+>>>     cap = cv2.VideoCapture(device)
+>>>     while cap.isOpened():
+>>>         ret, frame = cap.read()
+>>>         if ret:
+>>>             yield cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+>>>
+>>> for bg, fg, mask, meand, layers, report in camera(0):
+>>>     print(report['mode'], report['latency'], report['skipped'])
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from time import perf_counter
+
+from numpy import arange, minimum, meshgrid, clip
+
+from .blockmatching import block_matching, BlockError
+from .incremental import IncrementalMatcher
+from .scaling import downsample
+
+# Degradation levels, from the best to the cheapest.
+FULL = 0
+INCREMENTAL = 1
+REDUCED = 2
+REUSE = 3
+LEVELS = ('full', 'incremental', 'reduced', 'reuse')
+
+
+def _doubled(grids, width, height, shape, edges):
+    """
+    Grids of a search on frames at half resolution, in pixels of the frames:
+    the origins are the ones of the blocks of twice the size, the
+    displacements are doubled and kept inside the frames.
+    """
+    XP, YP, XD, YD = grids
+    hblock, wblock = XP.shape
+    lins, cols = shape
+    rows = minimum(arange(hblock) * 2 * height + height, lins - 2 * height)
+    columns = minimum(arange(wblock) * 2 * width + width, cols - 2 * width)
+    XP2, YP2 = meshgrid(rows, columns, indexing='ij')
+    XD2 = clip(XP2 + 2 * (XD - XP), 0, lins - 2 * height)
+    YD2 = clip(YP2 + 2 * (YD - YP), 0, cols - 2 * width)
+    out = (XP2, YP2, XD2, YD2)
+    if not edges:
+        # The blocks of the last line and column are not searched.
+        for grid in out:
+            grid[-1, :] = 0
+            grid[:, -1] = 0
+    return out
+
+
+class LatencyBudget:
+    r'''
+    Degradation of the matching of a stream to keep a latency budget.
+
+    :param int width: matching block width.
+    :param int height: matching block height.
+    :param float budget: latency budget of a frame, in seconds.
+    :param float period: time between two frames of the source, in seconds.
+                         Default the budget.
+    :param str metric: cost of a candidate block, as in block_matching.
+    :param float incremental: tolerance of the incremental search. With it
+                              the full level also reuses the blocks that did
+                              not change, as dlayers(incremental=...).
+                              Default 0.
+    :param float headroom: fraction of the budget the expected time of a
+                           level must fit in. Default 0.8.
+    :param float smoothing: weight of the last frame in the moving averages.
+    :param float decay: factor applied at each frame to the estimates of the
+                        levels not used.
+    :param int max_level: cheapest level allowed, default REUSE.
+    :param bool edges: search the blocks of the last line and column, as in
+                       block_matching. Default False.
+    :param bool parallel: default True. With False the serial kernels are
+                          used, as in block_matching.
+    :param callable clock: time in seconds, default perf_counter.
+
+    Attributes ``level`` (level of the next frame), ``lag``, ``frames``
+    (frames processed) and ``skipped`` (frames skipped) follow the stream.
+    '''
+
+    def __init__(self, width, height, budget, period=None, metric='clamped',
+                 incremental=None, headroom=0.8, smoothing=0.5, decay=0.95,
+                 max_level=REUSE, clock=perf_counter, edges=False,
+                 parallel=True):
+        if budget <= 0:
+            raise ValueError("The budget must be positive.")
+        self.width = width
+        self.height = height
+        self.budget = budget
+        self.period = budget if period is None else period
+        self.metric = metric
+        self.headroom = headroom
+        self.smoothing = smoothing
+        self.decay = decay
+        self.max_level = max_level
+        self.clock = clock
+        self.edges = edges
+        self.parallel = parallel
+        self.matcher = IncrementalMatcher(
+            width, height, 0.0 if incremental is None else incremental,
+            metric, edges=edges, parallel=parallel)
+        self.incremental = incremental is not None
+        self.reset()
+
+    def reset(self):
+        r'''
+        Forget the times and the last motion field.
+        '''
+        self.costs = [None] * len(LEVELS)
+        self.other = 0.0
+        self.level = FULL
+        self.lag = 0.0
+        self.frames = 0
+        self.skipped = 0
+        self._index = -1
+        self._skipped = 0
+        self._start = None
+        self._used = FULL
+        self._matching = 0.0
+        self._last = None
+
+    def stale(self):
+        r'''
+        Tell if the frame just received must be skipped. Call it for each
+        frame of the source.
+
+        :return bool: True when the pipeline is late by a period or more.
+        '''
+        self._index += 1
+        if self._index > 0 and self.lag >= self.period:
+            self.lag -= self.period
+            self.skipped += 1
+            self._skipped += 1
+            return True
+        return False
+
+    def backlog(self):
+        r'''
+        Frames of the source waiting behind the frame being processed.
+
+        :return int: whole periods of lag, counting the time spent on the
+                     frame so far.
+        '''
+        lag = self.lag
+        if self._start is not None:
+            lag += self.clock() - self._start - self.period
+        return max(0, int(lag // self.period))
+
+    def begin(self):
+        r'''
+        Start the timing of a frame and choose its level.
+
+        :return int: the level.
+        '''
+        self._start = self.clock()
+        self._matching = 0.0
+        self._used = FULL
+        target = self.headroom * self.budget
+        self.level = self.max_level
+        for level in range(self.max_level + 1):
+            cost = self.costs[level]
+            # A level never measured is tried.
+            if cost is None or self.other + cost <= target:
+                self.level = level
+                break
+        return self.level
+
+    def _search(self, img0, img1, level):
+        "Grids and block size of the search at one level."
+        if level == REDUCED:
+            try:
+                grids = block_matching(downsample(img0, 0.5),
+                                       downsample(img1, 0.5), self.width,
+                                       self.height, metric=self.metric,
+                                       edges=self.edges,
+                                       parallel=self.parallel)
+            except BlockError:
+                return None
+            return _doubled(grids, self.width, self.height, img0.shape,
+                            self.edges), 2 * self.width, 2 * self.height
+        if level == INCREMENTAL or self.incremental:
+            grids = self.matcher.match(img0, img1)
+        else:
+            grids = block_matching(img0, img1, self.width, self.height,
+                                   metric=self.metric, edges=self.edges,
+                                   parallel=self.parallel)
+        return grids, self.width, self.height
+
+    def match(self, img0, img1):
+        r'''
+        Block matching at the level of the frame.
+
+        :param 2d_array img0: Image in time t0 + kdt
+        :param 2d_array img1: Image in time t0 + (k+1)dt
+
+        :return tuple grids: XP, YP, XD, YD, as block_matching. At the
+                             reduced level the blocks cover two times more
+                             pixels, the positions and displacements are in
+                             pixels of the frames.
+        :return int width: width of the blocks of the grids.
+        :return int height: height of the blocks of the grids.
+        :return int level: the level used, REUSE when the last field is
+                           returned. The grids must not be changed.
+        '''
+        start = self.clock()
+        level = self.level
+        if level == REUSE and self._last is None:
+            level = FULL
+        if level == REUSE:
+            result = self._last
+        else:
+            result = self._search(img0, img1, level)
+        if result is None:
+            # Frames too small for the reduced search.
+            level = FULL
+            result = self._search(img0, img1, level)
+        self._last = result
+        self._used = level
+        self._matching = self.clock() - start
+        return result[0], result[1], result[2], level
+
+    def _average(self, old, new):
+        if old is None:
+            return new
+        return (1.0 - self.smoothing) * old + self.smoothing * new
+
+    def finish(self):
+        r'''
+        Close the timing of a frame.
+
+        :return dict report: frame, level, mode (name of the level),
+                             latency (seconds), lag (seconds) and skipped
+                             (frames skipped before this one).
+        '''
+        latency = self.clock() - self._start
+        used = self._used
+        if self._matching > 0:
+            self.costs[used] = self._average(self.costs[used],
+                                             self._matching)
+        for level in range(len(LEVELS)):
+            if level != used and self.costs[level] is not None:
+                self.costs[level] *= self.decay
+        self.other = self._average(self.other if self.frames else None,
+                                   latency - self._matching)
+        self.lag = max(0.0, self.lag + latency - self.period)
+        self.frames += 1
+        report = dict(frame=self._index, level=used, mode=LEVELS[used],
+                      latency=latency, lag=self.lag, skipped=self._skipped)
+        self._skipped = 0
+        return report
+
+
+def _backlog(deadline):
+    "Frames waiting at the source of a pipeline, None without a budget."
+    if deadline is None:
+        return None
+    return deadline.backlog()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Reduced resolution processing.
+
+For coarse analytics the background subtraction, the block matching and the
+clustering can run at half or quarter resolution, with 4 to 16 times less
+work. The pipelines given a ``scale`` downsample each frame once with
+:func:`downsample`, run their stages on the small frame and bring only the
+outputs back to the input size: the background and the foreground with
+:func:`upsample`, the layers with :func:`full_layers`, which takes the
+pixels of the full resolution frame inside the upsampled layer masks, and
+the displacements divided by the scale.
+
+Example
+-------
+>>> from blockmatching import *
+>>>
+>>> @dlayers(alpha=0.01, width=9, height=9, scale=0.5)
+>>> def background(videofile):
+>>>     ...
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import cv2
+from numpy import zeros_like
+
+
+def downsample(frame, scale):
+    r'''
+    Frame at the processing resolution.
+
+    :param 2d_array frame: full resolution frame.
+    :param float scale: scale factor, 1 returns the frame itself.
+
+    :return 2d_array frame: frame resized by scale, averaging the pixels.
+    '''
+    if scale == 1:
+        return frame
+    if not 0 < scale < 1:
+        raise ValueError("scale must be in (0, 1].")
+    return cv2.resize(frame, None, fx=scale, fy=scale,
+                      interpolation=cv2.INTER_AREA)
+
+
+def upsample(image, shape, nearest=False, copy=False):
+    r'''
+    Image back at the input resolution.
+
+    :param 2d_array image: low resolution image.
+    :param tuple shape: (lines, columns) of the full resolution frame.
+    :param bool nearest: with True the pixels are replicated, for masks.
+    :param bool copy: with True a new array is returned also at the input
+                      resolution.
+
+    :return 2d_array image: image with the given shape.
+    '''
+    if image.shape[:2] == tuple(shape[:2]):
+        return image.copy() if copy else image
+    interpolation = cv2.INTER_NEAREST if nearest else cv2.INTER_LINEAR
+    return cv2.resize(image, (shape[1], shape[0]),
+                      interpolation=interpolation)
+
+
+def full_layers(frame, small_layers):
+    r'''
+    Layers at the input resolution.
+
+    :param 2d_array frame: full resolution frame.
+    :param list small_layers: layers computed on the low resolution frame.
+
+    :return list layers: for each layer, the pixels of frame inside the
+                         upsampled layer mask.
+    '''
+    out = []
+    for small in small_layers:
+        inside = upsample((small != 0).view('uint8'), frame.shape,
+                          nearest=True) != 0
+        layer = zeros_like(frame)
+        layer[inside] = frame[inside]
+        out.append(layer)
+    return out
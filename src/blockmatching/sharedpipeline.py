@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Multi-process pipeline with shared memory frames.
+
+The clustering and layer stages are Python code that holds the GIL, so a
+``dlayers`` pipeline only scales with processes. Sending the frames and the
+layers through multiprocessing queues pickles megabytes per frame, which
+costs more than the matching itself.
+
+Here the frames, the foregrounds, the vector masks and the layers live in
+:class:`SharedRing` buffers of shared memory. The main process runs the
+background subtraction, which carries the sequential state and is cheap,
+writes each frame and foreground once in a ring slot and sends to the worker
+processes only the slot indices. The workers run block matching,
+clustering, layers and the vector mask on views of the slots and write the
+outputs in slots of the output rings. The results are yielded in the order
+of the frames, and a slot is reclaimed when every task that reads it has
+finished and the consumer has moved on to the next result. The output slots
+are the reorder buffer: a frame finished before an earlier one waits in its
+slot, and no frame is sent to the workers while every output slot is taken,
+so the memory stays bounded when one frame is slow.
+
+With a :class:`PipelineState` a long recording can be processed in pieces:
+the state follows the frames yielded, not the ones already produced, and a
+loaded state resumes the stream as in ``dlayers``.
+
+The shared slots are reused by the next frames and freed when the stream
+ends, so the foreground, the vector mask and the layers are copied out of
+them when a frame is yielded: the results stay valid, as in ``dlayers``.
+
+Example
+-------
+>>> import cv2
+>>> from blockmatching import *
+>>>
+>>> @process_dlayers(alpha=0.01, width=9, height=9, workers=4)
+>>> def background(videofile):
+>>>     cap = cv2.VideoCapture(videofile)
+>>>     while cap.isOpened():
+>>>         ret, frame = cap.read()
+>>>         if ret == True:
+>>>             frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+>>>             yield frame
+>>>         else:
+>>>             break
+>>>
+>>> for bg, fg, mask, meand, layers in background("./videos/car.mp4"):
+>>>     pass
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+import traceback
+import multiprocessing
+from collections import deque
+from itertools import chain
+from multiprocessing.shared_memory import SharedMemory
+from queue import Empty
+
+from numpy import ndarray, dtype as npdtype, prod, empty
+
+from .blockmatching import block_matching
+from .background import BackgroundSubtractor
+from .clustering import clustering
+from .motionlayers import layers
+from .vectormask import vectormask
+from .pipelinestats import FrameTimer, moving_blocks
+
+
+class SharedRing:
+    r'''
+    Ring of fixed shape array slots in shared memory.
+
+    :param tuple shape: shape of each slot.
+    :param dtype: type of the elements.
+    :param int slots: number of slots.
+    :param str name: name of an existing shared memory block to attach to.
+                     By default a new block is created.
+
+    The ring is pickled by name, so a process receiving it attaches to the
+    same memory. Only the process that created the ring frees the memory in
+    :meth:`close`.
+    '''
+
+    def __init__(self, shape, dtype, slots, name=None):
+        self.shape = tuple(shape)
+        self.dtype = npdtype(dtype)
+        self.slots = slots
+        size = int(slots * prod(self.shape) * self.dtype.itemsize)
+        if name is None:
+            self._shm = SharedMemory(create=True, size=max(size, 1))
+            self._creator = os.getpid()
+        else:
+            self._shm = SharedMemory(name=name)
+            self._creator = None
+        self.array = ndarray((slots,) + self.shape, dtype=self.dtype,
+                             buffer=self._shm.buf)
+
+    @property
+    def name(self):
+        r'''
+        Name of the shared memory block.
+        '''
+        return self._shm.name
+
+    def __getitem__(self, slot):
+        return self.array[slot]
+
+    def __setitem__(self, slot, value):
+        self.array[slot] = value
+
+    def __reduce__(self):
+        return (SharedRing, (self.shape, self.dtype.str, self.slots,
+                             self.name))
+
+    def close(self):
+        r'''
+        Detach from the shared memory, freeing it in the creator process.
+        '''
+        if self._shm is None:
+            return
+        self.array = None
+        self._shm.close()
+        if self._creator == os.getpid():
+            self._shm.unlink()
+        self._shm = None
+
+
+def _worker(tasks, results, frames, fgs, masks, lyrs, width, height, sigma,
+            tolerance, keep, edges):
+    """
+    Matching, clustering, layers and vector mask of the tasks received. With
+    keep the motion grids and the clusters are sent back too.
+    """
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            idx, prev, cur, slot = task
+            try:
+                timer = FrameTimer(idx)
+                XP, YP, XD, YD = block_matching(fgs[prev], fgs[cur], width,
+                                                height, parallel=False,
+                                                edges=edges)
+                timer.lap('matching')
+
+                U, V, object_tops, meand = clustering(XD, YD, XP, YP,
+                                                      tolerance=tolerance)
+                timer.lap('clustering')
+
+                objs = layers(frames[cur], object_tops, width, height,
+                              sigma=sigma)
+                nshared = min(len(objs), lyrs.shape[0])
+                for k in range(nshared):
+                    lyrs[slot][k] = objs[k]
+                timer.lap('layers')
+
+                masks[slot] = vectormask(fgs[cur], XD, YD,
+                                         (XD + U).astype(int),
+                                         (YD + V).astype(int))
+                timer.lap('vectormask')
+
+                motion = (XP, YP, XD, YD) if keep else None
+                results.put((idx, None, meand, nshared, objs[nshared:],
+                             moving_blocks(XP, YP, XD, YD), timer.stages,
+                             motion, object_tops if keep else None))
+            except Exception:
+                results.put((idx, traceback.format_exc(), None, 0, [], 0,
+                             {}, None, None))
+    finally:
+        for ring in (frames, fgs, masks, lyrs):
+            ring.close()
+
+
+class _Item:
+    "Frame waiting to be yielded."
+
+    def __init__(self, slot, background, timer, model=None):
+        self.slot = slot
+        self.background = background
+        self.timer = timer
+        self.model = model
+        self.motion = None
+        self.clusters = None
+        self.out = None
+        self.prev = None
+        self.result = None
+        self.nmoving = None
+        self.ncomponents = None
+
+
+class ProcessPipeline:
+    r'''
+    Runner of the dlayers pipeline over worker processes.
+
+    :param float alpha: background learning factor.
+    :param int width: matching block width.
+    :param int height: matching block height.
+    :param int sigma: smoothing of the layer masks.
+    :param int workers: number of worker processes.
+    :param int slots: number of frame slots, default 2 * workers + 2.
+    :param int max_layers: layers kept in shared memory for each frame, the
+                           extra layers of busy frames are pickled.
+    :param PipelineStats stats: optional, records the time of each stage and
+                                the number of frames in the workers.
+    :param str context: multiprocessing start method, default 'spawn'.
+                        Forking a process where a numba threading layer
+                        is running is not safe with every layer.
+    :param int velocity_tolerance: optional, velocity-aware clustering, see
+                                   clustering.
+    :param int reorder: number of output slots, default workers + 1. It
+                        bounds the frames sent to the workers plus the
+                        finished frames waiting for an earlier one, the
+                        reorder buffer. A larger value absorbs the variance
+                        of the time of the frames.
+    :param bool edges: default True, the blocks of the last line and column
+                       are also searched, as in dlayers.
+    '''
+
+    def __init__(self, alpha=0.01, width=9, height=9, sigma=7, workers=2,
+                 slots=None, max_layers=16, stats=None, context='spawn',
+                 velocity_tolerance=None, reorder=None, edges=True):
+        self.alpha = alpha
+        self.width = width
+        self.height = height
+        self.sigma = sigma
+        self.workers = workers
+        self.slots = slots if slots is not None else 2 * workers + 2
+        if self.slots < 2:
+            raise ValueError("At least two frame slots are needed.")
+        self.max_layers = max_layers
+        self.stats = stats
+        self.context = context
+        self.velocity_tolerance = velocity_tolerance
+        self.reorder = reorder if reorder is not None else workers + 1
+        if self.reorder < 1:
+            raise ValueError("At least one output slot is needed.")
+        self.edges = edges
+        self._state = None
+
+    def _start(self, frame, foreground):
+        ctx = multiprocessing.get_context(self.context)
+        nout = self.reorder
+        self._frames = SharedRing(frame.shape, frame.dtype, self.slots)
+        self._fgs = SharedRing(foreground.shape, foreground.dtype,
+                               self.slots)
+        self._masks = SharedRing(foreground.shape, foreground.dtype, nout)
+        self._lyrs = SharedRing((self.max_layers,) + frame.shape,
+                                frame.dtype, nout)
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._procs = [ctx.Process(target=_worker,
+                                   args=(self._tasks, self._results,
+                                         self._frames, self._fgs,
+                                         self._masks, self._lyrs,
+                                         self.width, self.height,
+                                         self.sigma, self.velocity_tolerance,
+                                         self._state is not None,
+                                         self.edges),
+                                   daemon=True)
+                       for _ in range(self.workers)]
+        for proc in self._procs:
+            proc.start()
+
+        self._free_in = deque(range(self.slots))
+        self._free_out = deque(range(nout))
+        self._refs = [0] * self.slots
+        self._items = {}
+        self._next = 0
+        self._inflight = 0
+
+    def _stop(self):
+        for _ in self._procs:
+            self._tasks.put(None)
+        for proc in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        for ring in (self._frames, self._fgs, self._masks, self._lyrs):
+            ring.close()
+        self._tasks.close()
+        self._results.close()
+
+    def _release(self, slot):
+        self._refs[slot] -= 1
+        if self._refs[slot] == 0:
+            self._free_in.append(slot)
+
+    def _receive(self, msg):
+        idx, error, meand, nshared, extra, nmoving, stages, motion, \
+            clusters = msg
+        if error is not None:
+            raise RuntimeError("Worker failed on frame {}:\n{}".format(idx,
+                                                                       error))
+        self._inflight -= 1
+        item = self._items[idx]
+        self._release(item.slot)
+        self._release(item.prev)
+        lyrs = [self._lyrs[item.out][k] for k in range(nshared)] + extra
+        item.result = (item.background, self._fgs[item.slot],
+                       self._masks[item.out], meand, lyrs)
+        if item.timer is not None:
+            item.timer.stages.update(stages)
+        item.nmoving = nmoving
+        item.ncomponents = len(meand)
+        item.motion = motion
+        item.clusters = clusters
+
+    def _poll(self, block):
+        "Receive the finished tasks, waiting for one if block."
+        while self._inflight > 0:
+            try:
+                msg = self._results.get(block=block, timeout=1.0)
+            except Empty:
+                if not block:
+                    return
+                for proc in self._procs:
+                    if not proc.is_alive():
+                        raise RuntimeError("Worker process exited with "
+                                           "code {}".format(proc.exitcode))
+                continue
+            self._receive(msg)
+            block = False
+
+    def _flush(self, block):
+        "Yield the finished frames in order."
+        ready = self._next in self._items and \
+            self._items[self._next].result is not None
+        self._poll(block and not ready)
+        while self._next in self._items and \
+                self._items[self._next].result is not None:
+            item = self._items.pop(self._next)
+            background, fg, mask, meand, lyrs = item.result
+            result = (background, fg.copy(),
+                      None if mask is None else mask.copy(), meand,
+                      [layer.copy() for layer in lyrs])
+            if self._state is not None:
+                self._state.update(item.model, result[1], item.motion,
+                                   meand if item.motion is not None
+                                   else None, clusters=item.clusters)
+            yield result
+            if item.timer is not None:
+                self.stats.finish(item.timer,
+                                  moving_blocks=item.nmoving,
+                                  components=item.ncomponents,
+                                  queue_depth=self._inflight)
+            if item.out is not None:
+                self._free_out.append(item.out)
+            self._release(item.slot)
+            self._next += 1
+
+    def _model(self, background):
+        "Background model of the frame produced, to keep in the state."
+        if self._state is None:
+            return None
+        return BackgroundSubtractor.from_state(background.state())
+
+    def run(self, frames, state=None):
+        r'''
+        Process the frames.
+
+        :param iterable frames: gray level frames of the same shape.
+        :param PipelineState state: optional, follows the state of the
+                                    pipeline, updated when each frame is
+                                    yielded. A loaded state resumes the
+                                    stream, as in dlayers.
+
+        :return generator: background, foreground, vector mask, mean
+                           velocities and layers of each frame, as dlayers.
+        '''
+        frames = iter(frames)
+        first = next(frames, None)
+        if first is None:
+            return
+
+        self._state = state
+        warm = state is not None and state.ready
+        if warm:
+            background = state.background
+            self._start(first, state.foreground)
+        else:
+            background = BackgroundSubtractor(self.alpha, first)
+            timer = self.stats.start() if self.stats is not None else None
+            foreground = background.foreground(first)
+            self._start(first, foreground)
+        try:
+            if warm:
+                # The first frame is matched with the saved foreground.
+                prev = self._free_in.popleft()
+                self._fgs[prev] = state.foreground
+                # References: the task of the first frame.
+                self._refs[prev] = 1
+                idx = 0
+                frames = chain([first], frames)
+            else:
+                slot = self._free_in.popleft()
+                self._frames[slot] = first
+                self._fgs[slot] = foreground
+                if timer is not None:
+                    timer.lap('background')
+                item = _Item(slot, background.background, timer,
+                             self._model(background))
+                item.result = (item.background, self._fgs[slot], None,
+                               empty((0, 2)), [])
+                # References: the yield and the task of the next frame.
+                self._refs[slot] = 2
+                self._items[0] = item
+                prev = slot
+                idx = 1
+                yield from self._flush(False)
+
+            for frame in frames:
+                while not self._free_in or not self._free_out:
+                    yield from self._flush(True)
+
+                timer = self.stats.start() if self.stats is not None \
+                    else None
+                slot = self._free_in.popleft()
+                self._frames[slot] = frame
+                background.foreground(frame, out=self._fgs[slot])
+                if timer is not None:
+                    timer.lap('background')
+
+                item = _Item(slot, background.background, timer,
+                             self._model(background))
+                item.out = self._free_out.popleft()
+                item.prev = prev
+                self._items[idx] = item
+                # References: the yield, this task and the next task.
+                self._refs[slot] = 3
+                self._tasks.put((idx, prev, slot, item.out))
+                self._inflight += 1
+
+                prev = slot
+                idx += 1
+                yield from self._flush(False)
+
+            # There is no next task for the last frame.
+            self._release(prev)
+            while self._next < idx:
+                yield from self._flush(True)
+        finally:
+            self._stop()
+            self._state = None
+
+
+def process_dlayers(alpha=0.01, width=9, height=9, sigma=7, workers=2,
+                    slots=None, max_layers=16, stats=None, context='spawn',
+                    velocity_tolerance=None, reorder=None, state=None,
+                    edges=True):
+    '''
+    Layer decorator running over worker processes.
+
+    Same parameters and outputs of dlayers, plus:
+
+    :parameter int workers: number of worker processes.
+    :parameter int slots: number of frame slots in shared memory.
+    :parameter int max_layers: layers kept in shared memory for each frame.
+    :parameter PipelineStats stats: optional, per-stage times and queue
+                                    depth.
+    :parameter str context: multiprocessing start method, default 'spawn'.
+    :parameter int velocity_tolerance: optional, velocity-aware clustering.
+    :parameter int reorder: output slots, bounding the frames in the workers
+                            and the finished frames waiting to be yielded in
+                            order. Default workers + 1.
+    :parameter PipelineState state: optional, follows the state of the
+                                    pipeline to save or resume it, as in
+                                    dlayers.
+    :parameter bool edges: default True, search the blocks of the last line
+                           and column, as in dlayers.
+
+    The arrays yielded are copies of the shared memory slots.
+    '''
+    def wrap(func):
+        def wrapped_func(*args, **kwargs):
+            pipeline = ProcessPipeline(alpha, width, height, sigma, workers,
+                                       slots, max_layers, stats, context,
+                                       velocity_tolerance, reorder, edges)
+            yield from pipeline.run(func(*args, **kwargs), state)
+        return wrapped_func
+    return wrap
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Warm-start snapshots of the pipelines.
+
+After a restart the ``BackgroundSubtractor`` learns the background again from
+the first frame, with a small ``alpha`` it takes minutes of video before the
+foreground is usable. A :class:`PipelineState` given to ``dlayers`` or
+``forecasting`` follows the state of the pipeline: the background model, the
+last foreground, the previous motion field, the mean velocities of the
+objects and the last forecast. It is saved in a compressed ``.npz`` file, or
+in bytes to be sent to another worker, and a pipeline started with the
+loaded state matches its first frame with the saved foreground, resuming the
+stream within one frame.
+
+Keeping the state only stores references, the arrays are copied when the
+state is saved.
+
+Example
+-------
+>>> from blockmatching import *
+>>>
+>>> state = PipelineState.load('cam0.npz') if os.path.exists('cam0.npz') \\
+>>>     else PipelineState()
+>>>
+>>> @dlayers(alpha=0.001, width=9, height=9, state=state)
+>>> def background(url):
+>>>     ...
+>>>
+>>> for k, (bg, fg, mask, meand, layers) in enumerate(background(url)):
+>>>     if k % 1000 == 0:
+>>>         state.save('cam0.npz')
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from io import BytesIO
+
+from numpy import load, savez, savez_compressed, asarray, stack
+
+from .background import BackgroundSubtractor
+
+_BACKGROUND = ('alpha', 'sgm', 'threashold', 'background', 'oldf')
+
+
+class PipelineState:
+    r'''
+    State of a dlayers or forecasting pipeline.
+
+    Attributes, None until the pipeline processed a frame:
+
+    - ``background``: the BackgroundSubtractor.
+    - ``foreground``: last foreground.
+    - ``motion``: the four grids XP, YP, XD, YD of the last matching.
+    - ``meand``: mean velocity of the objects of the last frame.
+    - ``forecast``: last forecast of a forecasting pipeline.
+    - ``clusters``: Clusters of the last frame, not saved.
+    - ``frames``: number of frames processed by the stream.
+    '''
+
+    def __init__(self):
+        self.background = None
+        self.foreground = None
+        self.motion = None
+        self.meand = None
+        self.forecast = None
+        self.clusters = None
+        self.frames = 0
+
+    @property
+    def ready(self):
+        r'''
+        True when the state can resume a pipeline.
+        '''
+        return self.background is not None and self.foreground is not None
+
+    def update(self, background, foreground, motion=None, meand=None,
+               forecast=None, clusters=None):
+        r'''
+        Keep the state of the last frame, called by the pipelines.
+
+        :param BackgroundSubtractor background: background model.
+        :param 2d_array foreground: last foreground.
+        :param tuple motion: XP, YP, XD, YD of the last matching.
+        :param meand: mean velocity of the objects.
+        :param 2d_array forecast: last forecast.
+        :param Clusters clusters: objects of the last frame.
+        '''
+        self.background = background
+        self.foreground = foreground
+        if motion is not None:
+            self.motion = motion
+        if meand is not None:
+            self.meand = meand
+        if forecast is not None:
+            self.forecast = forecast
+        if clusters is not None:
+            self.clusters = clusters
+        self.frames += 1
+
+    def _arrays(self):
+        if not self.ready:
+            raise ValueError("The pipeline did not process a frame yet.")
+        arrays = {'bg_' + key: asarray(value)
+                  for key, value in self.background.state().items()}
+        arrays['foreground'] = asarray(self.foreground)
+        arrays['frames'] = asarray(self.frames)
+        if self.motion is not None:
+            arrays['motion'] = stack(self.motion)
+        if self.meand is not None:
+            arrays['meand'] = asarray(self.meand, dtype=float).reshape(-1, 2)
+        if self.forecast is not None:
+            arrays['forecast'] = asarray(self.forecast)
+        return arrays
+
+    def save(self, file, compress=True):
+        r'''
+        Save the state in the npz format.
+
+        :param file: path or binary file.
+        :param bool compress: default True, compress the arrays.
+        '''
+        (savez_compressed if compress else savez)(file, **self._arrays())
+
+    def to_bytes(self, compress=True):
+        r'''
+        State as bytes, to be sent to another worker.
+
+        :return bytes: the npz file.
+        '''
+        buf = BytesIO()
+        self.save(buf, compress)
+        return buf.getvalue()
+
+    @classmethod
+    def load(cls, file):
+        r'''
+        Load a state saved by :meth:`save`.
+
+        :param file: path or binary file.
+
+        :return PipelineState: the state.
+        '''
+        state = cls()
+        with load(file) as data:
+            bgstate = {}
+            for key in _BACKGROUND:
+                value = data['bg_' + key]
+                bgstate[key] = value.item() if value.ndim == 0 else value
+            state.background = BackgroundSubtractor.from_state(bgstate)
+            state.foreground = data['foreground']
+            state.frames = int(data['frames'])
+            if 'motion' in data:
+                state.motion = tuple(data['motion'])
+            if 'meand' in data:
+                state.meand = data['meand']
+            if 'forecast' in data:
+                state.forecast = data['forecast']
+        return state
+
+    @classmethod
+    def from_bytes(cls, data):
+        r'''
+        Load a state from the bytes of :meth:`to_bytes`.
+
+        :param bytes data: the npz file.
+
+        :return PipelineState: the state.
+        '''
+        return cls.load(BytesIO(data))
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Matching kernels specialized on the block size.
+
+The kernels of ``block_matching`` take the block height and width as
+arguments: the loops of the cost functions have a trip count known only at
+run time. Deployments use a few fixed sizes, as 3, 9 or 17 pixels. For each
+size requested :func:`specialized_kernel` generates the source of a kernel
+where the height and the width are constants and the loop over the columns
+of the block is unrolled, one statement per column, so the compiler sees
+straight code with constant offsets.
+
+The source is written in a cache directory, one module per metric, size and
+threading, and imported from there, so numba keeps the compiled kernels on
+disk and the next processes load them without compiling. The kernels are
+kept in a registry for the session. They follow the generic kernels step by
+step, the vectors are the same.
+
+``block_matching(..., specialize=True)`` uses them for the full searches;
+with counters or successive elimination, for sizes larger than
+``MAX_SPECIALIZED`` or when the cache directory can not be written, the
+generic kernel is used.
+
+The directory is given by the environment variable ``BLOCKMATCHING_KERNELS``,
+default ``~/.cache/blockmatching/kernels``.
+
+Example
+-------
+>>> from blockmatching import *
+>>>
+>>> dy, dx = block_matching(img0, img1, 9, 9, compact='dense',
+>>>                         specialize=True)
+>>> print(specialized_sizes())
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import hashlib
+import importlib.util
+import os
+import sys
+import tempfile
+from threading import Lock
+
+# Largest block side with a specialized kernel, the unrolled source grows
+# with the width and the compilation time with it.
+MAX_SPECIALIZED = 64
+
+_HEADER = '''\
+# Generated by blockmatching.specialized, do not edit.
+from math import sqrt
+
+from numba import njit, prange
+
+H = {height}
+W = {width}
+HC = {hc}
+WC = {wc}
+N = {n}
+'''
+
+_COSTS = {
+    'clamped': ('diff = 0.0', '''\
+        val = float(img1[r1 + ki, c1 + {k}]) - img0[r0 + ki, c0 + {k}]
+        diff += min(max(val, 0.0), 255.0)''', 'return diff'),
+    'sad': ('diff = 0.0', '''\
+        val = float(img1[r1 + ki, c1 + {k}]) - img0[r0 + ki, c0 + {k}]
+        diff += abs(val)''', 'return diff'),
+    'ssd': ('diff = 0.0', '''\
+        val = float(img1[r1 + ki, c1 + {k}]) - img0[r0 + ki, c0 + {k}]
+        diff += val * val''', 'return diff'),
+    'zncc': ('''\
+sum1 = s1[r1 + H, c1 + W] - s1[r1, c1 + W] - s1[r1 + H, c1] + s1[r1, c1]
+    sq1 = q1[r1 + H, c1 + W] - q1[r1, c1 + W] - q1[r1 + H, c1] + q1[r1, c1]
+    norm1 = sq1 - sum1 * sum1 / N
+    cross = 0.0''', '''\
+        cross += float(img1[r1 + ki, c1 + {k}]) * img0[r0 + ki, c0 + {k}]''',
+             '''\
+cross -= m0 * sum1
+    denom = n0 * norm1
+    if denom <= 0.0:
+        return 1.0
+    return 1.0 - cross / sqrt(denom)'''),
+}
+
+_COST = '''
+
+@njit(nogil=True, cache=True)
+def cost(img0, img1, s1, q1, r0, c0, r1, c1, m0, n0):
+    {init}
+    for ki in range(H):
+{body}
+    {end}
+'''
+
+_PREP = {
+    'zncc': '''
+
+@njit(nogil=True, cache=True)
+def prep(img0, r0, c0):
+    total = 0.0
+    sq = 0.0
+    for ki in range(H):
+{body}
+    return total / N, sq - total * total / N
+''',
+}
+
+_PREP_STEP = '''\
+        val = float(img0[r0 + ki, c0 + {k}])
+        total += val
+        sq += val * val'''
+
+_PREP_NONE = '''
+
+@njit(nogil=True, cache=True)
+def prep(img0, r0, c0):
+    return 0.0, 0.0
+'''
+
+_KERNEL = '''
+
+@njit(parallel={parallel}, nogil=True, cache=True)
+def kernel(img0, img1, s0, s1, q1, width, height, wblock, oy, ox, blocks,
+           out, counts):
+    lins, cols = img0.shape
+    for t in prange(blocks.size):
+        k0 = blocks[t]
+        i = k0 // wblock
+        j = k0 % wblock
+        ib0 = min(i * H + HC, lins - H)
+        jb0 = min(j * W + WC, cols - W)
+        ic = min(max(ib0 + oy, 0), lins - H)
+        jc = min(max(jb0 + ox, 0), cols - W)
+        i0 = ic - HC
+        j0 = jc - WC
+        ki0 = max(0, -i0)
+        ki1 = min(H, lins - H - i0 + 1)
+        kj0 = max(0, -j0)
+        kj1 = min(W, cols - W - j0 + 1)
+
+        m0, n0 = prep(img0, ib0, jb0)
+        minval = cost(img0, img1, s1, q1, ib0, jb0, ic, jc, m0, n0)
+        bi = HC
+        bj = WC
+        for ki in range(ki0, ki1):
+            for kj in range(kj0, kj1):
+                if ki == HC and kj == WC:
+                    continue
+                diff = cost(img0, img1, s1, q1, ib0, jb0, i0 + ki, j0 + kj,
+                            m0, n0)
+                if diff < minval:
+                    minval = diff
+                    bi = ki
+                    bj = kj
+
+        out[k0, 0] = ib0
+        out[k0, 1] = jb0
+        out[k0, 2] = i0 + bi
+        out[k0, 3] = j0 + bj
+    return out
+'''
+
+_SPECIALIZED = {}
+_LOCK = Lock()
+
+
+def kernel_directory():
+    r'''
+    Directory of the generated kernels.
+
+    :return str: ``BLOCKMATCHING_KERNELS`` or
+                 ``~/.cache/blockmatching/kernels``.
+    '''
+    return os.environ.get('BLOCKMATCHING_KERNELS',
+                          os.path.join(os.path.expanduser('~'), '.cache',
+                                       'blockmatching', 'kernels'))
+
+
+def kernel_source(metric, height, width, parallel=True):
+    r'''
+    Source of the kernel specialized on one block size.
+
+    :param str metric: 'clamped', 'sad', 'ssd' or 'zncc'.
+    :param int height: block height.
+    :param int width: block width.
+    :param bool parallel: threaded kernel.
+
+    :return str: the source of a module with the functions cost, prep and
+                 kernel.
+    '''
+    if metric not in _COSTS:
+        raise ValueError("Unknown metric {}".format(metric))
+    init, step, end = _COSTS[metric]
+    source = _HEADER.format(height=height, width=width, hc=height // 2,
+                            wc=width // 2, n=height * width)
+    source += _COST.format(init=init, end=end, body='\n'.join(
+        step.format(k=k) for k in range(width)))
+    if metric in _PREP:
+        source += _PREP[metric].format(body='\n'.join(
+            _PREP_STEP.format(k=k) for k in range(width)))
+    else:
+        source += _PREP_NONE
+    source += _KERNEL.format(parallel=bool(parallel))
+    return source
+
+
+def _load(name, path):
+    "Import the generated module from its file."
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    # The kernels loaded from the numba cache find their module by name.
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _module_name(source, metric, height, width, parallel):
+    "Name of the module of a kernel, with the digest of its source."
+    digest = hashlib.sha1(source.encode()).hexdigest()[:12]
+    return 'bm_{}_{}x{}_{}_{}'.format(metric, height, width,
+                                      'p' if parallel else 's', digest)
+
+
+def _written(path):
+    "Content of a generated file, None when it does not exist."
+    try:
+        with open(path) as module:
+            return module.read()
+    except FileNotFoundError:
+        return None
+
+
+def _build(metric, height, width, parallel):
+    "Write, if needed, and import the module of a specialized kernel."
+    source = kernel_source(metric, height, width, parallel)
+    name = _module_name(source, metric, height, width, parallel)
+    directory = kernel_directory()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + '.py')
+    if _written(path) != source:
+        # Written aside and renamed, processes building the same kernel do
+        # not read a partial file. A file of another content, truncated or
+        # edited, is replaced before being imported.
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as out:
+            out.write(source)
+        os.replace(tmp, path)
+    return _load(name, path).kernel
+
+
+def specialized_kernel(metric, height, width, parallel=True):
+    r'''
+    Kernel specialized on one block size, generated at the first request.
+
+    :param str metric: 'clamped', 'sad', 'ssd' or 'zncc'.
+    :param int height: block height.
+    :param int width: block width.
+    :param bool parallel: threaded kernel.
+
+    :return: the kernel, with the arguments of the generic kernels, or None
+             when the size is larger than MAX_SPECIALIZED or the kernel can
+             not be written in the kernel directory.
+    '''
+    height, width = int(height), int(width)
+    if max(height, width) > MAX_SPECIALIZED:
+        return None
+    key = (metric, height, width, bool(parallel))
+    with _LOCK:
+        if key not in _SPECIALIZED:
+            try:
+                _SPECIALIZED[key] = _build(metric, height, width, parallel)
+            except OSError:
+                _SPECIALIZED[key] = None
+        return _SPECIALIZED[key]
+
+
+def specialized_sizes():
+    r'''
+    Kernels generated in this session.
+
+    :return list: (metric, height, width, parallel) of each kernel.
+    '''
+    return sorted(key for key, kernel in _SPECIALIZED.items()
+                  if kernel is not None)
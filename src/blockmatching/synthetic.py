@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Synthetic frames with known motion.
+
+Generators of textured gray level frames and of sequences where the true
+displacement of every object is known. They are used by the benchmarks and
+by the tests, so no video file is needed to exercise the algorithms.
+
+Example
+-------
+>>> from blockmatching import *
+>>> img0, img1 = translated_pair((120, 160), 2, -1)
+>>> XP, YP, XD, YD = block_matching(img0, img1, 9, 9)
+>>>
+>>> @dlayers(alpha=0.01, width=9, height=9)
+>>> def background():
+>>>     for frame in moving_squares(20, (120, 160)):
+>>>         yield frame
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from numpy import uint8, clip, roll, indices, sin, zeros, ptp
+from numpy.random import RandomState
+from scipy.ndimage import gaussian_filter
+
+
+def textured_frame(shape, texture='noise', seed=0):
+    '''
+    Gray level frame with a texture easy to match.
+
+    :parameter tuple shape: (lines, columns) of the frame.
+    :parameter str texture: 'noise' - uniform random noise;
+                            'smooth' - low pass filtered noise;
+                            'waves' - sum of sinusoids;
+                            'flat' - constant frame.
+    :parameter int seed: seed of the random generator.
+
+    :return 2d_array frame: uint8 frame.
+    '''
+    rng = RandomState(seed)
+    if texture == 'noise':
+        return rng.randint(0, 256, shape).astype(uint8)
+    if texture == 'smooth':
+        frame = gaussian_filter(rng.uniform(0, 255, shape), sigma=2)
+        frame = (frame - frame.min()) / max(ptp(frame), 1e-9) * 255
+        return frame.astype(uint8)
+    if texture == 'waves':
+        lin, col = indices(shape)
+        frame = 127 + 60 * sin(lin / 5.0) + 60 * sin(col / 7.0 + lin / 11.0)
+        return clip(frame, 0, 255).astype(uint8)
+    if texture == 'flat':
+        return zeros(shape, dtype=uint8) + 127
+    raise ValueError("Unknown texture {}".format(texture))
+
+
+def translated_pair(shape, dy, dx, texture='noise', seed=0, noise=0.0):
+    '''
+    Two frames where the whole second frame is the first one translated.
+
+    The translation wraps around the borders.
+
+    :parameter tuple shape: (lines, columns) of the frames.
+    :parameter int dy: displacement in lines.
+    :parameter int dx: displacement in columns.
+    :parameter str texture: texture of the frames, see textured_frame.
+    :parameter int seed: seed of the random generator.
+    :parameter float noise: standard deviation of the gaussian noise added
+                            to the second frame.
+
+    :return 2d_array img0: uint8 frame in time t0 + kdt
+    :return 2d_array img1: uint8 frame in time t0 + (k+1)dt
+    '''
+    img0 = textured_frame(shape, texture, seed)
+    img1 = roll(img0, (dy, dx), axis=(0, 1))
+    if noise > 0:
+        rng = RandomState(seed + 1)
+        img1 = clip(img1 + rng.normal(0, noise, shape), 0, 255).astype(uint8)
+    return img0, img1
+
+
+def moving_squares(nframes, shape, squares=None, texture='noise', seed=0,
+                   background=0):
+    '''
+    Sequence of frames with textured squares moving over a static
+    background.
+
+    :parameter int nframes: number of frames.
+    :parameter tuple shape: (lines, columns) of the frames.
+    :parameter list squares: list of (line, column, size, vy, vx) with the
+                             initial position, the size and the velocity, in
+                             pixels per frame, of each square. By default two
+                             squares moving in opposite directions.
+    :parameter str texture: texture of the squares, see textured_frame.
+    :parameter int seed: seed of the random generator.
+    :parameter int background: gray level of the background.
+
+    :return generator: uint8 frames.
+    '''
+    lins, cols = shape
+    if squares is None:
+        size = max(min(lins, cols) // 6, 4)
+        squares = [(lins // 4, cols // 8, size, 1, 2),
+                   (lins // 2, 5 * cols // 8, size, -1, -2)]
+
+    patches = [textured_frame((size, size), texture, seed + k)
+               for k, (_, _, size, _, _) in enumerate(squares)]
+
+    for t in range(nframes):
+        frame = zeros(shape, dtype=uint8) + uint8(background)
+        for (lin, col, size, vy, vx), patch in zip(squares, patches):
+            i0 = (lin + vy * t) % lins
+            j0 = (col + vx * t) % cols
+            i1 = min(i0 + size, lins)
+            j1 = min(j0 + size, cols)
+            frame[i0:i1, j0:j1] = patch[:i1 - i0, :j1 - j0]
+        yield frame
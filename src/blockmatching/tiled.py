@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- Coding: UTF-8 -*-
+"""
+Out-of-core tiled block matching.
+
+Full-disk satellite images can have tens of thousands of pixels per side,
+and the float64 copies made by :func:`blockmatching.block_matching` would
+not fit in memory. :func:`tiled_block_matching` reads the two images through
+memory maps (``.npy`` or raw files), cuts them in tiles aligned with the
+block grid, each one with a halo of one block (the search range), runs the
+matching kernel on each tile in a pool of threads and writes the grids into
+a memory mapped ``.npy`` output. The peak memory is bounded by the tile size
+and by the number of workers instead of by the image size.
+
+The result is the same as the one of ``block_matching`` on the full images.
+
+Example
+-------
+>>> from blockmatching import *
+>>> XP, YP, XD, YD = tiled_block_matching('t0.npy', 't1.npy', 9, 9,
+>>>                                       tile=4096, output='grids.npy',
+>>>                                       workers=8)
+>>>
+>>> # Raw files need the shape and the type of the pixels.
+>>> dy, dx = tiled_block_matching('t0.raw', 't1.raw', 9, 9,
+>>>                               shape=(21696, 21696), dtype='uint16',
+>>>                               compact='dense', output='motion.npy')
+
+License
+-------
+Developed by: E. S. Pereira.
+e-mail: pereira.somoza@gmail.com
+
+Copyright [2019] [E. S. Pereira]
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from numpy import load, memmap, zeros, ones, int64, uint8
+from numpy.lib.format import open_memmap
+
+from .blockmatching import BlockError, ImageSizeError, _search
+from .motionfield import displacement_dtype
+
+
+def open_frame(source, shape=None, dtype=uint8, offset=0):
+    '''
+    Open a frame without reading it in memory.
+
+    :parameter source: path of a ``.npy`` file, path of a raw file or an
+                       array, that is returned as is.
+    :parameter tuple shape: (lines, columns) of a raw file.
+    :parameter dtype: type of the pixels of a raw file.
+    :parameter int offset: size in bytes of the header of a raw file.
+
+    :return 2d_array: read only memory mapped frame.
+    '''
+    if not isinstance(source, (str, bytes, os.PathLike)):
+        return source
+    if str(source).endswith('.npy'):
+        return load(source, mmap_mode='r')
+    if shape is None:
+        raise ImageSizeError("The shape of a raw file must be given.")
+    return memmap(source, dtype=dtype, mode='r', offset=offset,
+                  shape=tuple(shape))
+
+
+def _tiles(hblock, wblock, tile_blocks):
+    "Ranges of block lines and block columns of each tile."
+    th, tw = tile_blocks
+    for bi0 in range(0, hblock, th):
+        for bj0 in range(0, wblock, tw):
+            yield bi0, min(bi0 + th, hblock), bj0, min(bj0 + tw, wblock)
+
+
+def _match_tile(img0, img1, width, height, bounds, out, compact, metric):
+    "Match one tile and write its blocks in out."
+    bi0, bi1, bj0, bj1 = bounds
+    lins, cols = img0.shape
+
+    # One block of halo, the search range of the last blocks of the tile.
+    r0, r1 = bi0 * height, min(bi1 * height + height, lins)
+    c0, c1 = bj0 * width, min(bj1 * width + width, cols)
+
+    hblock = (r1 - r0) // height
+    wblock = (c1 - c0) // width
+
+    # The kernel does not search the last line and column of its grid, so
+    # only the blocks with a halo are searched. Tiles made only of the last
+    # line or column of the image have nothing to search.
+    n = min(bi1 - bi0, hblock - 1)
+    m = min(bj1 - bj0, wblock - 1)
+    if n < 1 or m < 1:
+        return
+
+    tile0 = img0[r0:r1, c0:c1]
+    tile1 = img1[r0:r1, c0:c1]
+    res = zeros((hblock * wblock, 4), dtype=int64)
+    _search(tile0, tile1, width, height, ones((hblock, wblock), dtype=uint8),
+            res, parallel=False, metric=metric)
+    res = res.reshape(hblock, wblock, 4)[:n, :m]
+
+    if compact:
+        out[0, bi0:bi0 + n, bj0:bj0 + m] = res[:, :, 2] - res[:, :, 0]
+        out[1, bi0:bi0 + n, bj0:bj0 + m] = res[:, :, 3] - res[:, :, 1]
+    else:
+        out[0, bi0:bi0 + n, bj0:bj0 + m] = res[:, :, 0] + r0
+        out[1, bi0:bi0 + n, bj0:bj0 + m] = res[:, :, 1] + c0
+        out[2, bi0:bi0 + n, bj0:bj0 + m] = res[:, :, 2] + r0
+        out[3, bi0:bi0 + n, bj0:bj0 + m] = res[:, :, 3] + c0
+
+
+def tiled_block_matching(src0, src1, width, height, tile=2048, output=None,
+                         workers=None, shape=None, dtype=uint8, offset=0,
+                         compact=None, metric='clamped'):
+    '''
+    Block matching of large images, tile by tile.
+
+    :parameter src0: Image in time t0 + kdt - ``.npy`` path, raw file path or
+                     array (a numpy memmap for instance).
+    :parameter src1: Image in time t0 + (k+1)dt, as src0.
+    :parameter int width: matching block width.
+    :parameter int height: matching block height.
+    :parameter tile: int or (lines, columns) - tile size in pixels, rounded
+                     down to a multiple of the block size.
+    :parameter str output: optional ``.npy`` path of the memory mapped
+                           output. Without it the output is kept in memory.
+    :parameter int workers: number of threads, default the number of cpus.
+    :parameter tuple shape: (lines, columns) of raw input files.
+    :parameter dtype: type of the pixels of raw input files.
+    :parameter int offset: size in bytes of the header of raw input files.
+    :parameter str compact: None (default) or 'dense'. With 'dense' only
+                            the int8/int16 displacements dy, dx are written.
+    :parameter str metric: cost of a candidate block, as in block_matching.
+
+    :return 3d_array: array with the four grids XP, YP, XD, YD stacked in
+                      the first axis, or with dy, dx if compact='dense'.
+    '''
+    if compact not in (None, 'dense'):
+        raise ValueError("compact must be None or 'dense'.")
+
+    img0 = open_frame(src0, shape, dtype, offset)
+    img1 = open_frame(src1, shape, dtype, offset)
+
+    if img0.shape != img1.shape:
+        raise ImageSizeError("The images have diferent shapes")
+
+    lins, cols = img0.shape
+    hblock = lins // height
+    wblock = cols // width
+    if wblock < 2:
+        raise BlockError("block larger than image.")
+    if hblock < 2:
+        raise BlockError("block heigher than image.")
+
+    if isinstance(tile, int):
+        tile = (tile, tile)
+    tile_blocks = (max(tile[0] // height, 1), max(tile[1] // width, 1))
+
+    if compact:
+        gshape = (2, hblock, wblock)
+        gtype = displacement_dtype(width, height)
+    else:
+        gshape = (4, hblock, wblock)
+        gtype = int64
+
+    if output is None:
+        out = zeros(gshape, dtype=gtype)
+    else:
+        out = open_memmap(output, mode='w+', dtype=gtype, shape=gshape)
+        out[...] = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        jobs = [pool.submit(_match_tile, img0, img1, width, height, bounds,
+                            out, compact, metric)
+                for bounds in _tiles(hblock, wblock, tile_blocks)]
+        for job in jobs:
+            job.result()
+
+    if output is not None:
+        out.flush()
+    return out
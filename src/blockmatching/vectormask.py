@@ -55,11 +55,22 @@ Copyright [2019] [E. S. Pereira]
 import cv2
 from numpy import zeros_like
 
-def vectormask(image, x0, y0, x1, y1, color=(255, 255, 255), width=1):
+from .motionfield import MotionField, SparseMotion
+
+
+def vectormask(image, x0, y0=None, x1=None, y1=None, color=(255, 255, 255),
+               width=1):
     """
     Vector field image mask.
 
     Generate a mask with arrows representing the vector moviment.
+
+    The compact output of block matching, a MotionField or a SparseMotion,
+    can be given in place of the four grids, as in
+    ``vectormask(image, motion)``. In this case only the moving blocks are
+    drawn, with arrows from the initial position of the block to its
+    matching position.
+
     Parameters
     ----------
 
@@ -77,9 +88,23 @@ def vectormask(image, x0, y0, x1, y1, color=(255, 255, 255), width=1):
     :return 2d_array: array like input image.
     """
 
+    mask = zeros_like(image)
+
+    if isinstance(x0, (MotionField, SparseMotion)):
+        motion = x0.sparse()
+        xi, yi = motion.origins()
+        xf = xi + motion.dy
+        yf = yi + motion.dx
+        for k in range(len(motion)):
+            mask = cv2.arrowedLine(mask,
+                                   (int(yi[k]), int(xi[k])),
+                                   (int(yf[k]), int(xf[k])),
+                                   color, width
+                                   )
+        return mask
+
     sh = x0.shape
 
-    mask = zeros_like(image)
     for i in range(1, sh[0]):
         for j in range(1, sh[1]):
             mask = cv2.arrowedLine(mask,
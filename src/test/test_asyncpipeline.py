@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the asyncio pipelines."""
+import asyncio
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from numpy import array_equal
+
+from blockmatching import dlayers, async_dlayers, moving_squares
+from blockmatching import AsyncMotionPipeline
+
+
+class TestAsyncPipeline(unittest.TestCase):
+    "Test async_dlayers."
+
+    def test_same_results(self):
+        "Concurrent streams give the results of dlayers."
+        @dlayers(width=8, height=8)
+        def sync_source(seed):
+            yield from moving_squares(5, (96, 128), seed=seed)
+
+        @async_dlayers(width=8, height=8)
+        async def async_source(seed):
+            for frame in moving_squares(5, (96, 128), seed=seed):
+                await asyncio.sleep(0)
+                yield frame
+
+        async def collect(seed):
+            return [out async for out in async_source(seed)]
+
+        async def main():
+            return await asyncio.gather(collect(0), collect(1))
+
+        for seed, results in enumerate(asyncio.run(main())):
+            expected = list(sync_source(seed))
+            self.assertEqual(len(results), len(expected))
+            for res, exp in zip(results, expected):
+                self.assertTrue((res[1] == exp[1]).all())
+                self.assertTrue(array_equal(res[3], exp[3]))
+
+    def test_executor_threads(self):
+        "Streams run in several threads with the serial kernels."
+        @dlayers(width=8, height=8)
+        def sync_source(seed):
+            yield from moving_squares(4, (96, 128), seed=seed)
+
+        with ThreadPoolExecutor(4) as executor:
+            pipeline = AsyncMotionPipeline(executor=executor, width=8,
+                                           height=8)
+            self.assertFalse(pipeline.parallel)
+            self.assertEqual(pipeline.max_pending, 4)
+
+            async def collect(seed):
+                source = moving_squares(4, (96, 128), seed=seed)
+                return [out async for out in pipeline.stream(source)]
+
+            async def main():
+                return await asyncio.gather(*[collect(s) for s in range(4)])
+
+            streams = asyncio.run(main())
+
+        for seed, results in enumerate(streams):
+            expected = list(sync_source(seed))
+            self.assertEqual(len(results), len(expected))
+            for res, exp in zip(results, expected):
+                self.assertTrue(array_equal(res[3], exp[3]))
+
+    def test_budget_skips(self):
+        "The stale frames are skipped, the stream ends with its source."
+        frames = list(moving_squares(30, (240, 320)))
+
+        @async_dlayers(width=8, height=8, budget=0.001)
+        def sync_source():
+            yield from frames
+
+        @async_dlayers(width=8, height=8, budget=0.001)
+        async def async_source():
+            for frame in frames:
+                await asyncio.sleep(0)
+                yield frame
+
+        async def collect(source):
+            return [out async for out in source()]
+
+        for source in (sync_source, async_source):
+            results = asyncio.run(asyncio.wait_for(collect(source), 120))
+            reports = [out[-1] for out in results]
+            self.assertGreater(sum(r['skipped'] for r in reports), 0)
+            self.assertLess(len(results), len(frames))
+            self.assertEqual(reports[0]['frame'], 0)
+            for prev, report in zip(reports, reports[1:]):
+                self.assertEqual(report['frame'],
+                                 prev['frame'] + 1 + report['skipped'])
+            self.assertLess(reports[-1]['frame'], len(frames))
+
+    def test_cancel(self):
+        "A cancelled stream stops reading its source."
+        read = []
+
+        @async_dlayers(width=8, height=8)
+        def source():
+            for i, frame in enumerate(moving_squares(50, (96, 128))):
+                read.append(i)
+                yield frame
+
+        async def consume():
+            async for _ in source():
+                pass
+
+        async def main():
+            task = asyncio.ensure_future(consume())
+            while len(read) < 3:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(main())
+        self.assertLess(len(read), 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the batch processing."""
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import cv2
+from numpy import load, array_equal
+
+from blockmatching import moving_squares
+from blockmatching.batch import find_videos, process_video, main
+
+
+def interrupted(frames, stop):
+    "Frames of a run killed after stop frames."
+    for k, frame in enumerate(frames):
+        if k == stop:
+            raise KeyboardInterrupt
+        yield frame
+
+
+class TestBatch(unittest.TestCase):
+    "Test the batch processing."
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.frames = list(moving_squares(12, (96, 128)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_video(self, name):
+        path = os.path.join(self.tmp, 'videos', name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10,
+                              (128, 96), False)
+        for frame in self.frames:
+            out.write(frame)
+        out.release()
+        return path
+
+    def outputs(self, folder, kind):
+        arrays = {}
+        for name in sorted(os.listdir(folder)):
+            if name.startswith(kind):
+                with load(os.path.join(folder, name)) as data:
+                    for key in data:
+                        arrays.setdefault(key, []).append(data[key])
+        return arrays
+
+    def test_resume(self):
+        "A resumed video gives the outputs of an uninterrupted run."
+        whole = os.path.join(self.tmp, 'whole')
+        process_video('cam.avi', whole, width=8, height=8, chunk=4,
+                      frames=self.frames)
+
+        resumed = os.path.join(self.tmp, 'resumed')
+        with self.assertRaises(KeyboardInterrupt):
+            process_video('cam.avi', resumed, width=8, height=8, chunk=4,
+                          frames=interrupted(self.frames, 10))
+        progress = process_video('cam.avi', resumed, width=8, height=8,
+                                 chunk=4, frames=self.frames)
+        self.assertTrue(progress['done'])
+        self.assertEqual(progress['frames'], 12)
+        self.assertEqual(progress['processed'], 4)
+
+        for kind in ('motion', 'clusters'):
+            out0 = self.outputs(os.path.join(whole, 'cam'), kind)
+            out1 = self.outputs(os.path.join(resumed, 'cam'), kind)
+            self.assertEqual(sorted(out0), sorted(out1))
+            for key in out0:
+                for arr0, arr1 in zip(out0[key], out1[key]):
+                    self.assertTrue(array_equal(arr0, arr1))
+        frames = self.outputs(os.path.join(whole, 'cam'), 'motion')['frames']
+        self.assertEqual(sum(arr.size for arr in frames), 11)
+
+    def test_main(self):
+        "The console script processes a directory, then skips it."
+        self.write_video('a.avi')
+        self.write_video('b.avi')
+        videos = os.path.join(self.tmp, 'videos')
+        self.assertEqual(len(find_videos([videos])), 2)
+
+        out = os.path.join(self.tmp, 'out')
+        args = [videos, '-o', out, '--workers', '0', '--width', '8',
+                '--height', '8', '--render']
+        self.assertEqual(main(args), 0)
+        with open(os.path.join(out, 'a', 'progress.json')) as inp:
+            progress = json.load(inp)
+        self.assertTrue(progress['done'])
+        self.assertEqual(progress['frames'], 12)
+        self.assertTrue(os.path.exists(os.path.join(out, 'b',
+                                                    'render-00000.avi')))
+
+        self.assertEqual(main(args), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
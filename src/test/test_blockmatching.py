@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the block matching kernel schedule."""
+import unittest
+
+from numpy import zeros, uint8
+
+from blockmatching import block_matching, translated_pair
+from blockmatching import IncrementalMatcher, KernelCounters
+from blockmatching import dlayers, moving_squares, PipelineState
+
+
+class TestSchedule(unittest.TestCase):
+    "Test the flat work list of block_matching."
+
+    def test_chunksize(self):
+        "The chunk size does not change the vectors."
+        img0, img1 = translated_pair((90, 117), 2, -3)
+        mask = zeros((10, 13), dtype=uint8)
+        mask[::3, 1::2] = 1
+        ref = block_matching(img0, img1, 9, 9, mask=mask)
+        for chunksize in (0, 1, 7):
+            grids = block_matching(img0, img1, 9, 9, mask=mask,
+                                   chunksize=chunksize)
+            for grid, expected in zip(grids, ref):
+                self.assertTrue((grid == expected).all())
+
+    def test_edges(self):
+        "The last line and column are searched inside the image."
+        img0, img1 = translated_pair((94, 121), 0, 0, texture='smooth')
+        img1 = img1.copy()
+        img1[:-1, :-2] = img0[1:, 2:]
+        XP, YP, XD, YD = block_matching(img0, img1, 9, 9, edges=True)
+        self.assertTrue((XP[-1] + 9 <= 94).all())
+        self.assertTrue((YP[:, -1] + 9 <= 121).all())
+        self.assertTrue((XD - XP == -1).all())
+        self.assertTrue((YD - YP == -2).all())
+
+        XP, YP, XD, YD = block_matching(img0, img1, 9, 9)
+        self.assertTrue((XP[-1] == 0).all())
+
+    def test_pipeline_edges(self):
+        "The pipelines search the last line and column by default."
+        frames = list(moving_squares(3, (94, 121)))
+        img0, img1 = translated_pair((94, 121), 1, 2, texture='smooth')
+        ref = block_matching(img0, img1, 9, 9, edges=True)
+
+        matcher = IncrementalMatcher(9, 9, edges=True)
+        for _ in range(2):
+            for grid, expected in zip(matcher.match(img0, img1), ref):
+                self.assertTrue((grid == expected).all())
+
+        for edges in (True, False):
+            state = PipelineState()
+
+            @dlayers(width=9, height=9, state=state, edges=edges)
+            def source():
+                yield from frames
+
+            fgs = [out[1] for out in source()]
+            expected = block_matching(fgs[-2], fgs[-1], 9, 9, edges=edges)
+            for grid, refgrid in zip(state.motion, expected):
+                self.assertTrue((grid == refgrid).all())
+            self.assertEqual((state.motion[0][-1] != 0).all(), edges)
+
+
+class TestCounters(unittest.TestCase):
+    "Test the kernel counters."
+
+    def test_block_matching(self):
+        "The counters do not change the vectors and count the candidates."
+        img0, img1 = translated_pair((90, 117), 2, -3)
+        mask = zeros((10, 13), dtype=uint8)
+        mask[:6] = 1
+        counters = KernelCounters()
+        for parallel in (True, False):
+            grids = block_matching(img0, img1, 9, 9, mask=mask,
+                                   parallel=parallel, counters=counters)
+            ref = block_matching(img0, img1, 9, 9, mask=mask,
+                                 parallel=parallel)
+            for grid, expected in zip(grids, ref):
+                self.assertTrue((grid == expected).all())
+
+        # The last column is not searched without edges.
+        self.assertEqual(counters.calls, 2)
+        self.assertEqual(counters.searched, 2 * 6 * 12)
+        self.assertEqual(counters.skipped, 2 * (130 - 72))
+        self.assertTrue((counters.last['per_block'] == 81).all())
+        self.assertEqual(counters.candidates_per_block, 81)
+        self.assertEqual(counters.early_exit_fraction, 0)
+        self.assertEqual(counters.top(1), [((2, -3), 2 * 72)])
+
+    def test_incremental(self):
+        "The blocks reused by an incremental matcher are skipped."
+        img0, img1 = translated_pair((90, 117), 2, -3)
+        counters = KernelCounters()
+        matcher = IncrementalMatcher(9, 9, counters=counters)
+        matcher.match(img0, img1)
+        matcher.match(img0, img1)
+        self.assertEqual(counters.calls, 2)
+        self.assertEqual(counters.last['searched'], 0)
+        self.assertEqual(counters.skipped_fraction, (130 + 130 - 108) / 260)
+
+
+if __name__ == "__main__":
+    unittest.main()
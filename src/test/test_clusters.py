@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the array backed clusters."""
+import unittest
+
+from numpy import array, zeros, uint8
+
+from blockmatching import Clusters, layers, clustering, block_origins
+
+
+class TestClusters(unittest.TestCase):
+    "Test Clusters."
+
+    def setUp(self):
+        self.tops = [[(2, 3), (2, 9), (8, 3)], [(20, 21)]]
+        self.clusters = Clusters.from_tops(self.tops, [[1, -2], [0, 3]])
+
+    def test_arrays(self):
+        "Offsets, counts and bounding boxes."
+        clusters = self.clusters
+        self.assertEqual(list(clusters.offsets), [0, 3, 4])
+        self.assertEqual(list(clusters.counts), [3, 1])
+        self.assertEqual(clusters.bboxes.tolist(),
+                         [[2, 3, 8, 9], [20, 21, 20, 21]])
+        self.assertEqual(list(clusters.labels()), [0, 0, 0, 1])
+        self.assertEqual(clusters.displacement.shape, (2, 2))
+
+    def test_list_compatibility(self):
+        "The clusters behave as the list of lists of tuples."
+        self.assertEqual(len(self.clusters), 2)
+        self.assertEqual(list(self.clusters), self.tops)
+        self.assertEqual(self.clusters[-1], self.tops[-1])
+
+    def test_layers(self):
+        "Layers are the same from Clusters or from lists."
+        frame = (array(range(32 * 32)) % 251 + 1).reshape(32, 32)
+        frame = frame.astype(uint8)
+        for lyr0, lyr1 in zip(layers(frame, self.clusters, 4, 4, sigma=1),
+                              layers(frame, self.tops, 4, 4, sigma=1)):
+            self.assertTrue((lyr0 == lyr1).all())
+        self.assertEqual(layers(zeros((8, 8), uint8), [], 4, 4), [])
+
+
+class TestVelocityClustering(unittest.TestCase):
+    "Test the velocity-aware clustering."
+
+    def test_touching_objects(self):
+        "Touching blocks moving differently are separated."
+        dy = zeros((6, 8), dtype=int)
+        dx = zeros((6, 8), dtype=int)
+        dy[1:4, 1:4], dx[1:4, 1:4] = 2, 3
+        dy[1:4, 4:7], dx[1:4, 4:7] = -2, -3
+        dy[2, 2] = 1
+        XP, YP = block_origins(dy.shape, 8, 8)
+        U, V, clusters, meand = clustering(XP + dy, YP + dx, XP, YP,
+                                           tolerance=1)
+        self.assertEqual(list(clusters.counts), [9, 9])
+        self.assertEqual(meand.tolist(), [[2, 3], [-2, -3]])
+        self.assertEqual(U[2, 2], 2)
+        self.assertEqual(clusters.bboxes[1].tolist(), [12, 36, 28, 52])
+
+        U, V, clusters, meand = clustering(XP + dy, YP + dx, XP, YP,
+                                           tolerance=0)
+        self.assertEqual(list(clusters.counts), [8, 9, 1])
+
+    def test_diagonal_neighbors(self):
+        "Blocks touching by a corner are connected, as in the graph."
+        dy = zeros((6, 8), dtype=int)
+        for k in range(5):
+            dy[k, k + 1] = dy[k + 1, 5 - k] = 1
+        XP, YP = block_origins(dy.shape, 8, 8)
+        graph = clustering(XP + dy, YP, XP, YP, maxsizegraph=1000)
+        for tolerance in (0, 3):
+            U, V, clusters, meand = clustering(XP + dy, YP, XP, YP,
+                                               tolerance=tolerance)
+            self.assertEqual(list(clusters.counts), [10])
+            self.assertEqual(clusters, graph[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""
+Equivalence of the fast paths with reference implementations.
+
+Each engine and search mode of block matching is compared, block by block,
+with a plain numpy matcher that tests every candidate of the window in the
+same order as the kernels. The exact metrics must give the same vectors;
+zncc, whose costs are rounded differently, must choose a candidate with the
+reference cost of the best one. The clustering, layers and forecast shifts
+are compared with straightforward versions of the same rules.
+
+The failures list the blocks that diverge.
+"""
+import unittest
+from collections import deque
+
+from numpy import array, ones, zeros, zeros_like, int64, uint8, float64, clip
+from numpy import abs as npabs, indices, unique
+from numpy.random import RandomState
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.ndimage import gaussian_filter
+
+from blockmatching import block_matching, tiled_block_matching
+from blockmatching import IncrementalMatcher, KernelCounters, FrameCache
+from blockmatching import clustering, layers, Clusters, MotionField
+from blockmatching import translated_pair, moving_squares, textured_frame
+from blockmatching.forecast import _shift_add
+
+METRICS = ('clamped', 'sad', 'ssd', 'zncc')
+
+ZNCC_TOLERANCE = 1e-9
+
+
+def _costs(block, windows, metric):
+    "Cost of every candidate of a (h, w, height, width) stack of windows."
+    diff = windows - block
+    if metric == 'clamped':
+        return clip(diff, 0.0, 255.0).sum(axis=(2, 3))
+    if metric == 'sad':
+        return npabs(diff).sum(axis=(2, 3))
+    if metric == 'ssd':
+        return (diff * diff).sum(axis=(2, 3))
+    n = block.size
+    total = block.sum()
+    m0 = total / n
+    n0 = (block * block).sum() - total * total / n
+    sum1 = windows.sum(axis=(2, 3))
+    norm1 = (windows * windows).sum(axis=(2, 3)) - sum1 * sum1 / n
+    cross = (windows * block).sum(axis=(2, 3)) - m0 * sum1
+    denom = n0 * norm1
+    costs = ones(denom.shape)
+    valid = denom > 0
+    costs[valid] = 1.0 - cross[valid] / denom[valid] ** 0.5
+    return costs
+
+
+def reference_matching(img0, img1, width, height, metric='clamped',
+                       mask=None, edges=False, offset=(0, 0)):
+    """
+    Exhaustive block matching, one block at a time.
+
+    Return the (blocks, 4) output of the kernels and, for each block
+    searched, the first line and column of its window and the cost of each
+    candidate, in a dict indexed by the block.
+    """
+    img0 = img0.astype(float64)
+    img1 = img1.astype(float64)
+    lins, cols = img0.shape
+    hblock, wblock = lins // height, cols // width
+    hc, wc = height // 2, width // 2
+    if mask is None:
+        mask = zeros((hblock, wblock), dtype=uint8) + 1
+    if not edges:
+        mask = mask.copy()
+        mask[-1, :] = 0
+        mask[:, -1] = 0
+
+    out = zeros((hblock * wblock, 4), dtype=int64)
+    costs = {}
+    for i, j in zip(*mask.nonzero()):
+        ib0 = min(i * height + hc, lins - height)
+        jb0 = min(j * width + wc, cols - width)
+        ic = min(max(ib0 + offset[0], 0), lins - height)
+        jc = min(max(jb0 + offset[1], 0), cols - width)
+        i0, j0 = ic - hc, jc - wc
+        ki0, kj0 = max(0, -i0), max(0, -j0)
+        ki1 = min(height, lins - height - i0 + 1)
+        kj1 = min(width, cols - width - j0 + 1)
+        window = img1[i0 + ki0:i0 + ki1 + height - 1,
+                      j0 + kj0:j0 + kj1 + width - 1]
+        block = img0[ib0:ib0 + height, jb0:jb0 + width]
+        cost = _costs(block, sliding_window_view(window, (height, width)),
+                      metric)
+
+        # The center wins the ties, then the first candidate in raster
+        # order.
+        best = cost[hc - ki0, wc - kj0]
+        bi, bj = hc, wc
+        if cost.min() < best:
+            flat = cost.argmin()
+            bi = flat // cost.shape[1] + ki0
+            bj = flat % cost.shape[1] + kj0
+
+        k = i * wblock + j
+        out[k] = ib0, jb0, i0 + bi, j0 + bj
+        costs[k] = (i0 + ki0, j0 + kj0, cost)
+    return out, costs
+
+
+def divergence(out, expected, costs=None, wblock=1):
+    """
+    Blocks where out differs from the reference output expected.
+
+    With costs, the reference costs of reference_matching, a block is
+    accepted when the candidate chosen costs at most ZNCC_TOLERANCE more
+    than the reference choice.
+
+    Return a list of messages, one per block that diverges.
+    """
+    messages = []
+    for k in (out != expected).any(axis=1).nonzero()[0]:
+        if costs is not None and k in costs:
+            r0, c0, cost = costs[k]
+            got = cost[out[k, 2] - r0, out[k, 3] - c0]
+            best = cost[expected[k, 2] - r0, expected[k, 3] - c0]
+            if out[k, 0] == expected[k, 0] and \
+               out[k, 1] == expected[k, 1] and \
+               got <= best + ZNCC_TOLERANCE:
+                continue
+        moved = (int(out[k, 2] - out[k, 0]), int(out[k, 3] - out[k, 1]))
+        wanted = (int(expected[k, 2] - expected[k, 0]),
+                  int(expected[k, 3] - expected[k, 1]))
+        messages.append("block ({}, {}) at ({}, {}): {} instead of {}".format(
+            k // wblock, k % wblock, expected[k, 0], expected[k, 1], moved,
+            wanted))
+    return messages
+
+
+def _stack(grids):
+    "(blocks, 4) output from the four grids of block_matching."
+    return array([grid.ravel() for grid in grids]).T
+
+
+def _sequences():
+    "Frame pairs with known displacements, noise, flat regions and borders."
+    pairs = [('noise', translated_pair((61, 77), 2, -3)),
+             ('smooth+noise', translated_pair((64, 81), -1, 2,
+                                              texture='smooth', noise=4.0)),
+             ('waves', translated_pair((58, 70), 3, 1, texture='waves')),
+             ('flat', (textured_frame((45, 56), 'flat'),
+                       textured_frame((45, 56), 'flat')))]
+    frames = list(moving_squares(2, (66, 83), texture='noise'))
+    pairs.append(('squares', (frames[0], frames[1])))
+    return pairs
+
+
+class TestMatchingEquivalence(unittest.TestCase):
+    "Engines and search modes of block matching against the reference."
+
+    width = 7
+    height = 9
+
+    def assertEquivalent(self, out, img0, img1, metric, name, mask=None,
+                         edges=False, reference=None, offset=(0, 0)):
+        "Fail with the blocks that diverge from the reference."
+        expected, costs = reference or reference_matching(
+            img0, img1, self.width, self.height, metric, mask, edges, offset)
+        wblock = img0.shape[1] // self.width
+        messages = divergence(out, expected,
+                              costs if metric == 'zncc' else None, wblock)
+        if messages:
+            self.fail("{}, {}: {} blocks diverge\n{}".format(
+                name, metric, len(messages), "\n".join(messages[:10])))
+
+    def match(self, img0, img1, **options):
+        "Output of block_matching as a (blocks, 4) array."
+        return _stack(block_matching(img0, img1, self.width, self.height,
+                                     **options))
+
+    def test_engines(self):
+        "Serial and parallel kernels of every metric, with any chunk size."
+        for name, (img0, img1) in _sequences():
+            for metric in METRICS:
+                reference = reference_matching(img0, img1, self.width,
+                                               self.height, metric)
+                for parallel in (True, False):
+                    out = self.match(img0, img1, metric=metric,
+                                     parallel=parallel)
+                    self.assertEquivalent(out, img0, img1, metric, name,
+                                          reference=reference)
+                out = self.match(img0, img1, metric=metric, chunksize=1)
+                self.assertEquivalent(out, img0, img1, metric, name,
+                                      reference=reference)
+
+    def test_float_frames(self):
+        "Float frames give the vectors of the uint8 frames."
+        for name, (img0, img1) in _sequences():
+            for metric in METRICS:
+                out = self.match(img0.astype(float64), img1.astype(float64),
+                                 metric=metric)
+                self.assertEquivalent(out, img0, img1, metric, name)
+
+    def test_edges_and_mask(self):
+        "Border blocks and masked searches."
+        rng = RandomState(3)
+        for name, (img0, img1) in _sequences():
+            hblock = img0.shape[0] // self.height
+            wblock = img0.shape[1] // self.width
+            mask = (rng.uniform(size=(hblock, wblock)) > 0.4).astype(uint8)
+            for metric in ('clamped', 'zncc'):
+                out = self.match(img0, img1, metric=metric, edges=True)
+                self.assertEquivalent(out, img0, img1, metric, name,
+                                      edges=True)
+                out = self.match(img0, img1, metric=metric, mask=mask,
+                                 edges=True)
+                self.assertEquivalent(out, img0, img1, metric, name,
+                                      mask=mask, edges=True)
+
+    def test_successive_elimination(self):
+        "Successive elimination at each level, with and without cache."
+        for name, (img0, img1) in _sequences():
+            for metric in ('clamped', 'sad', 'ssd'):
+                reference = reference_matching(img0, img1, self.width,
+                                               self.height, metric,
+                                               edges=True)
+                for sea in (0, 1, 2):
+                    out = self.match(img0, img1, metric=metric, sea=sea,
+                                     edges=True)
+                    self.assertEquivalent(out, img0, img1, metric,
+                                          "{}, sea={}".format(name, sea),
+                                          reference=reference)
+            cache = FrameCache()
+            for _ in range(2):
+                out = self.match(img0, img1, metric='sad', sea=1,
+                                 edges=True, cache=cache, keys=(0, 1))
+                self.assertEquivalent(out, img0, img1, 'sad',
+                                      name + ", cache", edges=True)
+            self.assertGreater(cache.hits, 0)
+
+    def test_offset(self):
+        "Windows centered on a global shift, also out of the image."
+        for name, (img0, img1) in _sequences():
+            for offset in ((5, -8), (-30, 40), (100, 0)):
+                for metric in ('clamped', 'zncc'):
+                    out = self.match(img0, img1, metric=metric, edges=True,
+                                     offset=offset)
+                    self.assertEquivalent(out, img0, img1, metric,
+                                          "{}, offset={}".format(name, offset),
+                                          edges=True, offset=offset)
+                out = self.match(img0, img1, metric='sad', sea=1,
+                                 offset=offset)
+                self.assertEquivalent(out, img0, img1, 'sad',
+                                      "{}, sea=1, offset={}".format(name,
+                                                                    offset),
+                                      offset=offset)
+
+    def test_counters(self):
+        "The counting kernels choose the same vectors."
+        counters = KernelCounters()
+        for name, (img0, img1) in _sequences():
+            out = self.match(img0, img1, counters=counters)
+            self.assertEquivalent(out, img0, img1, 'clamped', name)
+            out = self.match(img0, img1, metric='sad', sea=1,
+                             counters=counters)
+            self.assertEquivalent(out, img0, img1, 'sad', name + ", sea=1")
+
+    def test_compact(self):
+        "Dense and sparse outputs hold the reference displacements."
+        for name, (img0, img1) in _sequences():
+            expected, _ = reference_matching(img0, img1, self.width,
+                                             self.height)
+            hblock = img0.shape[0] // self.height
+            dy = (expected[:, 2] - expected[:, 0]).reshape(hblock, -1)
+            dx = (expected[:, 3] - expected[:, 1]).reshape(hblock, -1)
+            motion = block_matching(img0, img1, self.width, self.height,
+                                    compact='dense')
+            self.assertTrue((motion.dy == dy).all(), name)
+            self.assertTrue((motion.dx == dx).all(), name)
+            sparse = block_matching(img0, img1, self.width, self.height,
+                                    compact='sparse').dense()
+            self.assertTrue((sparse.dy == dy).all(), name)
+            self.assertTrue((sparse.dx == dx).all(), name)
+
+    def test_incremental(self):
+        "Incremental matching, reusing the static blocks, and tiles."
+        frames = list(moving_squares(4, (66, 83), texture='smooth',
+                                     background=40))
+        matcher = IncrementalMatcher(self.width, self.height)
+        self.assertIsNone(matcher.update(frames[0]))
+        for k in range(1, len(frames)):
+            out = _stack(matcher.update(frames[k]))
+            self.assertEquivalent(out, frames[k - 1], frames[k], 'clamped',
+                                  "incremental, frame {}".format(k))
+
+        for name, (img0, img1) in _sequences():
+            for metric in ('clamped', 'zncc'):
+                out = tiled_block_matching(img0, img1, self.width,
+                                           self.height, tile=(20, 30),
+                                           workers=1, metric=metric)
+                out = _stack(out)
+                self.assertEquivalent(out, img0, img1, metric,
+                                      name + ", tiled")
+
+
+def reference_segments(dy, dx, tolerance):
+    """
+    Segments of the moving blocks by a flood fill over the 8 neighbors, as
+    the edges of the graph of clustering, whose displacements differ by at most tolerance, in the raster order of
+    their first block, with the most frequent displacement, the smallest on
+    ties.
+    """
+    lins, cols = dy.shape
+    label = zeros((lins, cols), dtype=int64) - 1
+    segments = []
+    for i in range(lins):
+        for j in range(cols):
+            if label[i, j] >= 0 or (dy[i, j] == 0 and dx[i, j] == 0):
+                continue
+            label[i, j] = len(segments)
+            members = []
+            queue = deque([(i, j)])
+            while queue:
+                a, b = queue.popleft()
+                members.append((a, b))
+                for na, nb in ((a + u, b + v) for u in (-1, 0, 1)
+                               for v in (-1, 0, 1) if u or v):
+                    if not (0 <= na < lins and 0 <= nb < cols):
+                        continue
+                    if label[na, nb] >= 0 or \
+                       (dy[na, nb] == 0 and dx[na, nb] == 0):
+                        continue
+                    if abs(dy[na, nb] - dy[a, b]) > tolerance or \
+                       abs(dx[na, nb] - dx[a, b]) > tolerance:
+                        continue
+                    label[na, nb] = label[i, j]
+                    queue.append((na, nb))
+            members.sort()
+            modes = []
+            for grid in (dy, dx):
+                values, counts = unique([grid[m] for m in members],
+                                        return_counts=True)
+                modes.append(float(values[counts.argmax()]))
+            segments.append((members, modes))
+    return segments
+
+
+class TestPipelineEquivalence(unittest.TestCase):
+    "Clustering, layers and forecast shifts against plain versions."
+
+    def fields(self):
+        "Motion grids with touching objects moving differently."
+        frames = list(moving_squares(
+            3, (90, 120), squares=[(20, 10, 27, 1, 2), (20, 37, 27, -1, 3),
+                                   (60, 70, 18, 2, -1)], texture='noise'))
+        for img0, img1 in zip(frames[:-1], frames[1:]):
+            yield block_matching(img0, img1, 9, 9)
+        rng = RandomState(5)
+        dy = rng.randint(-2, 3, (8, 11)) * (rng.uniform(size=(8, 11)) > 0.3)
+        dx = rng.randint(-2, 3, (8, 11))
+        XP, YP = indices((8, 11)) * 9 + 4
+        yield XP, YP, XP + dy, YP + dx
+
+    def test_velocity_segments(self):
+        "Union find segments equal a flood fill of the grids."
+        for XP, YP, XD, YD in self.fields():
+            for tolerance in (0, 1, 3):
+                dsx, dsy, clusters, _ = clustering(XD, YD, XP, YP,
+                                                   tolerance=tolerance)
+                segments = reference_segments(XD - XP, YD - YP, tolerance)
+                self.assertEqual(len(clusters), len(segments))
+                for k, (members, modes) in enumerate(segments):
+                    rows, cols = clusters.blocks(k)
+                    pos = [(XP[m], YP[m]) for m in members]
+                    self.assertEqual(list(zip(rows.tolist(), cols.tolist())),
+                                     pos, "segment {}".format(k))
+                    self.assertEqual(clusters.displacement[k].tolist(),
+                                     modes, "segment {}".format(k))
+                    for m in members:
+                        self.assertEqual((dsx[m], dsy[m]), tuple(modes))
+
+    def test_compact_clustering(self):
+        "Clustering of a motion field equals clustering of the grids."
+        for XP, YP, XD, YD in self.fields():
+            motion = MotionField(XD - XP, YD - YP, 9, 9)
+            for tolerance in (None, 1):
+                grids = clustering(XD, YD, XP, YP, maxsizegraph=1000,
+                                   tolerance=tolerance)
+                for field in (motion, motion.sparse()):
+                    compact = clustering(field, maxsizegraph=1000,
+                                         tolerance=tolerance)
+                    self.assertTrue((compact[0] == grids[0]).all())
+                    self.assertTrue((compact[1] == grids[1]).all())
+                    self.assertEqual(compact[2], grids[2])
+
+    def test_layers(self):
+        "Layers painted block by block."
+        frame = textured_frame((90, 120), 'smooth', seed=2)
+        clusters = Clusters.from_blocks(
+            [(array([-3, 4, 4, 85]), array([4, 4, 13, 116])),
+             (array([40, 49]), array([60, 60]))], zeros((2, 2)))
+        for k, layer in enumerate(layers(frame, clusters, 9, 7, sigma=3)):
+            tmp = zeros_like(frame)
+            for r, c in zip(*clusters.blocks(k)):
+                r0, c0 = max(r, 0), max(c, 0)
+                tmp[r0:r + 7, c0:c + 9] = frame[r0:r + 7, c0:c + 9]
+            dst = gaussian_filter(tmp, sigma=3)
+            expected = zeros_like(frame)
+            expected[dst != 0] = frame[dst != 0]
+            self.assertTrue((layer == expected).all(), "layer {}".format(k))
+
+    def test_shift_add(self):
+        "Shifted layers, pixel by pixel."
+        layer = textured_frame((13, 17), 'noise').astype(float64)
+        lin, col = indices(layer.shape)
+        for dsy in (-14, -5, 0, 3, 13):
+            for dsx in (-17, -2, 0, 6, 20):
+                out = zeros_like(layer)
+                _shift_add(out, layer, dsy, dsx)
+                expected = zeros_like(layer)
+                ii, jj = lin + dsy, col + dsx
+                inside = (ii >= 0) & (ii < 13) & (jj >= 0) & (jj < 17)
+                expected[ii[inside], jj[inside]] += layer[inside]
+                self.assertTrue((out == expected).all(), (dsy, dsx))
+
+
+if __name__ == "__main__":
+    unittest.main()
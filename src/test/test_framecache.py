@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the cache of the data derived from the frames."""
+import unittest
+
+from blockmatching import FrameCache, FrameRing, block_matching
+from blockmatching import moving_squares
+
+
+class TestFrameCache(unittest.TestCase):
+    "Test FrameCache."
+
+    def setUp(self):
+        self.frames = list(moving_squares(6, (90, 117)))
+
+    def check(self, pairs, **options):
+        for (img0, img1, keys), (ref0, ref1) in zip(
+                pairs, zip(self.frames[:-1], self.frames[1:])):
+            grids = block_matching(img0, img1, 9, 9, keys=keys, **options)
+            for grid, expected in zip(grids, block_matching(
+                    ref0, ref1, 9, 9, metric=options['metric'],
+                    sea=options.get('sea'))):
+                self.assertTrue((grid == expected).all())
+
+    def test_identity(self):
+        "Each frame is prepared once, found by identity."
+        cache = FrameCache(size=2)
+        pairs = [(img0, img1, None) for img0, img1 in
+                 zip(self.frames[:-1], self.frames[1:])]
+        self.check(pairs, metric='sad', sea=1, cache=cache)
+        self.assertEqual(cache.misses, 6)
+        self.assertEqual(cache.hits, 4)
+        self.assertEqual(len(cache), 2)
+
+        cache = FrameCache()
+        floats = [frame.astype(float) for frame in self.frames]
+        pairs = [(img0, img1, None) for img0, img1 in
+                 zip(floats[:-1], floats[1:])]
+        self.check(pairs, metric='zncc', cache=cache)
+        # The pixels of each frame and the integral images of img1.
+        self.assertEqual(cache.misses, 6 + 5)
+
+    def test_ring_keys(self):
+        "The slots of a FrameRing are found by sequence number."
+        cache = FrameCache()
+        ring = FrameRing(self.frames[0].shape, self.frames[0].dtype)
+        ring.push(self.frames[0])
+        for k in range(1, len(self.frames)):
+            ring.push(self.frames[k])
+            # The views of the ring are the same objects at each frame.
+            dy, dx = block_matching(ring.previous, ring.current, 9, 9,
+                                    compact='dense', metric='ssd', sea=0,
+                                    cache=cache, keys=(k - 1, k))
+            ref = block_matching(self.frames[k - 1], self.frames[k], 9, 9,
+                                 compact='dense', metric='ssd')
+            self.assertTrue((dy == ref.dy).all())
+            self.assertTrue((dx == ref.dx).all())
+        self.assertEqual(cache.hits, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the frame history."""
+import unittest
+
+from numpy import full, shares_memory, uint8
+from numpy.random import default_rng
+from scipy.signal import medfilt2d
+
+from blockmatching import FrameRing, dlayers, forecasting, moving_squares
+from blockmatching import BackgroundSubtractor
+from blockmatching.background import _median
+
+
+class TestFrameRing(unittest.TestCase):
+    "Test FrameRing."
+
+    def test_history(self):
+        "The ring keeps the last frames as read only views."
+        ring = FrameRing((4, 5), uint8, size=2)
+        self.assertIsNone(ring.previous)
+        slot = ring.next_slot()
+        slot[...] = 1
+        first = ring.commit()
+        self.assertTrue((ring.current == 1).all())
+        self.assertFalse(first.flags.writeable)
+
+        ring.push(full((4, 5), 2, dtype=uint8))
+        self.assertTrue((ring.previous == 1).all())
+        self.assertTrue((ring.current == 2).all())
+
+        # The third frame is written in the slot of the first one.
+        self.assertTrue(shares_memory(ring.next_slot(), first))
+        ring.push(full((4, 5), 3, dtype=uint8))
+        self.assertTrue((ring.previous == 2).all())
+        self.assertEqual(len(ring), 2)
+        with self.assertRaises(IndexError):
+            ring[2]
+
+
+class TestPipelineHistory(unittest.TestCase):
+    "The ring stays inside the pipelines."
+
+    def test_independent_foregrounds(self):
+        "The foregrounds yielded are not overwritten by the next frames."
+        frames = list(moving_squares(5, (96, 128)))
+
+        @dlayers(width=8, height=8)
+        def motion():
+            yield from frames
+
+        @forecasting(10, 1, width=8, height=8)
+        def forecast():
+            yield from frames
+
+        for source, index in ((motion, 1), (forecast, 2)):
+            copies = [out[index].copy() for out in source()]
+            kept = [out[index] for out in source()]
+            self.assertFalse(shares_memory(kept[1], kept[3]))
+            for fg, copy in zip(kept, copies):
+                self.assertTrue((fg == copy).all())
+
+    def test_foreground_slot(self):
+        "The foreground is filtered in the slot of the ring."
+        frames = list(moving_squares(4, (96, 128)))
+        ring = FrameRing(frames[0].shape, uint8)
+        model = BackgroundSubtractor(0.01, frames[0])
+        plain = BackgroundSubtractor(0.01, frames[0])
+        for frame in frames[1:]:
+            slot = ring.next_slot()
+            self.assertIs(model.foreground(frame, out=slot), slot)
+            current = ring.commit()
+            self.assertTrue((current == plain.foreground(frame)).all())
+
+    def test_median(self):
+        "The median of the slot is the one of medfilt2d, borders included."
+        rng = default_rng(0)
+        for shape in ((40, 50), (7, 9), (3, 3), (1, 5)):
+            image = (rng.random(shape) > 0.5).astype(uint8) * 255
+            for ksize in (1, 3, 5, 7):
+                out = full(shape, 7, dtype=uint8)
+                _median(image, ksize, out)
+                self.assertTrue((out == medfilt2d(image, ksize)).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
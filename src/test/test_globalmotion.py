@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the global motion estimation."""
+import unittest
+
+from blockmatching import global_motion, block_matching, translated_pair
+from blockmatching import FrameCache
+
+
+class TestGlobalMotion(unittest.TestCase):
+    "Test global_motion and the offset option of block_matching."
+
+    def test_shift(self):
+        "The shift of a translated frame is found."
+        for dy, dx in ((13, -17), (-25, 6), (0, 0)):
+            # Periodic textures, as 'waves', have no single shift.
+            for texture in ('noise', 'smooth'):
+                img0, img1 = translated_pair((160, 200), dy, dx,
+                                             texture=texture, noise=3.0)
+                gy, gx = global_motion(img0, img1)
+                self.assertLessEqual(abs(gy - dy), 2, texture)
+                self.assertLessEqual(abs(gx - dx), 2, texture)
+
+    def test_large_motion(self):
+        "Small blocks find a motion larger than the blocks."
+        img0, img1 = translated_pair((160, 200), 13, -17)
+        motion = block_matching(img0, img1, 9, 9, compact='dense')
+        self.assertFalse((motion.dy[:-3, 2:-1] == 13).any())
+        motion = block_matching(img0, img1, 9, 9, compact='dense',
+                                offset='auto')
+        self.assertTrue((motion.dy[:-3, 2:-1] == 13).all())
+        self.assertTrue((motion.dx[:-3, 2:-1] == -17).all())
+
+    def test_cache(self):
+        "The spectra of the frames are kept in the cache."
+        img0, img1 = translated_pair((160, 200), 5, 7, texture='smooth')
+        cache = FrameCache()
+        first = global_motion(img0, img1, cache=cache, keys=(0, 1))
+        self.assertEqual(global_motion(img0, img1, cache=cache, keys=(0, 1)),
+                         first)
+        self.assertEqual(cache.hits, 2)
+
+    def test_errors(self):
+        "Bad offsets and factors are refused."
+        img0, img1 = translated_pair((60, 80), 1, 1)
+        with self.assertRaises(ValueError):
+            block_matching(img0, img1, 9, 9, offset='global')
+        with self.assertRaises(ValueError):
+            global_motion(img0, img1, factor=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
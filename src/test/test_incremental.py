@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for incremental block matching."""
+import unittest
+
+from blockmatching import block_matching, IncrementalMatcher, moving_squares
+
+
+class TestIncremental(unittest.TestCase):
+    "Test incremental block matching."
+
+    def test_same_vectors(self):
+        "With tolerance 0 the vectors are the ones of the full search."
+        frames = list(moving_squares(6, (96, 128)))
+        matcher = IncrementalMatcher(8, 8)
+        self.assertIsNone(matcher.update(frames[0]))
+        for old, frame in zip(frames[:-1], frames[1:]):
+            grids = matcher.update(frame)
+            for inc, full in zip(grids, block_matching(old, frame, 8, 8)):
+                self.assertTrue((inc == full).all())
+
+    def test_static_blocks_skipped(self):
+        "Only the blocks around the moving squares are searched."
+        frames = list(moving_squares(4, (96, 128)))
+        matcher = IncrementalMatcher(8, 8)
+        for frame in frames:
+            matcher.update(frame)
+        self.assertLess(matcher.dirty.mean(), 0.5)
+        self.assertTrue(matcher.dirty.any())
+
+
+if __name__ == "__main__":
+    unittest.main()
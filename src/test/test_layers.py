@@ -5,7 +5,7 @@ import unittest
 import os
 
 import cv2
-from blockmatching import dlayers
+from blockmatching import dlayers, moving_squares
 
 CDIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -30,5 +30,17 @@ class TestLayers(unittest.TestCase):
         for bg, fg, mask, meand, layers in background(VIDEOTEST):
             pass
 
+    def test_mean_velocity(self):
+        "The mean velocities are a (n, 2) array, also on the first frame."
+        @dlayers(width=8, height=8)
+        def source():
+            yield from moving_squares(5, (96, 128))
+
+        shapes = [meand.shape for _, _, _, meand, _ in source()]
+        self.assertEqual(shapes[0], (0, 2))
+        for shape in shapes:
+            self.assertEqual(shape[1:], (2,))
+        self.assertGreater(max(shape[0] for shape in shapes), 0)
+
 if __name__ == "__main__":
     unittest.main()
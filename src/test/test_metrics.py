@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the cost functions of block matching."""
+import unittest
+
+from blockmatching import block_matching, translated_pair, moving_squares
+from blockmatching import KernelCounters
+
+
+class TestMetrics(unittest.TestCase):
+    "Test the metric option of block_matching."
+
+    def test_translation(self):
+        "Every metric finds a pure translation."
+        img0, img1 = translated_pair((90, 117), 2, -3)
+        for metric in ('clamped', 'sad', 'ssd', 'zncc'):
+            dy, dx = block_matching(img0, img1, 9, 9, compact='dense',
+                                    metric=metric)
+            self.assertTrue((dy[:-1, :-1] == 2).all(), metric)
+            self.assertTrue((dx[:-1, :-1] == -3).all(), metric)
+
+    def test_zncc_brightness(self):
+        "zncc is not affected by a change of brightness and contrast."
+        img0, img1 = translated_pair((90, 117), 1, 2, texture='smooth')
+        dy, dx = block_matching(img0, 0.5 * img1 + 60, 9, 9,
+                                compact='dense', metric='zncc')
+        self.assertTrue((dy[:-1, :-1] == 1).all())
+        self.assertTrue((dx[:-1, :-1] == 2).all())
+
+    def test_unknown_metric(self):
+        "Unknown metrics are refused."
+        img0, img1 = translated_pair((90, 117), 1, 2)
+        with self.assertRaises(ValueError):
+            block_matching(img0, img1, 9, 9, metric='mse')
+
+
+class TestSuccessiveElimination(unittest.TestCase):
+    "Test the sea option of block_matching."
+
+    def test_exact(self):
+        "The eliminated candidates do not change the vectors."
+        frames = list(moving_squares(2, (90, 117)))
+        pairs = [translated_pair((90, 117), 1, 4, texture='smooth',
+                                 noise=3), tuple(frames)]
+        for img0, img1 in pairs:
+            for metric in ('clamped', 'sad', 'ssd'):
+                ref = block_matching(img0, img1, 9, 9, metric=metric,
+                                     edges=True)
+                for sea in (0, 2):
+                    counters = KernelCounters()
+                    grids = block_matching(img0, img1, 9, 9, metric=metric,
+                                           edges=True, sea=sea,
+                                           counters=counters)
+                    for grid, expected in zip(grids, ref):
+                        self.assertTrue((grid == expected).all(), metric)
+                    self.assertGreater(counters.early_exits, 0)
+
+    def test_zncc(self):
+        "zncc has no elimination bound."
+        img0, img1 = translated_pair((90, 117), 2, -3)
+        with self.assertRaises(ValueError):
+            block_matching(img0, img1, 9, 9, metric='zncc', sea=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
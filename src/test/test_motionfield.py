@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for compact motion fields."""
+import random
+import unittest
+
+from numpy import zeros, uint8, int8, array_equal, pad
+from numpy.random import RandomState
+from blockmatching import block_matching, clustering, MotionField
+from blockmatching import vectormask
+
+
+def moving_square():
+    "Textured square displaced by two lines and one column."
+    rng = RandomState(0)
+    img0 = zeros((90, 90), dtype=uint8)
+    img0[20:50, 20:50] = rng.randint(50, 255, (30, 30))
+    img1 = zeros((90, 90), dtype=uint8)
+    img1[22:52, 21:51] = img0[20:50, 20:50]
+    return img0, img1
+
+
+def moving_frame():
+    "Texture of a 91 x 91 frame displaced by -2 lines and -1 column."
+    big = RandomState(1).randint(0, 255, (100, 100)).astype(uint8)
+    return big[3:94, 4:95], big[5:96, 5:96]
+
+
+class TestMotionField(unittest.TestCase):
+    "Test compact output of block matching."
+
+    def test_dense(self):
+        "Displacement grids match the four grids."
+        img0, img1 = moving_square()
+        XP, YP, XD, YD = block_matching(img0, img1, 6, 6)
+        motion = block_matching(img0, img1, 6, 6, compact='dense')
+        self.assertIsInstance(motion, MotionField)
+        self.assertEqual(motion.dy.dtype, int8)
+        self.assertTrue(((XD - XP) == motion.dy).all())
+        self.assertTrue(((YD - YP) == motion.dx).all())
+
+    def test_sparse(self):
+        "Sparse form round trips and clusters like the grids."
+        img0, img1 = moving_square()
+        XP, YP, XD, YD = block_matching(img0, img1, 6, 6)
+        motion = block_matching(img0, img1, 6, 6, compact='sparse')
+        dense = motion.dense()
+        self.assertTrue(((XD - XP) == dense.dy).all())
+        random.seed(0)
+        U0, V0, tops0, meand0 = clustering(XD, YD, XP, YP)
+        random.seed(0)
+        U1, V1, tops1, meand1 = clustering(motion)
+        self.assertTrue((U0 == U1).all())
+        self.assertTrue((V0 == V1).all())
+        self.assertEqual(tops0, tops1)
+
+    def test_edges(self):
+        "With edges the last blocks have the origins of the grids."
+        img0, img1 = moving_frame()
+        grids = block_matching(img0, img1, 6, 6, edges=True)
+        XP, YP, XD, YD = grids
+        self.assertEqual((XP[-1, -1], YP[-1, -1]), (85, 85))
+        motion = block_matching(img0, img1, 6, 6, compact='dense',
+                                edges=True)
+        self.assertEqual(motion.frame, img0.shape)
+        for res, exp in zip(motion.grids(), grids):
+            self.assertTrue(array_equal(res, exp))
+        sparse = motion.sparse()
+        self.assertEqual(len(sparse), XP.size)
+        x, y = sparse.origins()
+        self.assertTrue(array_equal(x, XP[sparse.rows, sparse.cols]))
+        self.assertTrue(array_equal(y, YP[sparse.rows, sparse.cols]))
+
+        random.seed(0)
+        expected = clustering(XD, YD, XP, YP)
+        for field in (motion, sparse, sparse.dense()):
+            random.seed(0)
+            U, V, tops, meand = clustering(field)
+            self.assertTrue((U == expected[0]).all())
+            self.assertTrue((V == expected[1]).all())
+            self.assertEqual(tops, expected[2])
+
+    def test_vectormask_edges(self):
+        "The arrows of the compact fields are the ones of the grids."
+        img0, img1 = moving_frame()
+        grids = block_matching(img0, img1, 6, 6, edges=True)
+        # Every block moves. The grids are drawn from their second line
+        # and column, a first one is added to draw all the blocks.
+        expected = vectormask(img1, *[pad(grid, ((1, 0), (1, 0)), 'edge')
+                                      for grid in grids])
+        self.assertTrue(expected[83:86, 83:86].any())
+        motion = block_matching(img0, img1, 6, 6, compact='sparse',
+                                edges=True)
+        for field in (motion, motion.dense()):
+            self.assertTrue(array_equal(vectormask(img1, field), expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the pipeline statistics."""
+import asyncio
+import unittest
+
+from numpy import array_equal, indices
+
+from blockmatching import PipelineStats, FrameTimer, moving_blocks
+from blockmatching import dlayers, async_dlayers, moving_squares
+
+
+def _frame(stats, **stages):
+    "Timer of a frame with the given stage times."
+    timer = stats.start()
+    timer.stages = dict(stages)
+    return timer
+
+
+class TestPipelineStats(unittest.TestCase):
+    "Test PipelineStats."
+
+    def test_percentiles(self):
+        "Percentiles and summary of known times and counts."
+        stats = PipelineStats()
+        for value in range(1, 101):
+            stats.finish(_frame(stats, matching=float(value)),
+                         moving_blocks=value, components=1)
+
+        self.assertEqual(stats.frames, 100)
+        p50, p90, p99 = stats.percentiles('matching')
+        self.assertAlmostEqual(p50, 50.5)
+        self.assertAlmostEqual(p90, 90.1)
+        self.assertAlmostEqual(p99, 99.01)
+        self.assertEqual(stats.percentiles('moving_blocks', (0, 100)),
+                         [1.0, 100.0])
+        self.assertEqual(stats.percentiles('queue_depth'), [None] * 3)
+
+        summary = stats.summary()
+        self.assertEqual(summary['matching']['count'], 100)
+        self.assertAlmostEqual(summary['matching']['mean'], 50.5)
+        self.assertEqual(summary['matching']['max'], 100.0)
+        self.assertEqual(summary['components']['p99'], 1.0)
+        self.assertNotIn('queue_depth', summary)
+        self.assertEqual(set(stats.stages()), {'matching', 'total'})
+
+    def test_window(self):
+        "Only the last frames of the window are kept."
+        stats = PipelineStats(window=10)
+        for value in range(1, 101):
+            stats.finish(_frame(stats, matching=float(value)),
+                         queue_depth=value)
+        self.assertEqual(stats.frames, 100)
+        self.assertEqual(stats.summary()['matching']['count'], 10)
+        self.assertAlmostEqual(stats.percentiles('matching', (50,))[0], 95.5)
+        self.assertEqual(stats.percentiles('queue_depth', (0,)), [91.0])
+
+        stats.reset()
+        self.assertEqual(stats.frames, 0)
+        self.assertEqual(stats.summary(), {})
+
+    def test_callback(self):
+        "The callback receives a record of each frame."
+        records = []
+        stats = PipelineStats(callback=records.append, queue=lambda: 3)
+        timer = stats.start()
+        timer.lap('background')
+        timer.lap('matching')
+        stats.finish(timer, moving_blocks=2)
+        stats.finish(stats.start(), queue_depth=0)
+
+        self.assertEqual([r['frame'] for r in records], [0, 1])
+        record = records[0]
+        self.assertEqual(set(record), {'frame', 'total', 'background',
+                                       'matching', 'moving_blocks',
+                                       'components', 'queue_depth'})
+        self.assertGreaterEqual(record['total'],
+                                record['background'] + record['matching'])
+        self.assertEqual(record['moving_blocks'], 2)
+        self.assertIsNone(record['components'])
+        # The depth given to finish wins over the queue of the runner.
+        self.assertEqual([r['queue_depth'] for r in records], [3, 0])
+
+    def test_interleaved(self):
+        "Frames started before the previous ones finish keep their index."
+        records = []
+        stats = PipelineStats(callback=records.append)
+        timers = [stats.start() for _ in range(3)]
+        stats.finish(timers[1])
+        timers.append(stats.start())
+        for timer in (timers[0], timers[3], timers[2]):
+            stats.finish(timer)
+        stats.finish(stats.start(index=10))
+        self.assertEqual([r['frame'] for r in records], [1, 0, 3, 2, 10])
+        self.assertEqual(stats.frames, 5)
+
+        stats.reset()
+        self.assertEqual(stats.start().index, 0)
+
+    def test_timer(self):
+        "The laps of a stage are added."
+        timer = FrameTimer(0)
+        timer.lap('matching')
+        first = timer.stages['matching']
+        timer.lap('matching')
+        self.assertGreaterEqual(timer.stages['matching'], first)
+        self.assertEqual(list(timer.stages), ['matching'])
+
+    def test_moving_blocks(self):
+        "Blocks whose final position differs from the initial one."
+        XP, YP = indices((3, 4))
+        self.assertEqual(moving_blocks(XP, YP, XP, YP), 0)
+        self.assertEqual(moving_blocks(XP, YP, XP + 1, YP), XP.size)
+
+
+class TestPipelineHooks(unittest.TestCase):
+    "Stats recorded by the pipelines on a known stream."
+
+    def test_dlayers(self):
+        "Stage times and counts of every frame."
+        stats = PipelineStats()
+
+        @dlayers(width=8, height=8, stats=stats)
+        def source():
+            yield from moving_squares(5, (96, 128))
+
+        @dlayers(width=8, height=8)
+        def plain():
+            yield from moving_squares(5, (96, 128))
+
+        results = list(source())
+        self.assertEqual(stats.frames, 5)
+        summary = stats.summary()
+        self.assertEqual(summary['total']['count'], 5)
+        self.assertEqual(summary['background']['count'], 5)
+        for stage in ('matching', 'clustering', 'layers', 'vectormask'):
+            self.assertEqual(summary[stage]['count'], 4)
+        self.assertEqual(summary['components']['count'], 4)
+        self.assertGreater(summary['moving_blocks']['max'], 0)
+        self.assertGreater(summary['components']['max'], 0)
+        # A plain generator has no queue.
+        self.assertNotIn('queue_depth', summary)
+
+        # Without stats the results are the same.
+        for res, exp in zip(results, plain()):
+            self.assertTrue(array_equal(res[3], exp[3]))
+
+    def test_budget_queue_depth(self):
+        "With a budget the frames that arrived while late are the queue."
+        stats = PipelineStats()
+
+        @dlayers(width=8, height=8, stats=stats, budget=1.0, period=1e-6)
+        def source():
+            yield from moving_squares(6, (96, 128))
+
+        results = list(source())
+        self.assertEqual(stats.summary()['queue_depth']['count'],
+                         len(results))
+        self.assertGreater(stats.summary()['queue_depth']['max'], 0)
+
+    def test_async_queue_depth(self):
+        "The async runner records the frames of its streams in flight."
+        stats = PipelineStats()
+
+        @async_dlayers(width=8, height=8, stats=stats, max_pending=1)
+        async def source(seed):
+            for frame in moving_squares(4, (96, 128), seed=seed):
+                await asyncio.sleep(0)
+                yield frame
+
+        async def collect(seed):
+            return [out async for out in source(seed)]
+
+        async def main():
+            return await asyncio.gather(collect(0), collect(1))
+
+        asyncio.run(main())
+        self.assertEqual(stats.frames, 8)
+        self.assertIsNotNone(stats.queue)
+        self.assertEqual(stats.summary()['queue_depth']['count'], 8)
+        self.assertGreater(stats.summary()['queue_depth']['max'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
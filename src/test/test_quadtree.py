@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the quadtree block matching."""
+import unittest
+
+from blockmatching import quadtree_matching, translated_pair, moving_squares
+
+
+class TestQuadTree(unittest.TestCase):
+    "Test quadtree_matching."
+
+    def test_translation(self):
+        "Large blocks are kept where the motion is uniform."
+        img0, img1 = translated_pair((128, 160), 2, -3)
+        tree = quadtree_matching(img0, img1, size=32, min_size=4)
+        dy, dx = tree.raster()
+        self.assertTrue((dy[32:-32, 32:-32] == 2).all())
+        self.assertTrue((dx[32:-32, 32:-32] == -3).all())
+        self.assertTrue((tree.heights[tree.level == 0] == 32).all())
+        self.assertGreater((tree.level == 0).sum(), 0)
+
+    def test_split_on_objects(self):
+        "Blocks are split on the moving squares only."
+        frames = list(moving_squares(2, (128, 160)))
+        tree = quadtree_matching(frames[0], frames[1], size=32, min_size=4)
+        self.assertLess(len(tree), (128 // 4) * (160 // 4) // 2)
+        self.assertEqual((tree.heights * tree.widths).sum(), 128 * 160)
+        dy, dx = quadtree_matching(frames[0], frames[1], size=32,
+                                   min_size=4, rasterize=True)
+        self.assertEqual(dy.shape, (128, 160))
+        self.assertTrue((dy != 0).any())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the memory mapped sources and sinks."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from numpy import array_equal, load, stack, save, zeros
+
+from blockmatching import MemmapSource, MemmapSink, save_raw
+from blockmatching import dlayers, block_matching, moving_squares
+
+
+class TestRawIO(unittest.TestCase):
+    "Test MemmapSource and MemmapSink."
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.frames = list(moving_squares(6, (96, 128)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_source(self):
+        "Raw and npy files give read only views of the frames."
+        raw = os.path.join(self.tmp, 'frames.raw')
+        self.assertEqual(save_raw(self.frames, raw), 6)
+        npy = os.path.join(self.tmp, 'frames.npy')
+        save(npy, stack(self.frames))
+
+        for source in (MemmapSource(raw, shape=(96, 128)),
+                       MemmapSource(npy)):
+            self.assertEqual(len(source), 6)
+            views = list(source)
+            for view, frame in zip(views, self.frames):
+                self.assertTrue(array_equal(view, frame))
+                self.assertFalse(view.flags.writeable)
+                self.assertFalse(view.flags.owndata)
+            img0, img1 = next(source.pairs(2))
+            self.assertTrue(array_equal(
+                block_matching(img0, img1, 8, 8)[2],
+                block_matching(self.frames[2], self.frames[3], 8, 8)[2]))
+
+    def test_sink(self):
+        "The outputs of dlayers over a source are written in the sink."
+        npy = os.path.join(self.tmp, 'frames.npy')
+        save(npy, stack(self.frames))
+        source = MemmapSource(npy)
+
+        @dlayers(width=8, height=8)
+        def mapped():
+            yield from source
+
+        @dlayers(width=8, height=8)
+        def listed():
+            yield from self.frames
+
+        out = os.path.join(self.tmp, 'out')
+        with MemmapSink(out, len(source)) as sink:
+            names = ('background', 'foreground', 'vectormask', None,
+                     'layers')
+            self.assertEqual(sink.drain(mapped(), names), 6)
+
+        foreground = load(os.path.join(out, 'foreground.npy'))
+        masks = load(os.path.join(out, 'vectormask.npy'))
+        nlayers = load(os.path.join(out, 'layers_count.npy'))
+        for k, (_, fg, mask, _, lyrs) in enumerate(listed()):
+            self.assertTrue(array_equal(foreground[k], fg))
+            if mask is not None:
+                self.assertTrue(array_equal(masks[k], mask))
+            self.assertEqual(nlayers[k], len(lyrs))
+
+    def test_sink_shapes(self):
+        "An output of another shape than its first frame is refused."
+        with MemmapSink(os.path.join(self.tmp, 'out'), 3) as sink:
+            sink.put(0, mask=zeros((4, 5)), layers=[zeros((4, 5))])
+            with self.assertRaisesRegex(ValueError,
+                                        r"mask .*\(1, 5\), .*\(4, 5\)"):
+                sink.put(1, mask=zeros((1, 5)))
+            with self.assertRaisesRegex(ValueError, "layers"):
+                sink.put(1, layers=[zeros((4, 5)), zeros((5,))])
+            with self.assertRaisesRegex(ValueError, "layers"):
+                sink.put(2, layers=[zeros((3, 5))])
+
+
+if __name__ == "__main__":
+    unittest.main()
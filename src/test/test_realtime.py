@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the deadline-aware real-time mode."""
+import unittest
+
+from numpy import zeros, array_equal
+
+from blockmatching import dlayers, forecasting, moving_squares
+from blockmatching import block_matching, translated_pair
+from blockmatching import LatencyBudget, FULL, INCREMENTAL, REDUCED, REUSE
+
+
+class Clock:
+    "Clock advanced by hand."
+
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+class Simulated(LatencyBudget):
+    "Budget whose searches take a given time of its clock."
+
+    costs_of = {FULL: 0.12, INCREMENTAL: 0.03, REDUCED: 0.01}
+    load = 1.0
+
+    def _search(self, img0, img1, level):
+        self.clock.t += self.costs_of[level] * self.load
+        return (zeros((2, 2)),) * 4, self.width, self.height
+
+
+def run(budget, frames, other=0.005):
+    "Reports of the frames processed by a simulated stream."
+    reports = []
+    for _ in range(frames):
+        if budget.stale():
+            continue
+        budget.begin()
+        budget.match(None, None)
+        budget.clock.t += other
+        reports.append(budget.finish())
+    return reports
+
+
+class TestLatencyBudget(unittest.TestCase):
+    "Test the degradation levels and the skipped frames."
+
+    def test_burst(self):
+        "A burst degrades the search, the full search comes back after it."
+        budget = Simulated(9, 9, 0.04, clock=Clock())
+        burst = run(budget, 60)
+        self.assertEqual(burst[0]['mode'], 'full')
+        self.assertGreater(sum(r['skipped'] for r in burst), 0)
+        late = [r for r in burst[10:] if r['latency'] > 0.04]
+        self.assertLess(len(late), len(burst[10:]) / 5.0)
+        self.assertIn(REDUCED, [r['level'] for r in burst])
+
+        budget.load = 0.2
+        calm = run(budget, 60)
+        self.assertEqual([r['level'] for r in calm[-10:]], [FULL] * 10)
+        self.assertEqual(sum(r['skipped'] for r in calm[-10:]), 0)
+        self.assertEqual(budget.frames + budget.skipped, 120)
+
+    def test_reuse(self):
+        "When no search fits, the last field is reused."
+        budget = Simulated(9, 9, 0.004, clock=Clock(), period=1.0)
+        reports = run(budget, 10, other=0.001)
+        self.assertEqual(reports[-1]['mode'], 'reuse')
+        self.assertEqual(reports[-1]['level'], REUSE)
+        self.assertEqual(budget.skipped, 0)
+
+    def test_reduced_grid(self):
+        "The reduced search gives the blocks of twice the size."
+        img0, img1 = translated_pair((144, 180), 2, -4, texture='smooth')
+        for edges in (False, True):
+            budget = LatencyBudget(9, 9, 1.0, edges=edges)
+            grids, width, height = budget._search(img0, img1, REDUCED)
+            self.assertEqual((width, height), (18, 18))
+            full = block_matching(img0, img1, 18, 18, edges=edges)
+            for grid, expected in zip(grids[:2], full[:2]):
+                self.assertTrue((grid == expected).all())
+            XP, YP, XD, YD = [grid[1:-1, 1:-1] for grid in grids]
+            self.assertTrue((XD - XP == 2).all())
+            self.assertTrue((YD - YP == -4).all())
+            self.assertTrue(((grids[2] >= 0) & (grids[2] <= 144 - 18)).all())
+
+    def test_max_level(self):
+        "The cheapest level can be limited."
+        budget = Simulated(9, 9, 0.004, clock=Clock(), period=1.0,
+                           max_level=INCREMENTAL)
+        levels = [r['level'] for r in run(budget, 10, other=0.001)]
+        self.assertLessEqual(max(levels), INCREMENTAL)
+
+
+class TestRealtimePipelines(unittest.TestCase):
+    "Test the budget option of dlayers and forecasting."
+
+    def frames(self):
+        return list(moving_squares(12, (72, 96), background=20))
+
+    def test_large_budget(self):
+        "With time to spare every frame is searched as without budget."
+        frames = self.frames()
+
+        @dlayers(width=9, height=9, sigma=3)
+        def plain():
+            yield from frames
+
+        @dlayers(width=9, height=9, sigma=3, budget=100.0)
+        def live():
+            yield from frames
+
+        count = 0
+        for ref, out in zip(plain(), live()):
+            report = out[-1]
+            self.assertEqual((report['mode'], report['skipped']),
+                             ('full', 0))
+            self.assertTrue((ref[1] == out[1]).all())
+            self.assertTrue(array_equal(ref[3], out[3]))
+            self.assertEqual(len(ref[4]), len(out[4]))
+            count += 1
+        self.assertEqual(count, len(frames))
+
+    def test_small_budget(self):
+        "A budget too small for the frames degrades them."
+        frames = self.frames()
+
+        # A long period: the frames are not skipped, whatever the time of
+        # the first ones.
+        @forecasting(1, 1, width=9, height=9, sigma=3, budget=1e-5,
+                     period=1e3)
+        def live():
+            yield from frames
+
+        outputs = list(live())
+        self.assertEqual(len(outputs), len(frames))
+        reports = [out[-1] for out in outputs]
+        self.assertEqual([r['frame'] for r in reports],
+                         list(range(len(frames))))
+        self.assertEqual([r['level'] for r in reports[1:4]],
+                         [FULL, INCREMENTAL, REDUCED])
+        self.assertEqual(reports[-1]['mode'], 'reuse')
+        self.assertTrue(all(out[1] is not None for out in outputs[1:]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the reduced resolution pipelines."""
+import unittest
+
+from numpy import asarray
+
+from blockmatching import dlayers, forecasting, moving_squares, downsample
+
+
+SQUARES = [(30, 30, 40, 4, 6), (100, 150, 40, -4, -6)]
+
+
+class TestScaling(unittest.TestCase):
+    "Test the scale option of the decorators."
+
+    def test_dlayers(self):
+        "Outputs have the input size and velocities in input pixels."
+        @dlayers(width=8, height=8, scale=0.5)
+        def source():
+            yield from moving_squares(4, (200, 256), squares=SQUARES)
+
+        # The same blocks, in input pixels, at full resolution.
+        @dlayers(width=16, height=16)
+        def full():
+            yield from moving_squares(4, (200, 256), squares=SQUARES)
+
+        found = 0
+        for (bg, fg, mask, meand, lyrs), ref in zip(source(), full()):
+            self.assertEqual(bg.shape, (200, 256))
+            self.assertEqual(fg.shape, (200, 256))
+            for lyr in lyrs:
+                self.assertEqual(lyr.shape, (200, 256))
+            meand = asarray(meand)
+            self.assertEqual(len(meand), len(ref[3]))
+            if len(meand):
+                # Half resolution displacements, scaled to input pixels,
+                # within the search window of the full resolution blocks.
+                self.assertTrue(((meand % 2) == 0).all())
+                self.assertLessEqual(abs(meand).max(), 8)
+            found += len(meand)
+        self.assertEqual(mask.shape, (200, 256))
+        self.assertGreater(found, 0)
+
+    def test_forecasting(self):
+        "The forecast has the input size."
+        @forecasting(2, 1, width=8, height=8, scale=0.5)
+        def source():
+            yield from moving_squares(3, (200, 256), squares=SQUARES)
+
+        for frame, forecast, fg, bg in source():
+            self.assertEqual(fg.shape, (200, 256))
+        self.assertEqual(forecast.shape, (200, 256))
+
+    def test_downsample(self):
+        "Scale 1 keeps the frame, other scales resize it."
+        frame = next(moving_squares(1, (200, 256)))
+        self.assertIs(downsample(frame, 1), frame)
+        self.assertEqual(downsample(frame, 0.25).shape, (50, 64))
+        with self.assertRaises(ValueError):
+            downsample(frame, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
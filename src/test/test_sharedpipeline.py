@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the multi-process pipeline."""
+import unittest
+
+from multiprocessing.shared_memory import SharedMemory
+
+from numpy import array_equal
+
+from blockmatching import dlayers, process_dlayers, moving_squares
+from blockmatching import PipelineState, PipelineStats, ProcessPipeline
+
+
+def run(decorator, frames):
+    "Foreground, vector mask and mean velocities of each frame."
+    @decorator
+    def source():
+        yield from frames
+
+    return [(fg.copy(), None if mask is None else mask.copy(), meand,
+             [layer.copy() for layer in lyrs])
+            for _, fg, mask, meand, lyrs in source()]
+
+
+class Recorder(ProcessPipeline):
+    """
+    Process pipeline that receives the result of a frame after the one of
+    the next frame, and records the slots reclaimed and the shared memory.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.held = None
+        self.swapped = 0
+        self.freed = []
+        self.names = []
+
+    def _start(self, frame, foreground):
+        super()._start(frame, foreground)
+        self.names = [ring.name for ring in (self._frames, self._fgs,
+                                             self._masks, self._lyrs)]
+
+    def _receive(self, msg):
+        if self.held is None and self._inflight > 1:
+            # Another frame is in the worker, its result comes first.
+            self.held = msg
+            return
+        super()._receive(msg)
+        if self.held is not None:
+            held, self.held = self.held, None
+            super()._receive(held)
+            self.swapped += 1
+
+    def _release(self, slot):
+        super()._release(slot)
+        if self._refs[slot] == 0:
+            self.freed.append(slot)
+
+
+class TestProcessPipeline(unittest.TestCase):
+    "Test process_dlayers."
+
+    def test_resumed_frames(self):
+        "Frame-parallel pieces of a stream give the results of dlayers."
+        frames = list(moving_squares(10, (96, 128)))
+        expected = run(dlayers(width=8, height=8, velocity_tolerance=1),
+                       frames)
+
+        state = PipelineState()
+        result = run(process_dlayers(width=8, height=8, workers=2,
+                                     velocity_tolerance=1, reorder=2,
+                                     state=state), frames[:6])
+        self.assertEqual(state.frames, 6)
+        state = PipelineState.from_bytes(state.to_bytes())
+        result += run(process_dlayers(width=8, height=8, workers=1,
+                                      velocity_tolerance=1, state=state),
+                      frames[6:])
+        self.assertEqual(state.frames, 10)
+
+        self.assertEqual(len(result), len(expected))
+        for out, ref in zip(result, expected):
+            for arr, refarr in zip(out, ref):
+                if refarr is None:
+                    self.assertIsNone(arr)
+                else:
+                    self.assertTrue(array_equal(arr, refarr))
+
+    def test_reorder_and_slots(self):
+        "Frames finished out of order are yielded in order, slots reused."
+        frames = list(moving_squares(10, (96, 128)))
+        expected = run(dlayers(width=8, height=8), frames)
+
+        records = []
+        pipeline = Recorder(width=8, height=8, workers=1, slots=4,
+                            max_layers=1, reorder=3,
+                            stats=PipelineStats(callback=records.append))
+        result = run(lambda func: lambda: pipeline.run(func()), frames)
+
+        self.assertGreater(pipeline.swapped, 0)
+        self.assertEqual([r['frame'] for r in records],
+                         list(range(len(frames))))
+        # Some frames have more layers than the shared slots.
+        self.assertGreater(max(len(ref[3]) for ref in expected), 1)
+        self.assertEqual(len(result), len(expected))
+        for out, ref in zip(result, expected):
+            self.assertEqual(out[1] is None, ref[1] is None)
+            for arr, refarr in zip(out, ref):
+                if refarr is not None:
+                    self.assertTrue(array_equal(arr, refarr))
+
+        # Every frame slot was reclaimed, and only 4 were used.
+        self.assertEqual(len(pipeline.freed), len(frames))
+        self.assertEqual(set(pipeline.freed), {0, 1, 2, 3})
+        self.assertEqual(pipeline._refs, [0] * 4)
+        self.assertEqual(sorted(pipeline._free_out), [0, 1, 2])
+        self.assertEqual(len(pipeline.names), 4)
+        for name in pipeline.names:
+            with self.assertRaises(FileNotFoundError):
+                SharedMemory(name=name)
+
+    def test_worker_error(self):
+        "A worker error is raised in the parent, the memory is freed."
+        frames = list(moving_squares(4, (96, 128)))
+        # Blocks larger than the frame fail in the worker.
+        pipeline = Recorder(width=200, height=8, workers=1)
+        with self.assertRaises(RuntimeError) as error:
+            list(pipeline.run(frames))
+        self.assertRegex(str(error.exception), "Worker failed on frame [12]")
+        self.assertIn("BlockError", str(error.exception))
+
+        self.assertEqual(len(pipeline.names), 4)
+        for name in pipeline.names:
+            with self.assertRaises(FileNotFoundError):
+                SharedMemory(name=name)
+        for proc in pipeline._procs:
+            self.assertFalse(proc.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
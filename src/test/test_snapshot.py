@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the warm-start snapshots."""
+import unittest
+
+from numpy import array_equal
+
+from blockmatching import dlayers, forecasting, moving_squares, PipelineState
+
+
+def run(decorator, frames, fg, extra):
+    "Run a pipeline, keeping copies of the foregrounds and of one output."
+    @decorator
+    def source():
+        yield from frames
+
+    return [(out[fg].copy(), out[extra]) for out in source()]
+
+
+class TestSnapshot(unittest.TestCase):
+    "Test PipelineState."
+
+    def check_resume(self, make, fg, extra):
+        frames = list(moving_squares(10, (96, 128)))
+        full = run(make(None), frames, fg, extra)
+
+        state = PipelineState()
+        run(make(state), frames[:5], fg, extra)
+        self.assertEqual(state.frames, 5)
+        restored = PipelineState.from_bytes(state.to_bytes())
+        resumed = run(make(restored), frames[5:], fg, extra)
+
+        self.assertEqual(restored.frames, 10)
+        for (fg0, v0), (fg1, v1) in zip(full[5:], resumed):
+            self.assertTrue(array_equal(fg0, fg1))
+            self.assertTrue(array_equal(v0, v1))
+
+    def test_dlayers(self):
+        "A resumed dlayers gives the results of the uninterrupted stream."
+        self.check_resume(lambda state: dlayers(width=8, height=8,
+                                                state=state), 1, 3)
+
+    def test_forecasting(self):
+        "A resumed forecasting gives the results of the whole stream."
+        self.check_resume(lambda state: forecasting(2, 1, width=8, height=8,
+                                                    state=state), 2, 1)
+
+    def test_not_ready(self):
+        "An empty state can not be saved."
+        with self.assertRaises(ValueError):
+            PipelineState().to_bytes()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for the kernels specialized on the block size."""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from blockmatching import block_matching, translated_pair, moving_squares
+from blockmatching import KernelCounters
+from blockmatching import specialized_kernel, specialized_sizes
+from blockmatching import MAX_SPECIALIZED, kernel_source
+from blockmatching.specialized import _module_name
+
+
+class TestSpecialized(unittest.TestCase):
+    "Test specialize option of block_matching."
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.env = mock.patch.dict(os.environ,
+                                  {'BLOCKMATCHING_KERNELS': cls.tmp.name})
+        cls.env.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.env.stop()
+        cls.tmp.cleanup()
+
+    def assertSame(self, img0, img1, width, height, **options):
+        "Specialized and generic kernels give the same grids."
+        generic = block_matching(img0, img1, width, height, **options)
+        fast = block_matching(img0, img1, width, height, specialize=True,
+                              **options)
+        for grid0, grid1 in zip(generic, fast):
+            self.assertTrue((grid0 == grid1).all(), options)
+
+    def test_same_vectors(self):
+        "Every metric, borders, offsets and float frames."
+        frames = list(moving_squares(2, (70, 90), background=30))
+        pairs = [translated_pair((70, 90), 2, -1, noise=3.0), frames]
+        for img0, img1 in pairs:
+            for metric in ('clamped', 'sad', 'ssd', 'zncc'):
+                self.assertSame(img0, img1, 7, 5, metric=metric,
+                                edges=True)
+            self.assertSame(img0, img1, 7, 5, offset=(3, -9))
+            self.assertSame(img0, img1, 7, 5, parallel=False)
+            self.assertSame(img0 / 2.0, img1 / 2.0, 7, 5, metric='sad')
+
+    def test_registry(self):
+        "Kernels are generated once, in the kernel directory."
+        kernel = specialized_kernel('sad', 5, 7)
+        self.assertIs(specialized_kernel('sad', 5, 7), kernel)
+        self.assertIn(('sad', 5, 7, True), specialized_sizes())
+        self.assertTrue(any(name.startswith('bm_sad_5x7_p')
+                            for name in os.listdir(self.tmp.name)))
+        self.assertIsNone(specialized_kernel('sad', MAX_SPECIALIZED + 1, 3))
+
+    def test_replaced_file(self):
+        "A file of the kernel with another content is written again."
+        source = kernel_source('ssd', 3, 4, parallel=False)
+        name = _module_name(source, 'ssd', 3, 4, False)
+        path = os.path.join(self.tmp.name, name + '.py')
+        with open(path, 'w') as module:
+            module.write(source[:len(source) // 2])
+        img0, img1 = translated_pair((40, 50), 1, -1)
+        self.assertIsNotNone(specialized_kernel('ssd', 3, 4, parallel=False))
+        with open(path) as module:
+            self.assertEqual(module.read(), source)
+        self.assertSame(img0, img1, 4, 3, metric='ssd', parallel=False)
+
+    def test_fallback(self):
+        "Counters and successive elimination use the generic kernels."
+        img0, img1 = translated_pair((70, 90), 1, 2)
+        counters = KernelCounters()
+        self.assertSame(img0, img1, 7, 5, metric='sad', sea=1)
+        block_matching(img0, img1, 7, 5, specialize=True, counters=counters)
+        self.assertGreater(counters.candidates, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
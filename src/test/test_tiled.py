@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- Codigin: UTF-8 -*-
+"""unit test for tiled block matching."""
+import os
+import tempfile
+import unittest
+
+from numpy import array, save
+from blockmatching import block_matching, tiled_block_matching, translated_pair
+
+
+class TestTiled(unittest.TestCase):
+    "Test out-of-core tiled block matching."
+
+    def test_same_grids(self):
+        "Tiles of memory mapped files give the grids of the full images."
+        img0, img1 = translated_pair((203, 251), 2, -1, texture='smooth')
+        full = array(block_matching(img0, img1, 7, 9))
+        with tempfile.TemporaryDirectory() as tmp:
+            save(os.path.join(tmp, 'img0.npy'), img0)
+            img1.tofile(os.path.join(tmp, 'img1.raw'))
+            out = tiled_block_matching(os.path.join(tmp, 'img0.npy'),
+                                       os.path.join(tmp, 'img1.raw'),
+                                       7, 9, tile=(40, 60),
+                                       output=os.path.join(tmp, 'out.npy'),
+                                       shape=img1.shape, workers=2)
+            self.assertTrue((out == full).all())
+            del out
+
+    def test_compact(self):
+        "Compact output holds the displacements."
+        img0, img1 = translated_pair((120, 130), 1, 2)
+        XP, YP, XD, YD = block_matching(img0, img1, 9, 9)
+        dy, dx = tiled_block_matching(img0, img1, 9, 9, tile=30,
+                                      compact='dense')
+        self.assertTrue((dy == XD - XP).all())
+        self.assertTrue((dx == YD - YP).all())
+
+
+if __name__ == "__main__":
+    unittest.main()